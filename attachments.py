@@ -0,0 +1,126 @@
+"""Вложения задач: файлы Telegram хранятся по file_id, а не подписью.
+
+Файл, фото или видео из сообщения превращается в словарь {kind, file_id,
+file_unique_id, name, url}; при сохранении задачи вложения пишутся в таблицу
+attachments и связываются с задачей через task_attachments (task_id,
+position). Повторная загрузка того же файла (file_unique_id одинаков для
+всех ботов и отправителей) не создает новую строку, а только обновляет
+file_id.
+
+Напоминание хранит id вложений. При отправке фото и видео уходят альбомами
+sendMediaGroup по MEDIA_GROUP_LIMIT штук, документы — отдельными альбомами
+документов (Telegram не смешивает их с фото), а ссылки и текст попадают в
+само сообщение напоминания.
+"""
+from telegram import MessageEntity
+
+# Telegram принимает в sendMediaGroup от 2 до 10 элементов
+MEDIA_GROUP_LIMIT = 10
+# Виды вложений, которые отправляются файлом; фото и видео можно смешивать в одном альбоме
+MEDIA_KINDS = ('photo', 'video', 'document')
+VISUAL_KINDS = ('photo', 'video')
+
+UPSERT_SQL = (
+    'INSERT INTO attachments (kind, file_id, file_unique_id, name, url) VALUES (?, ?, ?, ?, ?) '
+    'ON CONFLICT (file_unique_id) DO UPDATE SET file_id = excluded.file_id RETURNING id'
+)
+LINK_SQL = 'INSERT INTO task_attachments (task_id, position, attachment_id) VALUES (?, ?, ?)'
+FIELDS = ('id', 'kind', 'file_id', 'file_unique_id', 'name', 'url')
+# Сколько id подставлять в один запрос IN (...)
+CHUNK = 500
+
+
+def _item(kind, file=None, name=None, url=None):
+    return {
+        'kind': kind,
+        'file_id': file.file_id if file else None,
+        'file_unique_id': file.file_unique_id if file else None,
+        'name': name,
+        'url': url,
+    }
+
+
+def from_message(message):
+    """Вложение из сообщения Telegram или None, если распознать не удалось."""
+    if message.document:
+        return _item('document', message.document, name=message.document.file_name)
+    if message.photo:
+        # Telegram присылает несколько размеров фото; последний — самый большой
+        return _item('photo', message.photo[-1])
+    if message.video:
+        return _item('video', message.video, name=message.video.file_name)
+    if message.text and message.entities:
+        # Смещения сущностей считаются в единицах UTF-16: текст ссылки вырезает parse_entities
+        links = message.parse_entities([MessageEntity.URL, MessageEntity.TEXT_LINK])
+        for entity, text in links.items():
+            return _item('url', url=entity.url if entity.type == MessageEntity.TEXT_LINK else text)
+    if message.text:
+        return _item('text', name=message.text)
+    return None
+
+
+def label(item):
+    """Подпись вложения для текста сообщения. Строки — подписи из старых версий бота — возвращаются как есть."""
+    if isinstance(item, str):
+        return item
+    kind = item['kind']
+    if kind == 'document':
+        return f"📄 Файл: {item['name']}"
+    if kind == 'photo':
+        return '🖼️ Фото'
+    if kind == 'video':
+        return '📹 Видео'
+    if kind == 'url':
+        return f"🔗 Ссылка: {item['url']}"
+    return item['name']
+
+
+def store(conn, task_id, items):
+    """Сохраняет вложения задачи task_id; возвращает их же с полем id. Вызывается внутри транзакции."""
+    stored = []
+    for position, item in enumerate(items):
+        if isinstance(item, str):
+            stored.append(item)
+            continue
+        attachment_id = conn.execute(
+            UPSERT_SQL, (item['kind'], item['file_id'], item['file_unique_id'], item['name'], item['url'])
+        ).fetchone()[0]
+        conn.execute(LINK_SQL, (task_id, position, attachment_id))
+        stored.append({**item, 'id': attachment_id})
+    return stored
+
+
+def refs(items):
+    """Ссылки на вложения для хранения в напоминании: id, а старые подписи — строками."""
+    return [item if isinstance(item, str) else item['id'] for item in items]
+
+
+def load(db, ids):
+    """Словарь id -> вложение для набора id."""
+    ids = list(ids)
+    found = {}
+    for start in range(0, len(ids), CHUNK):
+        chunk = ids[start:start + CHUNK]
+        marks = ','.join('?' * len(chunk))
+        for row in db.query(f"SELECT {', '.join(FIELDS)} FROM attachments WHERE id IN ({marks})", chunk):
+            found[row[0]] = dict(zip(FIELDS, row))
+    return found
+
+
+def resolve(references, loaded):
+    """Вложения по ссылкам из напоминания; удаленные из базы пропускаются."""
+    return [ref if isinstance(ref, str) else loaded[ref] for ref in references
+            if isinstance(ref, str) or ref in loaded]
+
+
+def split(items):
+    """Делит вложения на (подписи для текста сообщения, альбомы для sendMediaGroup)."""
+    labels = [label(item) for item in items if isinstance(item, str) or item['kind'] not in MEDIA_KINDS]
+    visual = [item for item in items if not isinstance(item, str) and item['kind'] in VISUAL_KINDS]
+    documents = [item for item in items if not isinstance(item, str) and item['kind'] == 'document']
+    albums = [
+        group[start:start + MEDIA_GROUP_LIMIT]
+        for group in (visual, documents)
+        for start in range(0, len(group), MEDIA_GROUP_LIMIT)
+    ]
+    return labels, albums
@@ -0,0 +1,132 @@
+"""Нагрузочный тест доступа к tasks.db: N параллельных писателей и M читателей.
+
+Сравнивает прежнюю схему (одно общее соединение на все потоки) с пулом
+соединений из db.py в режиме WAL.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_db --writers 4 --readers 8 --seconds 5
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from db import Database
+
+TASKS_DDL = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    topic TEXT,
+    description TEXT,
+    attachments TEXT,
+    time TEXT
+)
+'''
+INSERT_SQL = 'INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)'
+SELECT_SQL = 'SELECT topic, description, attachments, time FROM tasks WHERE user_id = ? ORDER BY time'
+
+
+class SharedConnection:
+    """Прежняя схема: глобальные conn/cursor, общий для всех потоков."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.cursor = self.conn.cursor()
+        self.lock = threading.Lock()
+
+    def write(self, params):
+        # Без блокировки потоки перемешивают execute/fetchall на одном курсоре
+        with self.lock:
+            self.cursor.execute(INSERT_SQL, params)
+            self.conn.commit()
+
+    def read(self, user_id):
+        with self.lock:
+            self.cursor.execute(SELECT_SQL, (user_id,))
+            return self.cursor.fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class PooledConnection:
+    def __init__(self, path):
+        self.db = Database(path)
+
+    def write(self, params):
+        self.db.execute(INSERT_SQL, params)
+
+    def read(self, user_id):
+        return self.db.query(SELECT_SQL, (user_id,))
+
+    def close(self):
+        self.db.close_all()
+
+
+def seed(path, users, rows_per_user):
+    conn = sqlite3.connect(path)
+    conn.execute(TASKS_DDL)
+    conn.executemany(INSERT_SQL, (
+        (user_id, f'Задача {i}', '', '', f'2030-01-01 {i % 24:02d}:00')
+        for user_id in range(users) for i in range(rows_per_user)
+    ))
+    conn.commit()
+    conn.close()
+
+
+def run(backend, writers, readers, seconds, users):
+    counts = {'write': 0, 'read': 0}
+    counts_lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker(kind):
+        rnd = random.Random()
+        done = 0
+        while not stop.is_set():
+            user_id = rnd.randrange(users)
+            if kind == 'write':
+                backend.write((user_id, 'Бенчмарк', '', '', '2030-01-01 12:00'))
+            else:
+                backend.read(user_id)
+            done += 1
+        with counts_lock:
+            counts[kind] += done
+
+    threads = [threading.Thread(target=worker, args=('write',)) for _ in range(writers)]
+    threads += [threading.Thread(target=worker, args=('read',)) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    backend.close()
+    return counts['write'] / seconds, counts['read'] / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='путь к копии tasks.db (по умолчанию временный файл)')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rows-per-user', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, factory in (('shared', SharedConnection), ('pooled', PooledConnection)):
+            path = args.db or os.path.join(tmp, f'{name}.db')
+            if not args.db:
+                seed(path, args.users, args.rows_per_user)
+            writes, reads = run(factory(path), args.writers, args.readers, args.seconds, args.users)
+            print(f'{name:>7}: writers={args.writers} readers={args.readers} '
+                  f'writes/s={writes:,.0f} reads/s={reads:,.0f}')
+
+
+if __name__ == '__main__':
+    main()
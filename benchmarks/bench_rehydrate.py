@@ -0,0 +1,93 @@
+"""Время холодного старта: восстановление ожидающих напоминаний из tasks.db.
+
+Заполняет временную базу --reminders напоминаниями --users пользователей на
+ближайшие --horizon секунд и --missed напоминаниями, которые наступили, пока
+бот был остановлен. Измеряет:
+  - полный проход по всем ожидающим напоминаниям по индексу idx_reminders_due_at
+    keyset-страницами (столько стоило бы восстановить их все в памяти);
+  - старт ReminderDispatcher: время до отправки пропущенных напоминаний первой
+    пачкой и размер окна, которое диспетчер держит в памяти после старта.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_rehydrate --reminders 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from db import Database
+from migrations import migrate
+from reminders import INSERT_SQL, MAX_ID, ReminderDispatcher
+
+PAGE_SQL = 'SELECT due_at, id FROM reminders WHERE (due_at, id) > (?, ?) ORDER BY due_at, id LIMIT ?'
+
+
+def read_all(db, page=10000):
+    """Читает все ожидающие напоминания страницами; возвращает их число."""
+    total, key = 0, (-MAX_ID, 0)
+    while True:
+        rows = db.query(PAGE_SQL, (*key, page))
+        total += len(rows)
+        if len(rows) < page:
+            return total
+        key = rows[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reminders', type=int, default=100_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--missed', type=int, default=1000, help='наступивших, пока бот был остановлен')
+    parser.add_argument('--horizon', type=int, default=86400, help='разброс due_at в будущее, с')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'tasks.db'))
+        migrate(db)
+        now = int(time.time())
+        rnd = random.Random(1)
+        db.executemany(INSERT_SQL, (
+            (rnd.randrange(args.users), f'Задача {i}', '[]', now + 60 + rnd.randrange(args.horizon))
+            for i in range(args.reminders)
+        ))
+        db.executemany(INSERT_SQL, (
+            (rnd.randrange(args.users), f'Пропущено {i}', '[]', now - rnd.randrange(1, 3600))
+            for i in range(args.missed)
+        ))
+
+        started = time.perf_counter()
+        pending = read_all(db)
+        read_time = time.perf_counter() - started
+
+        fired = threading.Event()
+        first_batch = []
+
+        def fire_batch(rows):
+            if not first_batch:
+                first_batch.append((time.perf_counter(), len(rows)))
+                fired.set()
+
+        dispatcher = ReminderDispatcher(db, fire_batch)
+        started = time.perf_counter()
+        dispatcher.start()
+        fired.wait(30)
+        loaded = dispatcher.loaded
+        dispatcher.stop()
+        db.close_all()
+
+    print(f'ожидающих напоминаний: {pending:,} ({args.users:,} пользователей)', file=sys.stderr)
+    print(f'полный проход по индексу: {read_time * 1000:,.0f} мс', file=sys.stderr)
+    if first_batch:
+        fired_at, count = first_batch[0]
+        print(f'старт диспетчера: пропущенные ({count:,}) отправлены через {(fired_at - started) * 1000:,.1f} мс, '
+              f'в памяти {loaded:,}', file=sys.stderr)
+    else:
+        print('старт диспетчера: пропущенные не отправлены за 30 с', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
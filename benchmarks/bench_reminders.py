@@ -0,0 +1,76 @@
+"""Холодный старт и точность срабатывания диспетчера напоминаний.
+
+Заполняет временную базу N напоминаниями (часть — в ближайшие секунды,
+остальные — в пределах horizon), запускает ReminderDispatcher и измеряет
+время загрузки первого окна, размер окна в памяти и отставание срабатывания
+(фактическое время минус due_at).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_reminders --reminders 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from db import Database
+from migrations import migrate
+from reminders import INSERT_SQL, ReminderDispatcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reminders', type=int, default=100_000)
+    parser.add_argument('--horizon', type=int, default=30 * 86400, help='разброс due_at в будущее, с')
+    parser.add_argument('--soon', type=int, default=2000, help='сколько напоминаний наступит в ближайшие секунды')
+    parser.add_argument('--seconds', type=int, default=5, help='сколько секунд наблюдать срабатывания')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'tasks.db'))
+        migrate(db)
+        rnd = random.Random(1)
+        now = int(time.time())
+        db.executemany(INSERT_SQL, (
+            (rnd.randrange(100_000), f'Задача {i}', '[]', now + 600 + rnd.randrange(args.horizon))
+            for i in range(args.reminders - args.soon)
+        ))
+        # Ближайшие напоминания вставляем последними, чтобы заполнение базы их не задержало
+        now = int(time.time())
+        db.executemany(INSERT_SQL, (
+            (rnd.randrange(100_000), f'Скоро {i}', '[]', now + 2 + rnd.randrange(args.seconds - 1))
+            for i in range(args.soon)
+        ))
+
+        skews = []
+        first_batch = threading.Event()
+
+        def fire_batch(rows):
+            fired_at = time.time()
+            skews.extend(fired_at - row[4] for row in rows)
+            first_batch.set()
+
+        dispatcher = ReminderDispatcher(db, fire_batch)
+        started = time.perf_counter()
+        with dispatcher._cond:
+            dispatcher._refill(time.time())
+        cold_start = time.perf_counter() - started
+        loaded = dispatcher.loaded
+        dispatcher.start()
+        time.sleep(args.seconds + 2)
+        dispatcher.stop()
+        db.close_all()
+
+    skews.sort()
+    print(f'напоминаний в базе: {args.reminders:,}')
+    print(f'загрузка первого окна: {cold_start * 1000:,.1f} мс, в памяти: {loaded:,}')
+    if skews:
+        p = lambda q: skews[min(len(skews) - 1, int(q * len(skews)))]
+        print(f'срабатываний: {len(skews):,} из {args.soon:,}; отставание p50={p(0.5) * 1000:.0f} мс '
+              f'p99={p(0.99) * 1000:.0f} мс max={skews[-1] * 1000:.0f} мс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Стоимость выбора обработчика нажатия: регулярные выражения против таблицы маршрутов.
+
+Прежний вариант — список CallbackQueryHandler с регулярными выражениями на
+каждое состояние: python-telegram-bot проверяет их по очереди через re.match.
+Новый — CallbackRouter: один обработчик на состояние, проверка и поиск по
+словарю. Обе схемы строятся из одного набора callback_data (шаблоны прежнего
+ConversationHandler_states), после чего каждое нажатие прогоняется через обе.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_router --rounds 200000
+"""
+import argparse
+import random
+import re
+import time
+
+from router import CallbackRouter
+
+# Шаблоны CallbackQueryHandler по состояниям до перехода на таблицу маршрутов
+REGEX_STATES = {
+    'CHOOSING': [
+        '^(main_add_task|main_weekly_schedule|main_quick_note|main_settings|main_subscriptions|main_my_tasks|back)$',
+        '^tasks_(after|before):',
+    ],
+    'ADD_TASK_ATTACHMENTS': ['^(attach_yes|attach_no|back|done)$'],
+    'TYPING_TIME': ['^back$'],
+    'CONFIRMING': ['^(conf_confirm_yes|conf_confirm_no|conf_back)$'],
+    'SELECT_DAY': [
+        '^(schedule_add|schedule_reset|schedule_Monday|schedule_Tuesday|schedule_Wednesday|schedule_Thursday'
+        '|schedule_Friday|schedule_Saturday|schedule_Sunday|back)$',
+    ],
+    'SELECT_TIME_OF_DAY': ['^(schedule_time_Morning|schedule_time_Afternoon|schedule_time_Evening|back)$'],
+    'SET_SCHEDULE_HOUR': ['^back$'],
+    'SAVE_SCHEDULE': ['^schedule_save$', '^schedule_reset$', '^back$'],
+    'QUICK_NOTE': ['^back$'],
+    'QUICK_NOTE_CONFIRM': ['^(quick_confirm_yes|quick_confirm_no|back)$'],
+    'QUICK_NOTE_TIME': ['^back$'],
+    'SETTINGS': ['^(set_notification_time|back)$'],
+    'SET_NOTIFICATION_TIME': ['^back$'],
+    'SUBSCRIPTION_CATEGORY': ['^(subscription_Sport|subscription_Study|subscription_Rest|subscription_Personal|back)$'],
+    'VIEW_SUBSCRIPTION': ['^(view_subscriptions|add_subscription|back)$'],
+    'ADD_SUBSCRIPTION': ['^back$'],
+}
+
+PAGE_CALLBACKS = ['tasks_after:2024-05-01 10:00:1234', 'tasks_before:2024-05-01 10:00:1234']
+
+
+def handler(update, context, *args):
+    return args
+
+
+def literals(pattern):
+    """Точные callback_data из шаблона вида ^(a|b|c)$."""
+    match = re.fullmatch(r'\^\(?([\w|]+)\)?\$', pattern)
+    return match.group(1).split('|') if match else []
+
+
+def build():
+    """Возвращает (шаблоны по состояниям, роутер, список нажатий (состояние, callback_data))."""
+    compiled = {state: [re.compile(p) for p in patterns] for state, patterns in REGEX_STATES.items()}
+    router = CallbackRouter()
+    presses = []
+    for state, patterns in REGEX_STATES.items():
+        for pattern in patterns:
+            for data in literals(pattern):
+                router.add((state,), data, handler)
+                presses.append((state, data))
+    router.add_prefix(('CHOOSING',), 'tasks_after', handler, 'after')
+    router.add_prefix(('CHOOSING',), 'tasks_before', handler, 'before')
+    presses += [('CHOOSING', data) for data in PAGE_CALLBACKS]
+    return compiled, router, presses
+
+
+def dispatch_regex(compiled, state, data):
+    # Так CallbackQueryHandler.check_update перебирает обработчики состояния
+    for index, pattern in enumerate(compiled[state]):
+        if pattern.match(data):
+            return index
+    return None
+
+
+def dispatch_router(router, state, data):
+    # check_update (router.matches), затем route_callback (router.resolve)
+    if router.matches(state, data):
+        return router.resolve(state, data)
+    return None
+
+
+def measure(fn, presses):
+    start = time.perf_counter()
+    for state, data in presses:
+        fn(state, data)
+    return (time.perf_counter() - start) / len(presses) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=200_000, help='число нажатий в замере')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    compiled, router, presses = build()
+    for state, data in presses:
+        assert dispatch_regex(compiled, state, data) is not None, (state, data)
+        assert dispatch_router(router, state, data) is not None, (state, data)
+
+    rng = random.Random(args.seed)
+    workload = [rng.choice(presses) for _ in range(args.rounds)]
+    regex_ns = measure(lambda state, data: dispatch_regex(compiled, state, data), workload)
+    router_ns = measure(lambda state, data: dispatch_router(router, state, data), workload)
+
+    print(f"Различных кнопок: {len(presses)}, нажатий в замере: {args.rounds}")
+    print(f"{'регулярные выражения':<22} {regex_ns:8.0f} нс/нажатие")
+    print(f"{'таблица маршрутов':<22} {router_ns:8.0f} нс/нажатие")
+    print(f"Ускорение: {regex_ns / router_ns:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
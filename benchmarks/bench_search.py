@@ -0,0 +1,126 @@
+"""Поиск по задачам: FTS5 (search.py) против LIKE-сканирования строк пользователя.
+
+Заполняет временную базу (схема из migrations.py, индексы поддерживаются
+триггерами) --users пользователями по --notes заметок и --subscriptions
+подписок из словаря псевдослов с распределением Ципфа, затем для каждого
+пользователя выполняет --queries запросов трех видов: частое слово, редкое
+слово и слово, которого нет. Для каждого вида печатаются p50/p95/max времени
+запроса через search.search() (bm25, сниппеты, подписки) и через
+LIKE '%слово%' по topic/description с тем же LIMIT.
+
+LIKE останавливается на первых LIMIT совпадениях, поэтому частые слова
+находит быстро, но редкие и отсутствующие требуют прочитать все строки
+пользователя; время FTS определяется числом совпадений, а не числом заметок.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_search --users 5 --notes 20000 --queries 200
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from db import Database
+from migrations import migrate
+from search import LIKE_TASKS_SQL, LIMIT, search
+
+SYLLABLES = ('ка', 'ро', 'ми', 'на', 'ле', 'то', 'су', 'ве', 'ла', 'до', 'пи', 'ры', 'зо', 'ше', 'ту', 'го')
+INSERT_TASK_SQL = 'INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)'
+INSERT_SUBSCRIPTION_SQL = 'INSERT INTO subscriptions (user_id, category, content) VALUES (?, ?, ?)'
+
+
+def vocabulary(rnd, size):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))))
+    return sorted(words)
+
+
+def seed(db, rnd, words, users, notes, subscriptions):
+    """Заполняет базу; возвращает (строк в секунду с триггерами FTS, частые слова, редкие слова)."""
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+
+    def text(length):
+        return ' '.join(rnd.choices(words, cum_weights=cum_weights, k=length))
+
+    started = time.perf_counter()
+    for user_id in range(users):
+        tasks = [
+            (user_id, text(rnd.randint(2, 6)) if i % 3 else 'Быстрая заметка', text(rnd.randint(5, 30)), '',
+             f'2030-{i % 12 + 1:02d}-{i % 28 + 1:02d} {i % 24:02d}:00')
+            for i in range(notes)
+        ]
+        db.executemany(INSERT_TASK_SQL, tasks)
+        db.executemany(INSERT_SUBSCRIPTION_SQL, [
+            (user_id, rnd.choice(('Sport', 'News', 'Music')), text(rnd.randint(5, 15))) for _ in range(subscriptions)
+        ])
+    rate = users * (notes + subscriptions) / (time.perf_counter() - started)
+    return rate, words[:20], words[len(words) // 2:]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (
+        statistics.median(samples) * 1000,
+        samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        samples[-1] * 1000,
+    )
+
+
+def run(args):
+    rnd = random.Random(args.seed)
+    db = Database(args.db)
+    migrate(db)
+    words = vocabulary(rnd, args.vocabulary)
+    rate, frequent, rare = seed(db, rnd, words, args.users, args.notes, args.subscriptions)
+    print(f"заполнено: {args.users} × ({args.notes:,} заметок + {args.subscriptions:,} подписок), "
+          f"{rate:,.0f} строк/с с триггерами FTS", file=sys.stderr)
+
+    kinds = {
+        'частое слово': frequent,
+        'редкое слово': rare,
+        'нет совпадений': ['щщщъ'],
+    }
+    print(f"{'запрос':<16}{'FTS p50':>10}{'p95':>9}{'max':>9}{'LIKE p50':>11}{'p95':>9}{'max':>9}  мс",
+          file=sys.stderr)
+    for kind, pool in kinds.items():
+        fts, like = [], []
+        for _ in range(args.queries):
+            user_id = rnd.randrange(args.users)
+            word = rnd.choice(pool)
+            started = time.perf_counter()
+            search(db, user_id, word)
+            fts.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            db.query(LIKE_TASKS_SQL, (user_id, f'%{word}%', f'%{word}%', LIMIT))
+            like.append(time.perf_counter() - started)
+        print(f"{kind:<16}" + ''.join(f'{value:9.2f}' for value in percentiles(fts)) + '  '
+              + ''.join(f'{value:9.2f}' for value in percentiles(like)), file=sys.stderr)
+    db.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--notes', type=int, default=20000, help='заметок на пользователя')
+    parser.add_argument('--subscriptions', type=int, default=2000, help='подписок на пользователя')
+    parser.add_argument('--vocabulary', type=int, default=20000, help='размер словаря')
+    parser.add_argument('--queries', type=int, default=200, help='запросов каждого вида')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help='файл базы (по умолчанию временный)')
+    args = parser.parse_args()
+
+    if args.db:
+        run(args)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        args.db = os.path.join(tmp, 'tasks.db')
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
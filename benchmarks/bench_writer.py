@@ -0,0 +1,67 @@
+"""Пропускная способность вставок: коммит на каждую запись против группового коммита.
+
+Каждый из N потоков имитирует обработчик: вставляет строку и ждёт, пока она
+станет долговечной, прежде чем перейти к следующей.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_writer --threads 32 --writes 200
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from db import Database
+from migrations import migrate
+from writer import WriteBehindWriter
+
+INSERT_SQL = 'INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)'
+
+
+def run(threads, writes, write_fn):
+    def worker(user_id):
+        for i in range(writes):
+            write_fn((user_id, f'Задача {i}', '', '', '2030-01-01 12:00'))
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return threads * writes / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--writes', type=int, default=200, help='записей на поток')
+    parser.add_argument('--synchronous', default='NORMAL', help='PRAGMA synchronous (FULL — fsync на каждый коммит)')
+    parser.add_argument('--max-delay', type=float, default=0.002, help='наибольшее окно накопления пакета, с')
+    parser.add_argument('--dir', help='каталог для временных баз (по умолчанию системный tmp)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        pragmas = [('journal_mode', 'WAL'), ('synchronous', args.synchronous), ('busy_timeout', 30000)]
+
+        db = Database(os.path.join(tmp, 'direct.db'), pragmas=pragmas)
+        migrate(db)
+        direct = run(args.threads, args.writes, lambda params: db.execute(INSERT_SQL, params))
+        db.close_all()
+
+        db = Database(os.path.join(tmp, 'grouped.db'), pragmas=pragmas)
+        migrate(db)
+        writer = WriteBehindWriter(db, max_delay=args.max_delay)
+        writer.start()
+        grouped = run(args.threads, args.writes, lambda params: writer.write(INSERT_SQL, params).result())
+        writer.stop()
+        db.close_all()
+
+    print(f'коммит на запись: {direct:,.0f} записей/с')
+    print(f'групповой коммит: {grouped:,.0f} записей/с '
+          f'({grouped / direct:.1f}x, {writer.jobs / max(writer.batches, 1):.1f} записей на транзакцию)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Локальная проверка режима нескольких процессов (cluster.py) на общем файле SQLite.
+
+Запускает --workers процессов ClusterWorker над одной временной базой (или
+--db). Родитель с темпом --rate в секунду кладет в update_inbox обновления
+--users пользователей (как это делает лидер при long polling или вебхук) и
+добавляет напоминания напрямую в таблицу reminders (как schedule_notification
+в процессе, который не лидер); еще --reminders напоминаний засеяны заранее.
+Процесс-«обработчик» только записывает, кто и когда обработал обновление, а
+лидер отправляет напоминания в заглушку, записывающую срабатывания.
+
+Через --kill-after секунд лидер убивается SIGKILL: аренда должна перейти к
+другому процессу, а его слоты — разойтись по оставшимся. Через --join-after
+секунд запускается новый процесс, и слоты перебалансируются еще раз.
+
+В отчете: время перехода аренды, потерянные и повторно обработанные
+обновления, пользователи, обработанные несколькими процессами (ожидаемо
+только для переехавших слотов), пропущенные и повторные напоминания. Код
+возврата 1 при повторах или пропущенных напоминаниях.
+
+Запуск из корня репозитория:
+    python -m benchmarks.cluster_soak --workers 3 --duration 40 --kill-after 15 --join-after 25
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cluster import ClusterWorker, UpdateInbox
+from db import Database
+from migrations import migrate
+from reminders import INSERT_SQL, ReminderDispatcher
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SOAK_TABLES = (
+    'CREATE TABLE IF NOT EXISTS soak_processed (update_id INTEGER, user_id INTEGER, worker_id TEXT, at REAL)',
+    'CREATE TABLE IF NOT EXISTS soak_fired (reminder_id INTEGER, worker_id TEXT, at REAL)',
+)
+
+# После окончания подачи ждем столько секунд, прежде чем подводить итог
+GRACE = 8
+
+
+async def run_worker(args):
+    """Один процесс кластера: записывает обработанные обновления, у лидера — срабатывания напоминаний."""
+    db = Database(args.db)
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='db')
+    loop = asyncio.get_running_loop()
+
+    def fire_batch(rows):
+        db.executemany(
+            'INSERT INTO soak_fired (reminder_id, worker_id, at) VALUES (?, ?, ?)',
+            [(row[0], args.worker, time.time()) for row in rows]
+        )
+
+    dispatcher = ReminderDispatcher(db, fire_batch, poll_interval=0.5)
+
+    async def on_update(data):
+        await loop.run_in_executor(executor, db.execute,
+                                   'INSERT INTO soak_processed (update_id, user_id, worker_id, at) VALUES (?, ?, ?, ?)',
+                                   (data['update_id'], data['message']['from']['id'], args.worker, time.time()))
+
+    async def on_slots(slots):
+        pass
+
+    async def on_leader(is_leader):
+        if is_leader:
+            dispatcher.start()
+        else:
+            await asyncio.to_thread(dispatcher.stop)
+
+    worker = ClusterWorker(db, args.worker, on_update, on_slots, on_slots, on_leader,
+                           executor=executor, heartbeat=args.heartbeat, ttl=args.ttl)
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    await worker.run(stop)
+    await worker.leave()
+    await asyncio.to_thread(dispatcher.stop)
+    executor.shutdown()
+    db.close_all()
+
+
+def spawn(args, name):
+    return subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.cluster_soak', '--worker', name, '--db', args.db,
+         '--heartbeat', str(args.heartbeat), '--ttl', str(args.ttl)],
+        cwd=ROOT,
+    )
+
+
+def leader(db):
+    row = db.query_one('SELECT holder, expires_at FROM leases WHERE name = ?', ('leader',))
+    return row[0] if row and row[1] >= time.time() else None
+
+
+def run(args):
+    rnd = random.Random(args.seed)
+    db = Database(args.db)
+    migrate(db)
+    for sql in SOAK_TABLES:
+        db.execute(sql)
+    inbox = UpdateInbox(db)
+
+    start = time.time()
+    end = start + args.duration
+    db.executemany(INSERT_SQL, (
+        (rnd.randrange(args.users), f'Напоминание {i}', '[]', int(start + 2 + rnd.random() * (args.duration - 2)))
+        for i in range(args.reminders)
+    ))
+
+    processes = {f'w{i}': spawn(args, f'w{i}') for i in range(args.workers)}
+    events = []
+    killed = None
+    joined = False
+    failover_started = None
+    failover = None
+    update_id = 0
+    live_reminders = 0
+    next_at = time.time()
+    while time.time() < end:
+        now = time.time()
+        holder = leader(db)
+        if killed is None and now >= start + args.kill_after and holder in processes:
+            processes[holder].send_signal(signal.SIGKILL)
+            killed, failover_started = holder, now
+            events.append(f'{now - start:6.1f} с: убит лидер {holder}')
+        if failover_started and failover is None and holder not in (None, killed):
+            failover = now - failover_started
+            events.append(f'{now - start:6.1f} с: лидер {holder}, переход аренды {failover:.1f} с')
+        if args.join_after and not joined and now >= start + args.join_after:
+            name = f'w{len(processes)}'
+            processes[name] = spawn(args, name)
+            joined = True
+            events.append(f'{now - start:6.1f} с: запущен {name}')
+
+        for _ in range(max(1, int(args.rate / 10))):
+            update_id += 1
+            inbox.put({'update_id': update_id, 'message': {'from': {'id': rnd.randrange(args.users)}}})
+        if rnd.random() < 0.5:
+            db.execute(INSERT_SQL, (rnd.randrange(args.users), 'Новое напоминание', '[]', int(now) + 1 + rnd.randrange(5)))
+            live_reminders += 1
+        next_at += 0.1
+        time.sleep(max(0.0, next_at - time.time()))
+
+    time.sleep(GRACE)
+    for process in processes.values():
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    for process in processes.values():
+        process.wait(30)
+
+    processed = db.query('SELECT update_id, COUNT(*) FROM soak_processed GROUP BY update_id')
+    handled = {update for update, _ in processed}
+    pending = db.query_one('SELECT COUNT(*) FROM update_inbox')[0]
+    users = db.query('SELECT user_id, COUNT(DISTINCT worker_id) FROM soak_processed GROUP BY user_id')
+    fired = db.query('SELECT reminder_id, COUNT(*) FROM soak_fired GROUP BY reminder_id')
+    missed = db.query_one('SELECT COUNT(*) FROM reminders WHERE due_at <= ?', (end,))[0]
+    fired_ids = {reminder_id for reminder_id, _ in fired}
+    db.close_all()
+
+    return {
+        'config': vars(args),
+        'events': events,
+        'failover_seconds': round(failover, 2) if failover is not None else None,
+        'updates_sent': update_id,
+        'updates_processed': len(handled),
+        'updates_duplicated': sum(1 for _, count in processed if count > 1),
+        'updates_pending': pending,
+        # Забраны убитым процессом, но не обработаны
+        'updates_lost': update_id - len(handled) - pending,
+        'users_moved': sum(1 for _, workers in users if workers > 1),
+        'users_total': len(users),
+        'reminders_expected': args.reminders + live_reminders,
+        'reminders_fired': len(fired_ids),
+        'reminders_duplicated': sum(1 for _, count in fired if count > 1),
+        'reminders_missed': missed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--duration', type=int, default=40, help='длительность подачи обновлений, с')
+    parser.add_argument('--rate', type=int, default=200, help='обновлений в секунду')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--reminders', type=int, default=2000, help='напоминаний, засеянных до старта')
+    parser.add_argument('--kill-after', type=float, default=15, help='через сколько секунд убить лидера')
+    parser.add_argument('--join-after', type=float, default=25, help='через сколько секунд добавить процесс; 0 — нет')
+    parser.add_argument('--heartbeat', type=float, default=1.0)
+    parser.add_argument('--ttl', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help='файл базы (по умолчанию временный)')
+    parser.add_argument('--report', help='сохранить отчет JSON в файл')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        asyncio.run(run_worker(args))
+        return
+
+    if args.db:
+        report = run(args)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            args.db = os.path.join(tmp, 'tasks.db')
+            report = run(args)
+
+    for event in report['events']:
+        print(event, file=sys.stderr)
+    print(f"обновлений: отправлено {report['updates_sent']:,}, обработано {report['updates_processed']:,}, "
+          f"повторно {report['updates_duplicated']}, в очереди {report['updates_pending']}, "
+          f"потеряно с убитым процессом {report['updates_lost']}", file=sys.stderr)
+    print(f"пользователей: {report['users_total']:,}, обработаны несколькими процессами: {report['users_moved']:,}",
+          file=sys.stderr)
+    print(f"напоминаний: ожидалось {report['reminders_expected']:,}, сработало {report['reminders_fired']:,}, "
+          f"повторно {report['reminders_duplicated']}, пропущено {report['reminders_missed']}", file=sys.stderr)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    failed = report['updates_duplicated'] or report['reminders_duplicated'] or report['reminders_missed']
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
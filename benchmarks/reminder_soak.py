@@ -0,0 +1,239 @@
+"""Нагрузочный прогон диспетчера напоминаний.
+
+Заполняет базу (временную или --db) отложенными напоминаниями: --outstanding
+штук с due_at за пределами прогона (нагрузка на индекс и окно диспетчера) и
+--due штук, наступающих за --duration секунд прогона. Форма наступающих
+задается --shape: uniform — равномерно, bursty — пачками по --burst-size
+напоминаний на одну секунду, round — все на «круглые» отметки каждые
+--round-every секунд (3600 — начала часов). Во время прогона новые
+напоминания добавляются так же, как это делает schedule_notification: запись
+через WriteBehindWriter и ReminderDispatcher.add(), с темпом --live-rate в
+секунду.
+
+Напоминания уходят в отправитель-заглушку (--send-ms на одно сообщение
+имитирует исходящий лимит). Раз в секунду снимаются RSS, загрузка CPU и
+размер окна в памяти. В отчете — отставание срабатывания (факт минус due_at),
+пропущенные и повторные срабатывания; --report сохраняет его в JSON для
+сравнения прогонов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.reminder_soak --outstanding 1000000 --due 50000 --shape bursty --report soak.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from db import Database
+from migrations import migrate
+from reminders import INSERT_SQL, ReminderDispatcher, add_reminder
+from writer import WriteBehindWriter
+
+# После окончания прогона ждем столько секунд, прежде чем считать напоминание пропущенным
+GRACE = 5
+
+
+def due_times(shape, count, start, duration, burst_size, round_every, rnd):
+    """Моменты наступления count напоминаний в окне [start, start + duration)."""
+    if shape == 'uniform':
+        return [start + rnd.randrange(duration) for _ in range(count)]
+    if shape == 'bursty':
+        bursts = max(1, count // burst_size)
+        seconds = [start + rnd.randrange(duration) for _ in range(bursts)]
+        return [seconds[i % bursts] for i in range(count)]
+    if shape == 'round':
+        first = (start + round_every - 1) // round_every * round_every
+        marks = list(range(first, start + duration, round_every)) or [start]
+        return [marks[i % len(marks)] for i in range(count)]
+    raise ValueError(f'Неизвестная форма распределения: {shape}')
+
+
+def rss_kb():
+    """Текущий RSS процесса в КБ (только Linux) или None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return None
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def run(args, path):
+    rnd = random.Random(args.seed)
+    db = Database(path)
+    migrate(db)
+
+    started = time.perf_counter()
+    now = int(time.time())
+    outstanding_from = now + args.duration + GRACE + 60
+    db.executemany(INSERT_SQL, (
+        (rnd.randrange(args.users), f'Отложенное {i}', '[]', outstanding_from + rnd.randrange(args.horizon))
+        for i in range(args.outstanding)
+    ))
+    # Наступающие в прогоне вставляем последними, чтобы заполнение базы их не задержало
+    start = int(time.time()) + 2
+    db.executemany(INSERT_SQL, (
+        (rnd.randrange(args.users), f'Напоминание {i}', '[]', due_at)
+        for i, due_at in enumerate(due_times(
+            args.shape, args.due, start, args.duration, args.burst_size, args.round_every, rnd))
+    ))
+    seed_seconds = time.perf_counter() - started
+    end = start + args.duration
+
+    lock = threading.Lock()
+    skews = []
+    fired_ids = set()
+    duplicates = 0
+
+    def fire_batch(rows):
+        nonlocal duplicates
+        fired_at = time.time()
+        send = args.send_ms / 1000
+        with lock:
+            for i, row in enumerate(rows):
+                if row[0] in fired_ids:
+                    duplicates += 1
+                fired_ids.add(row[0])
+                # Заглушка «отправляет» пачку по очереди: i-е сообщение уходит после i предыдущих
+                skews.append(fired_at + (i + 1) * send - row[4])
+        if send:
+            time.sleep(len(rows) * send)
+
+    writer = WriteBehindWriter(db)
+    writer.start()
+    dispatcher = ReminderDispatcher(db, fire_batch, window=args.window, max_loaded=args.max_loaded)
+    started = time.perf_counter()
+    with dispatcher._cond:
+        dispatcher._refill(time.time())
+    cold_start = time.perf_counter() - started
+    dispatcher.start()
+
+    stop = threading.Event()
+    live = 0
+
+    def inject():
+        # Как schedule_notification: запись в базу через писатель, затем add() в диспетчер
+        nonlocal live
+        interval = 1 / args.live_rate
+        next_at = time.time()
+        while not stop.is_set() and time.time() < end - 10:
+            due_at = int(time.time()) + 1 + rnd.randrange(10)
+            chat_id = rnd.randrange(args.users)
+            reminder_id = writer.call(
+                lambda conn: add_reminder(conn, chat_id, 'Новое напоминание', [], due_at)
+            ).result()
+            dispatcher.add(reminder_id, due_at)
+            live += 1
+            next_at += interval
+            stop.wait(max(0.0, next_at - time.time()))
+
+    injector = threading.Thread(target=inject, daemon=True) if args.live_rate > 0 else None
+    if injector:
+        injector.start()
+
+    samples = []
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    last_cpu, last_wall = cpu_started, wall_started
+    while time.time() < end + GRACE:
+        time.sleep(1)
+        cpu, wall = time.process_time(), time.perf_counter()
+        with lock:
+            fired = len(fired_ids)
+        samples.append({
+            't': round(wall - wall_started, 1),
+            'rss_kb': rss_kb(),
+            'cpu_percent': round((cpu - last_cpu) / (wall - last_wall) * 100, 1),
+            'loaded': dispatcher.loaded,
+            'fired': fired,
+        })
+        last_cpu, last_wall = cpu, wall
+
+    stop.set()
+    if injector:
+        injector.join()
+    dispatcher.stop()
+    writer.stop()
+    cpu_seconds = time.process_time() - cpu_started
+    wall_seconds = time.perf_counter() - wall_started
+    # Строка удаляется из базы перед отправкой: оставшиеся наступившие — пропущенные
+    missed = db.query_one('SELECT COUNT(*) FROM reminders WHERE due_at <= ?', (end,))[0]
+    db.close_all()
+
+    skews.sort()
+    return {
+        'config': vars(args),
+        'seed_seconds': round(seed_seconds, 3),
+        'cold_start_ms': round(cold_start * 1000, 2),
+        'expected': args.due + live,
+        'live_added': live,
+        'fired': len(fired_ids),
+        'missed': missed,
+        'duplicates': duplicates,
+        'skew_ms': {
+            name: round(value * 1000, 1) if value is not None else None
+            for name, value in (
+                ('p50', percentile(skews, 0.5)), ('p95', percentile(skews, 0.95)),
+                ('p99', percentile(skews, 0.99)), ('max', skews[-1] if skews else None),
+            )
+        },
+        'cpu_seconds': round(cpu_seconds, 3),
+        'cpu_percent': round(cpu_seconds / wall_seconds * 100, 1),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'max_loaded': max((s['loaded'] for s in samples), default=0),
+        'samples': samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--outstanding', type=int, default=100_000, help='напоминаний с due_at после прогона')
+    parser.add_argument('--horizon', type=int, default=30 * 86400, help='разброс отложенных напоминаний, с')
+    parser.add_argument('--due', type=int, default=10_000, help='напоминаний, наступающих во время прогона')
+    parser.add_argument('--shape', choices=('uniform', 'bursty', 'round'), default='uniform')
+    parser.add_argument('--burst-size', type=int, default=1000, help='напоминаний в одной секунде для bursty')
+    parser.add_argument('--round-every', type=int, default=60, help='шаг «круглых» отметок для round, с')
+    parser.add_argument('--duration', type=int, default=60, help='длительность прогона, с')
+    parser.add_argument('--live-rate', type=float, default=20, help='новых напоминаний в секунду во время прогона')
+    parser.add_argument('--send-ms', type=float, default=0.0, help='время отправки одного сообщения заглушкой, мс')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--window', type=int, default=300, help='окно диспетчера, с')
+    parser.add_argument('--max-loaded', type=int, default=50_000, help='предел окна диспетчера в памяти')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help='файл базы (по умолчанию временный)')
+    parser.add_argument('--report', help='сохранить отчет JSON в файл; "-" — напечатать в stdout')
+    args = parser.parse_args()
+
+    if args.db:
+        report = run(args, args.db)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            report = run(args, os.path.join(tmp, 'tasks.db'))
+
+    skew = report['skew_ms']
+    print(f"отложенных: {args.outstanding:,}, наступающих: {report['expected']:,} ({args.shape}), "
+          f"заполнение базы: {report['seed_seconds']:.1f} с, первое окно: {report['cold_start_ms']:.1f} мс",
+          file=sys.stderr)
+    print(f"сработало: {report['fired']:,}, пропущено: {report['missed']:,}, повторно: {report['duplicates']}; "
+          f"отставание p50={skew['p50']} мс p95={skew['p95']} мс p99={skew['p99']} мс max={skew['max']} мс",
+          file=sys.stderr)
+    print(f"CPU: {report['cpu_percent']}%, пиковый RSS: {report['peak_rss_kb'] / 1024:.0f} МБ, "
+          f"окно в памяти до {report['max_loaded']:,}", file=sys.stderr)
+    if args.report == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    elif args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if report['missed'] or report['duplicates'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""Офлайн-прогон сценариев диалога через настоящий ConversationHandler.
+
+Запросы к Bot API перехватывает FakeRequest: ответы собираются локально, сеть
+и токен не нужны. Виртуальные пользователи параллельно проходят записанные
+сценарии (задача с вложениями, быстрая заметка с напоминанием, недельное
+расписание, подписки, «Мои задачи») через Application.process_update с
+обработчиками из main.conversation_handler(). База — временный tasks.db.
+Печатает задержку каждого обработчика (p50/p95/p99), время ожидания базы
+(вместе с очередью цикла событий), пропускную способность и число вызовов
+Bot API по методам; --json сохраняет то же самое в файл для сравнения
+прогонов. Код возврата 1, если обновление упало или не дошло до обработчика.
+
+Запуск из корня репозитория (нужен установленный python-telegram-bot):
+    python -m benchmarks.replay --users 200 --rounds 5
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from functools import partial
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'ToDoBot', 'username': 'todo_replay_bot'}
+FUTURE_TIME = '2030-01-01 10:00'
+
+# Шаги сценария: ('command' | 'text' | 'url' | 'photo' | 'press', значение)
+SCENARIOS = {
+    'add_task': [
+        ('press', 'main_add_task'),
+        ('text', 'Подготовить отчет'),
+        ('press', 'attach_yes'),
+        ('url', 'https://example.com/report'),
+        ('photo', None),
+        ('press', 'done'),
+        ('text', FUTURE_TIME),
+        ('press', 'conf_confirm_yes'),
+    ],
+    'quick_note': [
+        ('press', 'main_quick_note'),
+        ('text', 'Купить молоко'),
+        ('press', 'quick_confirm_yes'),
+        ('text', FUTURE_TIME),
+    ],
+    'weekly_schedule': [
+        ('press', 'main_weekly_schedule'),
+        ('press', 'schedule_add'),
+        ('press', 'schedule_Monday'),
+        ('press', 'schedule_time_Morning'),
+        *(('text', f'Задача на {hour}:00') for hour in range(6, 12)),
+        ('press', 'schedule_save'),
+        ('press', 'back'),
+    ],
+    'subscriptions': [
+        ('press', 'main_subscriptions'),
+        ('press', 'subscription_Sport'),
+        ('press', 'add_subscription'),
+        ('text', 'Зал по вторникам'),
+        ('press', 'subscription_Sport'),
+        ('press', 'view_subscriptions'),
+        ('press', 'back'),
+        ('press', 'back'),
+    ],
+    'my_tasks': [
+        ('press', 'main_my_tasks'),
+        ('press', 'back'),
+    ],
+}
+
+_ids = itertools.count(1)
+# Накопитель времени в базе для обработчика, который сейчас выполняется
+_db_time = contextvars.ContextVar('db_time', default=None)
+
+
+class FakeRequest(BaseRequest):
+    """Отвечает на вызовы Bot API локально, как если бы Telegram все принял."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = defaultdict(int)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({'ok': True, 'result': self._result(endpoint, params)}).encode()
+
+    @staticmethod
+    def _result(endpoint, params):
+        if endpoint == 'getMe':
+            return BOT_USER
+        if endpoint.startswith('send') or endpoint.startswith('edit'):
+            return {
+                'message_id': next(_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        return True
+
+
+class Session:
+    """Виртуальный пользователь: собирает обновления в формате Bot API."""
+
+    def __init__(self, bot, user_id):
+        self.bot = bot
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+        self.chat = {'id': user_id, 'type': 'private'}
+
+    def _message(self, **fields):
+        return {'message_id': next(_ids), 'date': int(time.time()), 'chat': self.chat, 'from': self.user, **fields}
+
+    def update(self, kind, value):
+        if kind == 'command':
+            text = f'/{value}'
+            payload = {'message': self._message(text=text, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(text)}])}
+        elif kind == 'text':
+            payload = {'message': self._message(text=value)}
+        elif kind == 'url':
+            payload = {'message': self._message(text=value, entities=[{'type': 'url', 'offset': 0, 'length': len(value)}])}
+        elif kind == 'photo':
+            file_id = f'photo{next(_ids)}'
+            payload = {'message': self._message(photo=[{'file_id': file_id, 'file_unique_id': file_id, 'width': 90, 'height': 90}])}
+        else:
+            payload = {'callback_query': {
+                'id': str(next(_ids)),
+                'from': self.user,
+                'chat_instance': str(self.user['id']),
+                'data': value,
+                'message': {**self._message(text='…'), 'from': BOT_USER},
+            }}
+        return Update.de_json({'update_id': next(_ids), **payload}, self.bot)
+
+
+class Stats:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.db = defaultdict(float)
+        self.errors = 0
+
+    def timed(self, callback, name_of):
+        async def wrapper(update, context):
+            name = name_of(update)
+            db_time = [0.0]
+            token = _db_time.set(db_time)
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                self.latency[name].append(time.perf_counter() - started)
+                self.db[name] += db_time[0]
+                _db_time.reset(token)
+        return wrapper
+
+    def report(self):
+        handlers = {}
+        for name, samples in sorted(self.latency.items()):
+            samples = sorted(samples)
+            p = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+            handlers[name] = {
+                'calls': len(samples),
+                'p50_ms': p(0.5), 'p95_ms': p(0.95), 'p99_ms': p(0.99),
+                'db_ms_mean': self.db[name] / len(samples) * 1000,
+            }
+        return handlers
+
+
+def timed_db(fn):
+    """Обертка run_db/wait_written: время ожидания базы засчитывается текущему обработчику."""
+    async def wrapper(*args):
+        started = time.perf_counter()
+        try:
+            return await fn(*args)
+        finally:
+            db_time = _db_time.get()
+            if db_time is not None:
+                db_time[0] += time.perf_counter() - started
+    return wrapper
+
+
+def instrument(bot_main, conv_handler, stats):
+    """Подменяет callback каждого обработчика диалога на замеряющую обертку."""
+    handlers = list(conv_handler.entry_points) + list(conv_handler.fallbacks)
+    for state_handlers in conv_handler.states.values():
+        handlers += state_handlers
+    for handler in handlers:
+        callback = handler.callback
+        if isinstance(callback, partial) and callback.func is bot_main.route_callback:
+            state = callback.args[0]
+            name_of = lambda update, state=state: bot_main.router.resolve(state, update.callback_query.data)[0].__name__
+        else:
+            name_of = lambda update, name=callback.__name__: name
+        handler.callback = stats.timed(callback, name_of)
+    bot_main.run_db = timed_db(bot_main.run_db)
+    bot_main.wait_written = timed_db(bot_main.wait_written)
+
+
+async def play(application, session, rounds):
+    await application.process_update(session.update('command', 'start'))
+    sent = 1
+    for _ in range(rounds):
+        for steps in SCENARIOS.values():
+            for kind, value in steps:
+                await application.process_update(session.update(kind, value))
+                sent += 1
+    return sent
+
+
+async def run(args):
+    sys.path.insert(0, ROOT)
+    workdir = tempfile.mkdtemp(prefix='todobot-replay-')
+    os.chdir(workdir)
+    import main as bot_main  # база tasks.db создается в текущем каталоге при импорте
+
+    logging.getLogger().setLevel(args.log_level)
+    stats = Stats()
+    request = FakeRequest(args.api_ms / 1000)
+    application = (
+        Application.builder()
+        .token('0:replay')
+        .request(request)
+        .get_updates_request(FakeRequest())
+        .concurrent_updates(True)
+        .build()
+    )
+    bot_main.application = application
+    conv_handler = bot_main.conversation_handler(persistent=False)
+    instrument(bot_main, conv_handler, stats)
+    application.add_handler(conv_handler)
+
+    async def count_error(update, context):
+        stats.errors += 1
+        if stats.errors <= 5:
+            logging.getLogger(__name__).error(f"Ошибка обработчика: {context.error!r}")
+    application.add_error_handler(count_error)
+
+    await application.initialize()
+    calls_before = sum(request.calls.values())
+    sessions = [Session(application.bot, 100000 + i) for i in range(args.users)]
+    started = time.perf_counter()
+    sent = sum(await asyncio.gather(*(play(application, session, args.rounds) for session in sessions)))
+    elapsed = time.perf_counter() - started
+    await application.shutdown()
+    bot_main.writer.stop()
+    bot_main.db_executor.shutdown()
+    bot_main.db.close_all()
+
+    handlers = stats.report()
+    handled = sum(h['calls'] for h in handlers.values())
+    result = {
+        'users': args.users,
+        'rounds': args.rounds,
+        'api_ms': args.api_ms,
+        'updates': sent,
+        'unhandled': sent - handled,
+        'errors': stats.errors,
+        'seconds': elapsed,
+        'updates_per_second': sent / elapsed,
+        'db_ms_total': sum(stats.db.values()) * 1000,
+        'api_calls': sum(request.calls.values()) - calls_before,
+        'api_calls_by_method': dict(sorted(request.calls.items())),
+        'handlers': handlers,
+    }
+
+    print(f"{'обработчик':<28} {'вызовов':>8} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'база мс':>8}")
+    for name, h in handlers.items():
+        print(f"{name:<28} {h['calls']:>8} {h['p50_ms']:>8.2f} {h['p95_ms']:>8.2f} {h['p99_ms']:>8.2f} {h['db_ms_mean']:>8.2f}")
+    print(f"обновлений: {sent:,} за {elapsed:.2f} с — {result['updates_per_second']:,.0f}/с; "
+          f"без обработчика: {result['unhandled']}, ошибок: {stats.errors}")
+    print(f"время в базе: {result['db_ms_total']:.0f} мс; вызовы Bot API: {result['api_calls_by_method']}")
+    if args.json:
+        with open(os.path.join(ROOT, args.json) if not os.path.isabs(args.json) else args.json, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100, help='параллельных пользователей')
+    parser.add_argument('--rounds', type=int, default=3, help='сколько раз каждый пользователь проходит все сценарии')
+    parser.add_argument('--api-ms', type=float, default=0.0, help='имитируемая задержка ответа Bot API, мс')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--json', help='сохранить результаты в файл JSON')
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    # Для CI: сценарий, который не дошел до обработчика или упал, — ошибка прогона
+    sys.exit(1 if result['errors'] or result['unhandled'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Локальный нагрузочный тест вебхука.
+
+Поднимает WebhookServer с ограниченной очередью и пулом обработчиков-заглушек
+(или бьёт по уже запущенному боту через --url) и отправляет синтетические
+Update JSON по нескольким keep-alive соединениям. Печатает принятые
+обновления в секунду, число отказов 503 и задержку от отправки до окончания
+обработки (p50/p95/p99).
+
+Запуск из корня репозитория:
+    python -m benchmarks.webhook_load --updates 20000 --connections 32
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from webhook import WebhookServer
+
+SECRET = 'load-test-secret'
+
+
+def synthetic_update(update_id, user_id):
+    """Нажатие кнопки «Мои задачи» от пользователя user_id."""
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Load'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'chat_instance': str(user_id),
+            'data': 'main_my_tasks',
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'ToDoBot'},
+                'text': 'Выберите действие:',
+            },
+        },
+    }
+
+
+async def post_updates(host, port, path, secret, ids, sent_at, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for update_id in ids:
+            body = json.dumps(synthetic_update(update_id, update_id % 10000)).encode()
+            writer.write(
+                f'POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                f'X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n'.encode()
+                + body
+            )
+            sent_at[update_id] = time.perf_counter()
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode().partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            if length:
+                await reader.readexactly(length)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run(args):
+    sent_at, latencies, statuses = {}, [], {}
+    server = workers = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port, path = parts.hostname, parts.port or 80, parts.path or '/'
+    else:
+        queue = asyncio.Queue(maxsize=args.queue_size)
+
+        def on_update(data):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                return False
+            return True
+
+        async def handler():
+            while True:
+                data = await queue.get()
+                if args.handler_ms:
+                    await asyncio.sleep(args.handler_ms / 1000)
+                latencies.append(time.perf_counter() - sent_at[data['update_id']])
+                queue.task_done()
+
+        server = WebhookServer(on_update, '/telegram', SECRET, '127.0.0.1', 0)
+        await server.start()
+        host, port, path = '127.0.0.1', server.port, '/telegram'
+        workers = [asyncio.create_task(handler()) for _ in range(args.workers)]
+
+    ids = list(range(args.updates))
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        post_updates(host, port, path, args.secret, ids[i::args.connections], sent_at, statuses)
+        for i in range(args.connections)
+    ))
+    elapsed = time.perf_counter() - started
+    if server is not None:
+        await queue.join()
+        for task in workers:
+            task.cancel()
+        await server.stop()
+
+    accepted = statuses.get(200, 0)
+    print(f'отправлено: {args.updates:,}, ответы: {dict(sorted(statuses.items()))}')
+    print(f'принято: {accepted / elapsed:,.0f} обновлений/с')
+    if latencies:
+        latencies.sort()
+        p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f'задержка до конца обработки: p50={p(0.5):.1f} мс p95={p(0.95):.1f} мс p99={p(0.99):.1f} мс')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=64, help='обработчиков-заглушек')
+    parser.add_argument('--handler-ms', type=float, default=2.0, help='время работы заглушки, мс')
+    parser.add_argument('--queue-size', type=int, default=1000)
+    parser.add_argument('--url', help='адрес вебхука уже запущенного бота, например http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', default=SECRET, help='секретный токен для --url')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
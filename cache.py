@@ -0,0 +1,102 @@
+"""LRU-кэш отрисованных представлений пользователя.
+
+Ключ — (user_id, представление, страница или категория), значение — готовый
+результат отрисовки. Кэш ограничен по числу записей и сбрасывается точечно
+из путей записи: invalidate(user_id, view) удаляет только записи этого
+пользователя и представления. Чтобы результат чтения, начатого до записи, не
+попал в кэш после неё, put() принимает отметку begin(), взятую перед чтением.
+"""
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # user_id -> [отметка последней инвалидации, множество ключей пользователя]
+        self._users = {}
+        # Отметка для пользователей, чьи записи уже вытеснены
+        self._floor = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def begin(self):
+        """Отметка перед чтением из базы; передается в put()."""
+        with self._lock:
+            return self._clock
+
+    def put(self, key, value, token):
+        user_id = key[0]
+        with self._lock:
+            user = self._users.get(user_id)
+            invalidated_at = user[0] if user else self._floor
+            if invalidated_at > token:
+                # Пока шло чтение, пользователь что-то записал — результат мог устареть
+                return
+            if user is None:
+                user = self._users[user_id] = [invalidated_at, set()]
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            user[1].add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._forget(old_key)
+                self.evictions += 1
+
+    def invalidate(self, user_id, view=None, part=None):
+        """Сбрасывает записи пользователя: все, одного представления или одной страницы/категории."""
+        with self._lock:
+            self._clock += 1
+            user = self._users.get(user_id)
+            if user is None:
+                user = self._users[user_id] = [self._clock, set()]
+            user[0] = self._clock
+            for key in [k for k in user[1] if (view is None or k[1] == view) and (part is None or k[2] == part)]:
+                del self._entries[key]
+                user[1].discard(key)
+            if len(self._users) > self.max_entries:
+                # Пользователи без записей в кэше нужны только ради отметок инвалидации
+                empty = [uid for uid, (_, keys) in self._users.items() if not keys]
+                for uid in empty:
+                    self._floor = max(self._floor, self._users.pop(uid)[0])
+
+    def invalidate_where(self, predicate):
+        """Сбрасывает все записи пользователей с predicate(user_id) — например, переехавших в другой процесс."""
+        with self._lock:
+            users = [user_id for user_id in self._users if predicate(user_id)]
+        for user_id in users:
+            self.invalidate(user_id)
+        return len(users)
+
+    def _forget(self, key):
+        user = self._users.get(key[0])
+        if user is None:
+            return
+        user[1].discard(key)
+        if not user[1]:
+            self._floor = max(self._floor, user[0])
+            del self._users[key[0]]
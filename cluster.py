@@ -0,0 +1,247 @@
+"""Работа бота несколькими процессами поверх общей базы tasks.db.
+
+Обновления от Telegram попадают в таблицу update_inbox (при long polling их
+забирает лидер, в режиме вебхука — сервер любого процесса) с номером слота
+slot_of(user_id). Живые процессы отмечаются в таблице workers; слоты
+распределяются между ними консистентным хешированием (HashRing), поэтому
+каждый пользователь обрабатывается одним процессом, а при появлении или
+падении процесса переезжает лишь его доля пользователей. Слот, доставшийся
+процессу при перебалансировке, начинает обрабатываться через handover_delay
+секунд — за это время прежний владелец успевает записать данные
+пользователей в базу.
+
+Напоминания и недельное расписание отправляет только лидер — процесс,
+держащий аренду (Lease) в таблице leases. Лидер продлевает аренду на каждом
+такте; если он упал, аренда истекает через ttl секунд и ее забирает другой
+процесс. Отправка напоминания удаляет строку в той же транзакции, что и
+читает, поэтому даже два лидера на стыке аренд не отправят его дважды.
+"""
+import asyncio
+import bisect
+import json
+import logging
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Число слотов: пользователи переезжают между процессами слотами, а не по одному
+SLOTS = 1024
+
+LEASE_SQL = (
+    'INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) '
+    'ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at '
+    'WHERE leases.holder = excluded.holder OR leases.expires_at < ?'
+)
+HEARTBEAT_SQL = (
+    'INSERT INTO workers (worker_id, seen_at) VALUES (?, ?) '
+    'ON CONFLICT (worker_id) DO UPDATE SET seen_at = excluded.seen_at'
+)
+LIVE_WORKERS_SQL = 'SELECT worker_id FROM workers WHERE seen_at >= ? ORDER BY worker_id'
+INBOX_PUT_SQL = 'INSERT OR IGNORE INTO update_inbox (update_id, slot, payload) VALUES (?, ?, ?)'
+OFFSET_SQL = (
+    'INSERT INTO cluster_state (key, value) VALUES (?, ?) '
+    'ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)'
+)
+
+
+def _hash(value):
+    return zlib.crc32(str(value).encode())
+
+
+def slot_of(user_id):
+    return _hash(user_id) % SLOTS
+
+
+class HashRing:
+    """Кольцо консистентного хеширования: replicas виртуальных точек на каждого участника."""
+
+    def __init__(self, members, replicas=64):
+        self.members = tuple(sorted(members))
+        points = sorted((_hash(f'{member}#{i}'), member) for member in self.members for i in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key):
+        if not self._owners:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+    def slots_of(self, member):
+        return frozenset(slot for slot in range(SLOTS) if self.owner(slot) == member)
+
+
+class Lease:
+    """Аренда name в таблице leases: acquire() берет или продлевает ее на ttl секунд."""
+
+    def __init__(self, db, name, holder, ttl=15, clock=time.time):
+        self.db = db
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.clock = clock
+
+    def acquire(self):
+        """Возвращает True, если аренда теперь принадлежит holder."""
+        now = self.clock()
+        with self.db.transaction() as conn:
+            conn.execute(LEASE_SQL, (self.name, self.holder, now + self.ttl, now))
+            row = conn.execute('SELECT holder FROM leases WHERE name = ?', (self.name,)).fetchone()
+        return row is not None and row[0] == self.holder
+
+    def release(self):
+        self.db.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (self.name, self.holder))
+
+
+class UpdateInbox:
+    """Очередь обновлений в базе, разбитая на слоты по user_id."""
+
+    def __init__(self, db, writer=None):
+        self.db = db
+        self.writer = writer
+
+    @staticmethod
+    def _row(data):
+        payload = data.get('message') or data.get('edited_message') or data.get('callback_query') or {}
+        user = payload.get('from') or {}
+        chat = payload.get('chat') or {}
+        user_id = user.get('id', chat.get('id', 0))
+        return data['update_id'], slot_of(user_id), json.dumps(data, ensure_ascii=False)
+
+    def put(self, data):
+        """Сохраняет одно обновление в формате Bot API (повторная доставка игнорируется).
+
+        С writer запись отложенная и вызов не блокирует: так его можно делать из цикла событий.
+        """
+        if self.writer is not None:
+            return self.writer.write(INBOX_PUT_SQL, self._row(data))
+        self.db.execute(INBOX_PUT_SQL, self._row(data))
+
+    def put_many(self, updates, offset):
+        """Сохраняет пачку обновлений из getUpdates и следующий offset одной транзакцией."""
+        with self.db.transaction() as conn:
+            conn.executemany(INBOX_PUT_SQL, [self._row(data) for data in updates])
+            conn.execute(OFFSET_SQL, ('update_offset', offset))
+
+    def offset(self):
+        row = self.db.query_one('SELECT value FROM cluster_state WHERE key = ?', ('update_offset',))
+        return row[0] if row else None
+
+    def claim(self, slots, limit=500):
+        """Забирает из очереди до limit обновлений слотов slots в порядке update_id."""
+        if not slots:
+            return []
+        marks = ','.join('?' * len(slots))
+        select = f'SELECT update_id FROM update_inbox WHERE slot IN ({marks}) ORDER BY update_id LIMIT ?'
+        # Пустую очередь проверяем без пишущей транзакции
+        if not self.db.query(select, (*slots, limit)):
+            return []
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                f'DELETE FROM update_inbox WHERE update_id IN ({select}) RETURNING update_id, payload',
+                (*slots, limit)
+            ).fetchall()
+        return [json.loads(payload) for _, payload in sorted(rows)]
+
+
+class ClusterWorker:
+    """Такт процесса кластера: отметка в workers, распределение слотов, аренда лидера и разбор очереди.
+
+    Колбэки — корутины:
+    on_update(data) — обработать обновление своего слота;
+    on_release(slots) — слоты ушли другим процессам: пора записать и выгрузить данные их пользователей;
+    on_acquire(slots) — слоты начинают обрабатываться здесь (после handover_delay);
+    on_leader(is_leader) — процесс стал лидером или перестал им быть.
+    """
+
+    def __init__(self, db, worker_id, on_update, on_release, on_acquire, on_leader, executor=None, writer=None,
+                 heartbeat=2.0, ttl=10.0, poll_interval=0.05, batch=500, clock=time.time):
+        self.db = db
+        self.worker_id = worker_id
+        self.on_update = on_update
+        self.on_release = on_release
+        self.on_acquire = on_acquire
+        self.on_leader = on_leader
+        self.executor = executor
+        self.heartbeat = heartbeat
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.clock = clock
+        self.handover_delay = 2 * heartbeat
+        self.inbox = UpdateInbox(db, writer)
+        self.lease = Lease(db, 'leader', worker_id, ttl, clock)
+        self.members = ()
+        # slot -> время, с которого слот можно обрабатывать
+        self._owned = {}
+        self.active = frozenset()
+        self.is_leader = False
+        self.processed = 0
+
+    async def _db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _live(self):
+        now = self.clock()
+        self.db.execute(HEARTBEAT_SQL, (self.worker_id, now))
+        return [row[0] for row in self.db.query(LIVE_WORKERS_SQL, (now - self.ttl,))]
+
+    async def tick(self):
+        """Отметка, перебалансировка и аренда; вызывается раз в heartbeat секунд."""
+        members = tuple(await self._db(self._live))
+        if members != self.members:
+            owned = HashRing(members).slots_of(self.worker_id)
+            now = self.clock()
+            # Единственный процесс при старте ни у кого слоты не забирает — ждать незачем
+            delay = 0 if not self.members and len(members) == 1 else self.handover_delay
+            self._owned = {slot: self._owned.get(slot, now + delay) for slot in owned}
+            logger.info("Процессы кластера: %s; слотов у %s: %s", ', '.join(members), self.worker_id, len(owned))
+            self.members = members
+            released = self.active - owned
+            if released:
+                self.active -= released
+                await self.on_release(released)
+
+        is_leader = await self._db(self.lease.acquire)
+        if is_leader != self.is_leader:
+            self.is_leader = is_leader
+            logger.info("Процесс %s %s лидером.", self.worker_id, 'стал' if is_leader else 'перестал быть')
+            await self.on_leader(is_leader)
+
+    async def _activate(self):
+        now = self.clock()
+        acquired = frozenset(slot for slot, since in self._owned.items() if since <= now) - self.active
+        if acquired:
+            await self.on_acquire(acquired)
+            self.active |= acquired
+
+    async def run(self, stop):
+        """Работает до установки события stop."""
+        next_tick = 0.0
+        while not stop.is_set():
+            try:
+                if self.clock() >= next_tick:
+                    next_tick = self.clock() + self.heartbeat
+                    await self.tick()
+                await self._activate()
+                updates = await self._db(self.inbox.claim, sorted(self.active), self.batch)
+            except Exception as e:
+                logger.error("Ошибка такта кластера: %s", e)
+                updates = []
+            for data in updates:
+                await self.on_update(data)
+            self.processed += len(updates)
+            if len(updates) < self.batch:
+                try:
+                    await asyncio.wait_for(stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def leave(self):
+        """Освобождает аренду и убирает процесс из workers, чтобы слоты переехали сразу."""
+        def leave():
+            if self.is_leader:
+                self.lease.release()
+            self.db.execute('DELETE FROM workers WHERE worker_id = ?', (self.worker_id,))
+        await self._db(leave)
@@ -0,0 +1 @@
+# Корень репозитория попадает в sys.path, и тесты импортируют модули бота так же, как main.py
@@ -0,0 +1,119 @@
+"""Слой доступа к SQLite: отдельное соединение на поток, режим WAL и короткоживущие курсоры."""
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Настройки соединения: WAL позволяет читателям не ждать писателей,
+# synchronous=NORMAL в режиме WAL безопасен и заметно дешевле FULL
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -20000),  # ~20 МБ страничного кэша на соединение
+    ('temp_store', 'MEMORY'),
+    ('mmap_size', 64 * 1024 * 1024),
+    ('busy_timeout', 5000),
+)
+
+
+class Database:
+    """Пул соединений с базой: каждый поток получает своё соединение при первом обращении."""
+
+    def __init__(self, path, pragmas=PRAGMAS):
+        self.path = path
+        self.pragmas = pragmas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        # observe(sql, seconds) вызывается после каждого запроса через execute/query; None — без замеров
+        self.observe = None
+
+    def _connect(self):
+        # isolation_level=None: транзакции открываются только явно через transaction()
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        with self._lock:
+            self._connections.append(conn)
+        logger.debug("Открыто новое соединение с %s для потока %s", self.path, threading.current_thread().name)
+        return conn
+
+    @property
+    def conn(self):
+        """Соединение текущего потока."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    @contextmanager
+    def cursor(self):
+        """Короткоживущий курсор, который закрывается сразу после использования."""
+        cur = self.conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+    @contextmanager
+    def transaction(self):
+        """Явная пишущая транзакция: BEGIN IMMEDIATE ... COMMIT или ROLLBACK при ошибке."""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+
+    def _observed(self, sql, started):
+        if self.observe is not None:
+            self.observe(sql, time.perf_counter() - started)
+
+    def execute(self, sql, params=()):
+        """Выполняет одну пишущую команду в автокоммите и возвращает lastrowid."""
+        started = time.perf_counter()
+        with self.cursor() as cur:
+            cur.execute(sql, params)
+            lastrowid = cur.lastrowid
+        self._observed(sql, started)
+        return lastrowid
+
+    def executemany(self, sql, seq_of_params):
+        """Выполняет пакет команд одной транзакцией."""
+        started = time.perf_counter()
+        with self.transaction() as conn:
+            conn.executemany(sql, seq_of_params)
+        self._observed(sql, started)
+
+    def query(self, sql, params=()):
+        started = time.perf_counter()
+        with self.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        self._observed(sql, started)
+        return rows
+
+    def query_one(self, sql, params=()):
+        started = time.perf_counter()
+        with self.cursor() as cur:
+            cur.execute(sql, params)
+            row = cur.fetchone()
+        self._observed(sql, started)
+        return row
+
+    def close_all(self):
+        """Закрывает все соединения пула (при остановке бота)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error("Ошибка при закрытии соединения: %s", e)
+        self._local = threading.local()
@@ -0,0 +1,95 @@
+"""Группировка ошибок по отпечаткам для уведомлений администратора.
+
+Отпечаток ошибки — тип исключения и место в коде бота, где оно возникло
+(самый глубокий кадр трейсбека вне стандартной библиотеки и site-packages).
+Одинаковые ошибки только увеличивают счетчик: администратор получает одно
+сообщение о новом отпечатке, а дальше — периодическую сводку с числом
+повторов. Полные трейсбеки последних ошибок хранятся в кольцевом буфере и
+выдаются по запросу.
+"""
+import hashlib
+import os
+import sysconfig
+import time
+import traceback
+from collections import deque
+
+# Каталоги, кадры из которых не считаются местом ошибки
+_LIBRARY_PATHS = tuple(
+    os.path.normcase(os.path.abspath(path)) + os.sep
+    for path in {sysconfig.get_paths()[name] for name in ('stdlib', 'platstdlib', 'purelib', 'platlib')}
+)
+
+
+def error_location(frames):
+    """Самый глубокий кадр кода бота, а если такого нет — самый глубокий вообще."""
+    for frame in reversed(frames):
+        if not os.path.normcase(os.path.abspath(frame.filename)).startswith(_LIBRARY_PATHS):
+            return frame
+    return frames[-1] if frames else None
+
+
+class ErrorGroup:
+    __slots__ = ('fingerprint', 'type', 'location', 'message', 'count', 'unreported', 'first_seen', 'last_seen')
+
+    def __init__(self, fingerprint, type, location, message, now):
+        self.fingerprint = fingerprint
+        self.type = type
+        self.location = location
+        self.message = message
+        self.count = 0
+        self.unreported = 0
+        self.first_seen = now
+        self.last_seen = now
+
+
+class ErrorTracker:
+    def __init__(self, max_groups=1000, max_tracebacks=50, clock=time.time):
+        self.max_groups = max_groups
+        self.clock = clock
+        self._groups = {}
+        # (время, отпечаток, описание обновления, трейсбек) последних ошибок
+        self._recent = deque(maxlen=max_tracebacks)
+        self.total = 0
+
+    def record(self, error, context=''):
+        """Учитывает ошибку; возвращает (группа, True если отпечаток новый)."""
+        now = self.clock()
+        frames = traceback.extract_tb(error.__traceback__)
+        frame = error_location(frames)
+        location = f'{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}' if frame else '?'
+        error_type = type(error).__qualname__
+        fingerprint = hashlib.blake2b(f'{error_type}|{location}'.encode(), digest_size=4).hexdigest()
+
+        group = self._groups.get(fingerprint)
+        is_new = group is None
+        if is_new:
+            if len(self._groups) >= self.max_groups:
+                oldest = min(self._groups.values(), key=lambda g: g.last_seen)
+                del self._groups[oldest.fingerprint]
+            group = self._groups[fingerprint] = ErrorGroup(fingerprint, error_type, location, str(error), now)
+        group.count += 1
+        group.last_seen = now
+        # О новой ошибке сообщаем сразу, поэтому в сводку она попадает только повторами
+        if not is_new:
+            group.unreported += 1
+        self.total += 1
+        formatted = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+        self._recent.append((now, fingerprint, context, formatted))
+        return group, is_new
+
+    def digest(self):
+        """Группы с повторами после прошлой сводки (счетчики повторов сбрасываются)."""
+        groups = [g for g in self._groups.values() if g.unreported]
+        result = [(g, g.unreported) for g in sorted(groups, key=lambda g: -g.unreported)]
+        for g in groups:
+            g.unreported = 0
+        return result
+
+    def groups(self):
+        """Все известные отпечатки, самые частые первыми."""
+        return sorted(self._groups.values(), key=lambda g: -g.count)
+
+    def recent(self, fingerprint=None):
+        """Последние сохраненные ошибки (новые первыми), при fingerprint — только этого отпечатка."""
+        return [entry for entry in reversed(self._recent) if fingerprint is None or entry[1] == fingerprint]
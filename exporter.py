@@ -0,0 +1,234 @@
+"""Потоковая выгрузка задач, быстрых заметок, недельного расписания и подписок.
+
+Строки читаются keyset-страницами по индексам, начинающимся с user_id, — так
+же, как страницы «Моих задач» в views.py: задачи по (time, id), расписание по
+(day, hour, id), подписки по (category, id). Каждая страница — отдельный
+запрос на page_rows строк; его результат разбирается fetchmany по FETCH_ROWS
+и сразу пишется в файл, поэтому в памяти никогда нет больше FETCH_ROWS строк,
+а между страницами пул соединений свободен для остальных запросов бота.
+
+Выгрузка всех пользователей обходит user_id по возрастанию: следующий
+пользователь — наименьший user_id больше текущего в трех таблицах, каждая
+часть находится одним спуском по индексу.
+
+Форматы:
+  csv   — одна таблица с колонкой kind и объединенным набором колонок;
+  jsonl — объект на строку, только поля своего вида;
+  ics   — задачи с временем как VEVENT, заметки без времени как VTODO,
+          расписание как еженедельные события; подписки в календарь не попадают.
+Любой формат можно сжать gzip.
+
+Обратно через импорт (importer.py) выгрузка загружается лишь частично:
+восстанавливаются только задачи и заметки со временем. Строки расписания и
+подписок в CSV и заметки без времени в обоих форматах импорт пропускает как
+строки с ошибкой, а еженедельное событие расписания из ICS превращается в
+одну задачу на дату первого занятия. JSON Lines импорт не читает.
+"""
+import csv
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytz
+
+from weekly import DAYS
+
+FORMATS = ('csv', 'jsonl', 'ics')
+# Строк в одной keyset-странице и в одном fetchmany
+PAGE_ROWS = 5000
+FETCH_ROWS = 500
+# Тема, под которой сохраняются быстрые заметки
+NOTE_TOPIC = 'Быстрая заметка'
+# Меньше любого chat_id Telegram
+MIN_USER_ID = -(2 ** 63)
+
+# (вид, таблица, колонки, колонки ключа, начальный ключ); NULL в колонках ключа не выгружаются, как и в views.py
+SECTIONS = (
+    ('task', 'tasks', ('id', 'topic', 'description', 'time', 'due_at'), ('time', 'id'), ('', -1)),
+    ('schedule', 'schedules', ('id', 'day', 'time_of_day', 'hour', 'task'), ('day', 'hour', 'id'), ('', -1, -1)),
+    ('subscription', 'subscriptions', ('id', 'category', 'content'), ('category', 'id'), ('', -1)),
+)
+NEXT_USER_SQL = (
+    'SELECT MIN(user_id) FROM ('
+    'SELECT MIN(user_id) AS user_id FROM tasks WHERE user_id > :after UNION ALL '
+    'SELECT MIN(user_id) FROM schedules WHERE user_id > :after UNION ALL '
+    'SELECT MIN(user_id) FROM subscriptions WHERE user_id > :after)'
+)
+CSV_COLUMNS = (
+    'kind', 'user_id', 'id', 'topic', 'description', 'time', 'due_at',
+    'day', 'time_of_day', 'hour', 'task', 'category', 'content',
+)
+
+
+def page_sql(table, columns, key):
+    """Запрос keyset-страницы строк пользователя после заданного ключа."""
+    key_list = ', '.join(key)
+    marks = ', '.join('?' * len(key))
+    return (
+        f"SELECT {', '.join(columns)} FROM {table} "
+        f"WHERE user_id = ? AND ({key_list}) > ({marks}) ORDER BY {key_list} LIMIT ?"
+    )
+
+
+class CsvWriter:
+    def __init__(self, f, timezone):
+        self._writer = csv.DictWriter(f, CSV_COLUMNS, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def write(self, record):
+        self._writer.writerow(record)
+
+    def close(self):
+        pass
+
+
+class JsonLinesWriter:
+    def __init__(self, f, timezone):
+        self._f = f
+
+    def write(self, record):
+        self._f.write(json.dumps(record, ensure_ascii=False))
+        self._f.write('\n')
+
+    def close(self):
+        pass
+
+
+def _ics_text(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_fold(line):
+    """Строка iCalendar длиной не больше 75 байт UTF-8; продолжения начинаются с пробела."""
+    parts, current, size = [], [], 0
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > 75:
+            parts.append(''.join(current))
+            current, size = [' '], 1
+        current.append(char)
+        size += width
+    parts.append(''.join(current))
+    return '\r\n'.join(parts) + '\r\n'
+
+
+class IcsWriter:
+    def __init__(self, f, timezone):
+        self._f = f
+        self.timezone = timezone
+        self._stamp = datetime.now(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+        self._today = datetime.now(timezone).date()
+        self._lines('BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//tasks-bot//export//RU', 'CALSCALE:GREGORIAN')
+
+    def _lines(self, *lines):
+        for line in lines:
+            self._f.write(_ics_fold(line))
+
+    def _task_time(self, record):
+        if record['due_at'] is not None:
+            return datetime.fromtimestamp(record['due_at'], pytz.utc)
+        try:
+            # Задачи, которым фоновое заполнение due_at еще не дошло
+            return self.timezone.localize(datetime.strptime(record['time'], '%Y-%m-%d %H:%M'))
+        except (TypeError, ValueError):
+            return None
+
+    def write(self, record):
+        uid = f"UID:{record['kind']}-{record['user_id']}-{record['id']}@tasks-bot"
+        if record['kind'] in ('task', 'note'):
+            moment = self._task_time(record)
+            component = 'VEVENT' if moment else 'VTODO'
+            lines = [f'BEGIN:{component}', uid, f'DTSTAMP:{self._stamp}']
+            if moment:
+                lines.append(f"DTSTART:{moment.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')}")
+            lines.append(f"SUMMARY:{_ics_text(record['topic'])}")
+            if record['description']:
+                lines.append(f"DESCRIPTION:{_ics_text(record['description'])}")
+            self._lines(*lines, f'END:{component}')
+        elif record['kind'] == 'schedule' and record['day'] in DAYS:
+            # Первое такое занятие начиная с сегодняшнего дня, дальше — каждую неделю
+            day = self._today + timedelta(days=(DAYS.index(record['day']) - self._today.weekday()) % 7)
+            self._lines(
+                'BEGIN:VEVENT', uid, f'DTSTAMP:{self._stamp}',
+                f"DTSTART;TZID={self.timezone.zone}:{day:%Y%m%d}T{int(record['hour']):02d}0000",
+                'RRULE:FREQ=WEEKLY',
+                f"SUMMARY:{_ics_text(record['task'])}",
+                'END:VEVENT',
+            )
+
+    def close(self):
+        self._lines('END:VCALENDAR')
+
+
+WRITERS = {'csv': CsvWriter, 'jsonl': JsonLinesWriter, 'ics': IcsWriter}
+
+
+class Exporter:
+    """Выгрузка в файл по страницам: step() пишет одну страницу и возвращает False, когда все выгружено.
+
+    user_id=None — все пользователи по возрастанию user_id (резервная копия и аналитика).
+    """
+
+    def __init__(self, db, path, fmt, timezone, user_id=None, compress=False, page_rows=PAGE_ROWS):
+        self.db = db
+        self.page_rows = page_rows
+        opener = gzip.open if compress else open
+        self.file = opener(path, 'wt', encoding='utf-8', newline='')
+        self._writer = WRITERS[fmt](self.file, timezone)
+        self._all_users = user_id is None
+        self._user = user_id
+        self._section = 0
+        self._key = SECTIONS[0][4]
+        self._sql = [page_sql(table, columns, key) for _, table, columns, key, _ in SECTIONS]
+        self.rows = 0
+        self.users = 0 if self._all_users else 1
+        self.done = False
+
+    def _next_user(self):
+        after = MIN_USER_ID if self._user is None else self._user
+        self._user = self.db.query_one(NEXT_USER_SQL, {'after': after})[0]
+        if self._user is not None:
+            self.users += 1
+        return self._user
+
+    def step(self):
+        if self.done:
+            return False
+        if self._all_users and self._section == 0 and self._key == SECTIONS[0][4] and self._next_user() is None:
+            self.done = True
+            return False
+        kind, _, columns, key, _ = SECTIONS[self._section]
+        count, last = 0, None
+        with self.db.cursor() as cur:
+            cur.execute(self._sql[self._section], (self._user, *self._key, self.page_rows))
+            while True:
+                rows = cur.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(zip(columns, row))
+                    if kind == 'task' and record['topic'] == NOTE_TOPIC:
+                        record['kind'] = 'note'
+                    else:
+                        record['kind'] = kind
+                    record['user_id'] = self._user
+                    self._writer.write(record)
+                count += len(rows)
+                last = rows[-1]
+        self.rows += count
+        if count == self.page_rows:
+            self._key = tuple(last[columns.index(name)] for name in key)
+            return True
+        # Вид выгружен целиком: следующий вид, а после подписок — следующий пользователь
+        self._section = (self._section + 1) % len(SECTIONS)
+        self._key = SECTIONS[self._section][4]
+        if self._section == 0 and not self._all_users:
+            self.done = True
+        return not self.done
+
+    def close(self):
+        """Дописывает окончание формата и закрывает файл."""
+        try:
+            self._writer.close()
+        finally:
+            self.file.close()
@@ -0,0 +1,226 @@
+"""Массовый импорт задач из CSV и iCalendar (.ics).
+
+Файл читается потоково: строки разбираются по одной, проверяются теми же
+правилами, что и время, введенное вручную (parse_task_time), и отдаются
+пачками по batch штук. В памяти одновременно находится одна пачка, поэтому
+расход памяти не зависит от размера файла.
+
+CSV: колонки «тема, время[, описание]» по порядку или по заголовку
+(topic/title/summary/тема/задача, time/due/date/время/дата,
+description/notes/описание); разделитель определяется по началу файла,
+кодировка — UTF-8 или, если файл в ней не читается, CP1251 (экспорт Excel).
+
+ICS: события VEVENT и задачи VTODO; тема из SUMMARY, описание из DESCRIPTION,
+время из DUE или DTSTART (UTC, TZID или время бота). У событий на весь день
+время — ALL_DAY_TIME.
+"""
+import codecs
+import csv
+from datetime import datetime, time, timedelta
+
+import pytz
+
+from reminders import INSERT_SQL as INSERT_REMINDER_SQL
+
+FORMATS = ('csv', 'ics')
+# Время задачи для событий календаря на весь день
+ALL_DAY_TIME = time(9, 0)
+# Длинные поля обрезаются при импорте, как и при отображении
+MAX_FIELD_LENGTH = 1000
+
+TOPIC_COLUMNS = ('topic', 'title', 'summary', 'subject', 'тема', 'задача', 'название')
+TIME_COLUMNS = ('time', 'due', 'date', 'datetime', 'время', 'дата', 'срок')
+DESCRIPTION_COLUMNS = ('description', 'notes', 'note', 'описание', 'заметка', 'заметки')
+
+INSERT_TASK_SQL = 'INSERT INTO tasks (user_id, topic, description, attachments, time, due_at) VALUES (?, ?, ?, ?, ?, ?)'
+
+
+def parse_task_time(input_time, now, timezone):
+    """Время задачи из 'ГГГГ-ММ-ДД ЧЧ:ММ' или 'ЧЧ:ММ' (сегодня, а если уже прошло — завтра); None, если формат неверный."""
+    if not input_time:
+        return None
+    try:
+        if len(input_time) == 5:
+            task_time = datetime.strptime(input_time, '%H:%M').replace(year=now.year, month=now.month, day=now.day)
+            task_time = timezone.localize(task_time)
+            if task_time < now:
+                task_time += timedelta(days=1)
+            return task_time
+        if len(input_time) == 16:
+            return timezone.localize(datetime.strptime(input_time, '%Y-%m-%d %H:%M'))
+    except ValueError:
+        pass
+    return None
+
+
+def file_format(file_name):
+    """'csv' или 'ics' по расширению файла, иначе None."""
+    extension = (file_name or '').rsplit('.', 1)[-1].lower()
+    return extension if extension in FORMATS else None
+
+
+def _encoding(path, sample_size=65536):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as f:
+        try:
+            # Неполный символ на границе образца ошибкой не считается
+            decoder.decode(f.read(sample_size))
+        except UnicodeDecodeError:
+            return 'cp1251'
+    return 'utf-8-sig'
+
+
+def _clip(value):
+    value = (value or '').strip()
+    return value[:MAX_FIELD_LENGTH]
+
+
+def _cell(row, index):
+    return row[index] if index is not None and index < len(row) else ''
+
+
+def _column(header, names):
+    for index, cell in enumerate(header):
+        if cell.strip().lower() in names:
+            return index
+    return None
+
+
+def csv_rows(f):
+    """Строки CSV: (номер строки, тема, описание, время текстом)."""
+    sample = f.read(8192)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(f, dialect)
+    # Индексы колонок темы, времени и описания
+    columns = (0, 1, 2)
+    first = True
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if first:
+            first = False
+            header = (_column(row, TOPIC_COLUMNS), _column(row, TIME_COLUMNS), _column(row, DESCRIPTION_COLUMNS))
+            if header[0] is not None and header[1] is not None:
+                columns = header
+                continue
+        topic, time_str, description = (_cell(row, index) for index in columns)
+        yield reader.line_num, _clip(topic), _clip(description), time_str.strip()
+
+
+def _unescape(value):
+    out, chars = [], iter(value)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+            char = '\n' if char in 'nN' else char
+        out.append(char)
+    return ''.join(out)
+
+
+def _ics_time(params, value, timezone):
+    """Время из значения DTSTART/DUE в часовом поясе бота или None."""
+    try:
+        if len(value) == 8:
+            day = datetime.strptime(value, '%Y%m%d').date()
+            return timezone.localize(datetime.combine(day, ALL_DAY_TIME))
+        moment = datetime.strptime(value.rstrip('Z')[:15], '%Y%m%dT%H%M%S')
+    except ValueError:
+        return None
+    if value.endswith('Z'):
+        return pytz.utc.localize(moment).astimezone(timezone)
+    zone = params.get('TZID')
+    try:
+        zone = pytz.timezone(zone.strip('"')) if zone else timezone
+    except pytz.UnknownTimeZoneError:
+        zone = timezone
+    return zone.localize(moment).astimezone(timezone)
+
+
+def _unfolded(f):
+    """Строки ICS с продолжениями (строки, начинающиеся с пробела или табуляции), склеенными с предыдущей."""
+    current, start = None, 0
+    for line_no, line in enumerate(f, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, line_no
+    if current is not None:
+        yield start, current
+
+
+def ics_rows(f, timezone):
+    """Компоненты VEVENT и VTODO: (номер строки, тема, описание, время текстом)."""
+    component = None
+    for line_no, line in _unfolded(f):
+        name, _, value = line.partition(':')
+        name, *raw_params = name.split(';')
+        name = name.upper()
+        if name == 'BEGIN' and value.upper() in ('VEVENT', 'VTODO'):
+            component = {'line': line_no}
+        elif component is None:
+            continue
+        elif name == 'END' and value.upper() in ('VEVENT', 'VTODO'):
+            moment = component.get('DUE') or component.get('DTSTART')
+            yield (
+                component['line'], _clip(_unescape(component.get('SUMMARY', ''))),
+                _clip(_unescape(component.get('DESCRIPTION', ''))),
+                moment.strftime('%Y-%m-%d %H:%M') if moment else '',
+            )
+            component = None
+        elif name in ('SUMMARY', 'DESCRIPTION'):
+            component[name] = value
+        elif name in ('DTSTART', 'DUE'):
+            params = {}
+            for param in raw_params:
+                key, _, item = param.partition('=')
+                params[key.upper()] = item
+            component[name] = _ics_time(params, value, timezone)
+
+
+def open_rows(path, kind, timezone):
+    """Открывает файл и возвращает (файл, итератор строк); файл закрывает вызывающий."""
+    f = open(path, encoding=_encoding(path), errors='replace', newline='')
+    return f, (csv_rows(f) if kind == 'csv' else ics_rows(f, timezone))
+
+
+def next_batch(rows, now, timezone, batch=1000):
+    """Следующие batch проверенных строк: ([(тема, описание, время задачи)], [(номер строки, причина)]).
+
+    Пустой первый список вместе с пустым вторым означает конец файла.
+    """
+    valid, errors = [], []
+    for line_no, topic, description, time_str in rows:
+        task_time = parse_task_time(time_str, now, timezone)
+        if not topic:
+            errors.append((line_no, 'нет темы'))
+        elif task_time is None:
+            errors.append((line_no, f'неверное время «{time_str[:40]}»'))
+        else:
+            valid.append((topic, description, task_time))
+        if len(valid) + len(errors) >= batch:
+            break
+    return valid, errors
+
+
+def insert_batch(conn, user_id, tasks, reminders):
+    """Вставляет пачку задач и напоминаний executemany; возвращает (первый, последний) id напоминаний или None.
+
+    tasks — [(тема, описание, время задачи)], reminders — [(тема, UTC timestamp)]. Вызывается внутри
+    транзакции: id напоминаний одной вставки идут подряд.
+    """
+    conn.executemany(INSERT_TASK_SQL, [
+        (user_id, topic, description, '', task_time.strftime('%Y-%m-%d %H:%M'), int(task_time.timestamp()))
+        for topic, description, task_time in tasks
+    ])
+    if not reminders:
+        return None
+    before = conn.execute('SELECT COALESCE(MAX(id), 0) FROM reminders').fetchone()[0]
+    conn.executemany(INSERT_REMINDER_SQL, [(user_id, topic, '[]', int(due_at)) for topic, due_at in reminders])
+    return before + 1, conn.execute('SELECT MAX(id) FROM reminders').fetchone()[0]
@@ -0,0 +1,112 @@
+"""Асинхронное структурированное логирование.
+
+Все записи уходят через QueueHandler в очередь, а форматирование и вывод
+выполняет поток QueueListener — обработчики и цикл событий не ждут
+ввода-вывода. Сообщения форматируются лениво (logger.info('... %s', x)):
+строка собирается только в потоке вывода и только для записей, прошедших
+фильтр.
+
+Обработчики обновлений выполняются внутри log_context(user_id, state,
+handler): эти поля добавляются в каждую запись, а INFO-записи из обработчиков
+пропускаются с вероятностью sample_rate, чтобы при большом потоке обновлений
+лог не занимал ввод-вывод. Предупреждения и ошибки, а также записи вне
+обработчиков (запуск, диспетчеры) не отбрасываются никогда.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Поля контекста, которые попадают в запись и в JSON
+CONTEXT_FIELDS = ('user_id', 'state', 'handler')
+EXTRA_FIELDS = CONTEXT_FIELDS + ('duration',)
+
+# (user_id, state, handler) обработчика, который сейчас выполняется, или None
+_context = contextvars.ContextVar('log_context', default=None)
+
+
+def set_context(user_id, state, handler):
+    """Устанавливает контекст обработчика; возвращает токен для reset_context()."""
+    return _context.set((user_id, state, handler))
+
+
+def reset_context(token):
+    _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи поля контекста обработчика и прореживает INFO-записи из обработчиков."""
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        context = _context.get()
+        if context is None:
+            return True
+        if record.levelno <= logging.INFO and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        record.user_id, record.state, record.handler = context
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler, который оставляет дорогое форматирование (JSON, время, трейсбек) потоку вывода.
+
+    В вызывающем потоке подставляются только args в сообщение: объекты из args
+    (словари, списки задач) могут измениться, пока запись ждет в очереди, и в
+    лог попало бы их более позднее состояние.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение и поля контекста."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=logging.INFO, fmt='text', sample_rate=1.0):
+    """Настраивает корневой логгер на вывод через очередь и возвращает запущенный QueueListener.
+
+    fmt — 'json' (структурированные строки) или 'text' (прежний формат basicConfig).
+    """
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    handler = LazyQueueHandler(records)
+    handler.addFilter(ContextFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+    listener = QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    # Дописываем очередь при выходе из процесса
+    atexit.register(listener.stop)
+    return listener
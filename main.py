@@ -1,23 +1,54 @@
+import asyncio
+import html
 import logging
+import os
+import signal
+import socket
+import tempfile
+import time
 from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaDocument, InputMediaPhoto, InputMediaVideo
 )
 from telegram.constants import ParseMode
 from telegram.ext import (
-    Updater, CommandHandler, MessageHandler, filters, CallbackContext,
-    CallbackQueryHandler, ConversationHandler
+    Application, CommandHandler, MessageHandler, filters, CallbackContext,
+    CallbackQueryHandler, ConversationHandler, TypeHandler
 )
-from apscheduler.schedulers.background import BackgroundScheduler
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import sqlite3
+from contextlib import contextmanager
+from functools import partial, wraps
 import pytz
-import traceback
 
-# Включаем логирование
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+import attachments as task_attachments
+import importer
+from cache import RenderCache
+from cluster import ClusterWorker, slot_of
+from db import Database
+from errors import ErrorTracker
+from logs import reset_context as reset_log_context, set_context as set_log_context, setup_logging
+from metrics import MetricsRegistry, MetricsServer, statement_labels
+from exporter import FORMATS as EXPORT_FORMATS, Exporter
+from importer import file_format as import_format, parse_task_time
+from migrations import backfill_due_at, backfill_progress, migrate
+from outbox import PRIORITY_REMINDER, OutboundLimiter
+from persistence import SQLitePersistence
+from profiler import MODES as PROFILE_MODES, Profiler
+from reminders import ReminderDispatcher, add_reminder
+from router import CallbackRouter
+from search import render_results as render_search_results, search as search_notes
+from views import RANGE_HEADERS, encode_page_key, parse_page_key, range_bounds, range_page, tasks_page
+from webhook import WebhookServer
+from weekly import DAYS, WeeklyScheduleDispatcher
+from writer import WriteBehindWriter
+
+# Включаем логирование: записи уходят через очередь в отдельный поток вывода.
+# TODOBOT_LOG_FORMAT — 'json' (структурированные строки) или 'text'; TODOBOT_LOG_INFO_SAMPLE_RATE — доля
+# INFO-записей из обработчиков обновлений, попадающих в лог (по умолчанию 1.0 — все)
+LOG_LEVEL = logging.INFO
+LOG_FORMAT = os.environ.get('TODOBOT_LOG_FORMAT', 'json')
+LOG_INFO_SAMPLE_RATE = float(os.environ.get('TODOBOT_LOG_INFO_SAMPLE_RATE', '1.0'))
+log_listener = setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_INFO_SAMPLE_RATE)
 
 logger = logging.getLogger(__name__)
 
@@ -35,211 +66,622 @@ logger = logging.getLogger(__name__)
 # Указываем ваш часовой пояс
 TIMEZONE = pytz.timezone('Europe/Moscow')
 
-# Подключаемся к базе данных
-conn = sqlite3.connect('tasks.db', check_same_thread=False)
-cursor = conn.cursor()
-
-# Создаем таблицы, если они не существуют
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS tasks (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    topic TEXT,
-    description TEXT,
-    attachments TEXT,
-    time TEXT
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS schedules (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    day TEXT,
-    time_of_day TEXT,
-    hour INTEGER,
-    task TEXT
+# Таблица маршрутов inline-кнопок; заполняется в register_routes() после объявления обработчиков
+router = CallbackRouter()
+
+SCHEDULE_DAYS = dict(zip(DAYS, (
+    'Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье'
+)))
+SCHEDULE_TIMES_OF_DAY = {
+    'Morning': '🌅 Утро (6-12)',
+    'Afternoon': '🌇 День (12-18)',
+    'Evening': '🌃 Вечер (18-24)',
+}
+SUBSCRIPTION_CATEGORIES = {
+    'Sport': '🏋️‍♂️ Спорт',
+    'Study': '📚 Учеба',
+    'Rest': '🎉 Отдых',
+    'Personal': '💌 Личное',
+}
+# Выборки задач по времени (views.range_page)
+TASK_RANGES = {
+    'today': '📅 Сегодня',
+    'week': '🗓️ Неделя',
+    'overdue': '⏰ Просроченные',
+}
+
+# Подключаемся к базе данных: у каждого рабочего потока своё соединение в режиме WAL
+DB_PATH = 'tasks.db'
+db = Database(DB_PATH)
+
+# Создаем таблицы и индексы или обновляем схему существующего файла
+migrate(db)
+# Задачам, сохраненным до появления due_at, он заполняется в фоне пачками по DUE_AT_BACKFILL_BATCH строк
+# с паузой DUE_AT_BACKFILL_PAUSE секунд, чтобы не задерживать запись обработчиков
+DUE_AT_BACKFILL_BATCH = 1000
+DUE_AT_BACKFILL_PAUSE = 0.05
+backfill_task = None
+
+# Поток отложенной записи: вставки объединяются в групповые транзакции.
+# Обработчики ждут подтверждения коммита не дольше WRITE_TIMEOUT секунд
+WRITE_TIMEOUT = 10
+writer = WriteBehindWriter(db)
+writer.start()
+
+# Чтение из базы выполняется в отдельном пуле потоков, чтобы не блокировать цикл событий
+DB_WORKERS = 8
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+
+# Кэш отрисованных списков задач и подписок; сбрасывается путями записи
+RENDER_CACHE_SIZE = 10000
+render_cache = RenderCache(RENDER_CACHE_SIZE)
+
+# user_data, chat_data и состояния диалогов переживают перезапуск; изменения пишутся раз в PERSISTENCE_INTERVAL секунд
+PERSISTENCE_INTERVAL = 60
+# Данные пользователей, не писавших боту дольше этого времени (в секундах), выгружаются из памяти
+USER_IDLE_TTL = 3600
+persistence = SQLitePersistence(db, writer, db_executor, update_interval=PERSISTENCE_INTERVAL, idle_ttl=USER_IDLE_TTL)
+eviction_task = None
+
+# Цикл событий бота; фоновые диспетчеры передают в него отправку сообщений
+bot_loop = None
+
+# Режим процессов: 'single' — один процесс делает всё; 'cluster' — несколько процессов с общим tasks.db
+# делят пользователей по слотам, а напоминания и расписание отправляет только лидер (см. cluster.py).
+# Имя процесса должно быть уникальным; по умолчанию — хост и pid. Лимиты outbound_limiter действуют
+# на процесс, поэтому в кластере их стоит разделить на число процессов
+WORKER_MODE = 'single'
+WORKER_ID = os.environ.get('TODOBOT_WORKER_ID') or f'{socket.gethostname()}-{os.getpid()}'
+# Как часто процесс отмечается в workers и продлевает аренду лидера; через CLUSTER_TTL секунд без отметки
+# процесс считается упавшим
+CLUSTER_HEARTBEAT = 2
+CLUSTER_TTL = 10
+cluster_worker = None
+main_conversation = None
+
+async def run_db(fn, *args):
+    """Выполняет блокирующий вызов базы в пуле db_executor."""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(fn, *args))
+
+async def wait_written(future):
+    """Дожидается коммита отложенной записи, не блокируя цикл событий.
+
+    shield: по таймауту отменяется только ожидание, а не Future записи — строка все равно будет записана.
+    """
+    return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), WRITE_TIMEOUT)
+
+def run_in_loop(coro):
+    """Выполняет корутину в цикле событий бота из фонового потока и ждет результата."""
+    return asyncio.run_coroutine_threadsafe(coro, bot_loop).result()
+
+# Диспетчер напоминаний: держит в памяти только ближайшее окно из таблицы reminders.
+# Запускается после старта бота, когда уже можно отправлять сообщения
+# В кластере напоминания создают все процессы, а отправляет лидер: он раз в секунду ищет новые строки
+reminder_dispatcher = ReminderDispatcher(
+    db, lambda rows: run_in_loop(send_reminders(rows)), poll_interval=1 if WORKER_MODE == 'cluster' else None
 )
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS subscriptions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    category TEXT,
-    content TEXT
-)
-''')
-
-conn.commit()
 
-# Создаем планировщик
-scheduler = BackgroundScheduler(timezone=TIMEZONE)
-scheduler.start()
+# Диспетчер недельного расписания: в начале каждого часа рассылает задачи этого слота
+weekly_dispatcher = WeeklyScheduleDispatcher(
+    db, lambda day, hour, users: run_in_loop(send_weekly_schedule(day, hour, users)), TIMEZONE
+)
 
 # Укажите здесь ваш chat_id для получения уведомлений об ошибках (без кавычек)
 ADMIN_CHAT_ID = ''  # Замените на ваш реальный chat_id
 
+# Ошибки группируются по отпечатку (тип и место в коде): о новой администратор узнает сразу,
+# о повторах — из сводки раз в ERROR_DIGEST_INTERVAL секунд. Трейсбеки последних
+# ERROR_TRACEBACKS ошибок доступны командой /errors
+ERROR_DIGEST_INTERVAL = 600
+ERROR_TRACEBACKS = 50
+error_tracker = ErrorTracker(max_tracebacks=ERROR_TRACEBACKS)
+digest_task = None
+
+# Импорт задач из присланного файла .csv или .ics: строки пишутся пачками по IMPORT_BATCH, сообщение о ходе
+# импорта обновляется не чаще раза в IMPORT_PROGRESS_INTERVAL секунд. Bot API отдает боту файлы до 20 МБ
+IMPORT_BATCH = 1000
+IMPORT_PROGRESS_INTERVAL = 2
+IMPORT_MAX_SIZE = 20 * 1024 * 1024
+IMPORT_ERRORS_SHOWN = 10
+# Пользователи, у которых сейчас идет импорт
+active_imports = set()
+# Выгрузка /export пишется во временный файл страницами между запросами остальных обработчиков;
+# Bot API принимает от бота документы до 50 МБ
+EXPORT_MAX_SIZE = 50 * 1024 * 1024
+EXPORT_PROGRESS_INTERVAL = 2
+# Пользователи, для которых сейчас готовится выгрузка
+active_exports = set()
+
+# Профилирование по команде /profile: файлы результатов складываются в PROFILE_DIR
+PROFILE_DIR = 'profiles'
+profiler = Profiler(PROFILE_DIR)
+
 # Время напоминания по умолчанию (в минутах)
 DEFAULT_NOTIFICATION_TIME = 5
 
-def error_handler(update: object, context: CallbackContext):
-    """Отправляет уведомление администратору при возникновении ошибки."""
-    logger.error(msg="Произошла ошибка при обработке обновления:", exc_info=context.error)
-    tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
-    tb_string = ''.join(tb_list)
+# Способ получения обновлений: 'polling' (long polling) или 'webhook' (встроенный HTTP-сервер)
+BOT_MODE = 'polling'
+
+# Настройки вебхука: публичный адрес, который Telegram будет вызывать,
+# и секретный токен, который он передает в каждом запросе
+WEBHOOK_URL = ''  # Например, https://example.com/telegram
+WEBHOOK_SECRET = ''  # Замените на случайную строку из букв, цифр, _ и -
+WEBHOOK_LISTEN = '0.0.0.0'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = '/telegram'
+
+# Сколько обновлений может ждать обработки; при переполнении вебхук отвечает 503
+UPDATE_QUEUE_SIZE = 1000
+
+# Все исходящие запросы к Telegram проходят через общую очередь с лимитами:
+# не больше 30 сообщений в секунду на бота и 1 в секунду на чат (с небольшим запасом на всплески)
+outbound_limiter = OutboundLimiter(global_rate=30, chat_rate=1, chat_burst=3)
+
+# Метрики в формате Prometheus: HTTP-эндпоинт для сборщика и команда /metrics для администратора.
+# METRICS_PORT = None отключает эндпоинт; слушаем только localhost — наружу метрики не нужны
+METRICS_LISTEN = '127.0.0.1'
+METRICS_PORT = 9108
+METRICS_PATH = '/metrics'
+metrics = MetricsRegistry(prefix='todobot_')
+metrics_server = MetricsServer(metrics, METRICS_LISTEN, METRICS_PORT, METRICS_PATH) if METRICS_PORT else None
+metrics_started = time.time()
+webhook_server = None
+
+handler_seconds = metrics.histogram('handler_seconds', 'Время выполнения обработчика диалога', ('handler',))
+sql_seconds = metrics.histogram('sql_seconds', 'Время SQL-запроса по типу и таблице', ('statement', 'table'))
+updates_total = metrics.counter('updates_total', 'Полученные обновления по типу', ('type',))
+notifications_total = metrics.counter('notifications_total', 'Отправка напоминаний по результату', ('result',))
+notification_seconds = metrics.histogram(
+    'notification_send_seconds', 'Время отправки напоминания вместе с ожиданием в очереди исходящих'
+)
+reminder_lag_seconds = metrics.histogram(
+    'reminder_lag_seconds', 'Отставание передачи напоминания на отправку от due_at',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+
+def observe_sql(sql, seconds):
+    sql_seconds.labels(*statement_labels(sql)).observe(seconds)
+
+db.observe = writer.observe = observe_sql
+
+def stats_metrics(name, stats, counters=()):
+    """Публикует каждое поле stats() компонента отдельной метрикой name_<поле>; значения читаются при запросе."""
+    for key in stats():
+        metric = f'{name}_{key}'
+        if key in counters and not key.endswith('_total'):
+            metric += '_total'
+        kind = 'counter' if metric.endswith('_total') else 'gauge'
+        metrics.gauge_fn(metric, f'{name}: {key}', lambda key=key: stats()[key], kind=kind)
+
+stats_metrics('outbound', outbound_limiter.stats)
+stats_metrics('render_cache', render_cache.stats, counters=('hits', 'misses', 'evictions'))
+stats_metrics('persistence', persistence.stats)
+metrics.gauge_fn('cluster_leader', 'Процесс — лидер кластера',
+                 lambda: cluster_worker and int(cluster_worker.is_leader))
+metrics.gauge_fn('cluster_slots', 'Слотов пользователей у процесса', lambda: cluster_worker and len(cluster_worker.active))
+metrics.gauge_fn('cluster_members', 'Живых процессов кластера', lambda: cluster_worker and len(cluster_worker.members))
+metrics.gauge_fn('errors_total', 'Ошибки в обработчиках', lambda: error_tracker.total, kind='counter')
+metrics.gauge_fn('writer_batches_total', 'Групповые коммиты писателя', lambda: writer.batches, kind='counter')
+metrics.gauge_fn('writer_jobs_total', 'Записи, прошедшие через писатель', lambda: writer.jobs, kind='counter')
+metrics.gauge_fn('reminders_loaded', 'Напоминаний в окне диспетчера', lambda: reminder_dispatcher.loaded)
+metrics.gauge_fn('reminders_fired_total', 'Сработавшие напоминания', lambda: reminder_dispatcher.fired, kind='counter')
+metrics.gauge_fn('reminders_last_skew_seconds', 'Отставание последней пачки напоминаний',
+                 lambda: reminder_dispatcher.last_skew)
+metrics.gauge_fn('weekly_fired_total', 'Пользователи, получившие рассылку расписания',
+                 lambda: weekly_dispatcher.fired, kind='counter')
+metrics.gauge_fn('webhook_updates_total', 'Обновления, пришедшие на вебхук', lambda: webhook_server and {
+    ('accepted',): webhook_server.accepted, ('rejected',): webhook_server.rejected,
+}, labelnames=('result',), kind='counter')
+
+@contextmanager
+def handler_scope(update, state, name):
+    """Выполнение обработчика: контекст логирования (user_id, state, handler), время — в handler_seconds и в лог."""
+    user = update.effective_user
+    token = set_log_context(user.id if user else None, state, name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        handler_seconds.labels(name).observe(duration)
+        logger.info("Обработчик %s выполнен за %.1f мс", name, duration * 1000, extra={'duration': round(duration, 4)})
+        reset_log_context(token)
+
+def timed(state, callback):
+    """Обертка обработчика сообщений состояния state в handler_scope."""
+    @wraps(callback)
+    async def wrapper(update, context):
+        with handler_scope(update, state, callback.__name__):
+            return await callback(update, context)
+    return wrapper
+
+async def error_handler(update: object, context: CallbackContext):
+    """Учитывает ошибку по отпечатку; администратору сразу сообщается только о новых отпечатках."""
+    error = context.error
+    user = update.effective_user if isinstance(update, Update) else None
+    group, is_new = error_tracker.record(error, f'пользователь {user.id}' if user else '')
+    if not is_new:
+        logger.error("Повтор ошибки [%s] %s в %s: %s", group.fingerprint, group.type, group.location, error)
+        return
+    logger.error("Новая ошибка [%s] при обработке обновления:", group.fingerprint, exc_info=error)
 
     message = (
-        f"⚠️ Произошла ошибка:\n\n"
-        f"{context.error}\n\n"
-        f"Трейсбек:\n"
-        f"{tb_string}"
+        f"⚠️ Новая ошибка [{group.fingerprint}]\n\n"
+        f"{group.type}: {group.message}\n"
+        f"Место: {group.location}\n\n"
+        f"Трейсбек: /errors {group.fingerprint}"
     )
+    await send_admin(message)
 
-    if ADMIN_CHAT_ID:
-        try:
-            context.bot.send_message(chat_id=ADMIN_CHAT_ID, text=message, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logger.error(f"Не удалось отправить сообщение админу: {e}")
+async def send_admin(text):
+    if not ADMIN_CHAT_ID:
+        return
+    try:
+        await application.bot.send_message(chat_id=ADMIN_CHAT_ID, text=text[:4096])
+    except Exception as e:
+        logger.error("Не удалось отправить сообщение админу: %s", e)
+
+async def send_error_digests():
+    """Раз в ERROR_DIGEST_INTERVAL секунд отправляет администратору сводку повторившихся ошибок."""
+    while True:
+        await asyncio.sleep(ERROR_DIGEST_INTERVAL)
+        digest = error_tracker.digest()
+        if not digest:
+            continue
+        lines = [f"🧾 Повторы ошибок за {ERROR_DIGEST_INTERVAL // 60} мин:"]
+        lines += [
+            f"• [{group.fingerprint}] {group.type} в {group.location}: +{count} (всего {group.count})"
+            for group, count in digest[:30]
+        ]
+        if len(digest) > 30:
+            lines.append(f"…и еще отпечатков: {len(digest) - 30}")
+        await send_admin('\n'.join(lines))
+
+async def errors_command(update: Update, context: CallbackContext):
+    """/errors — отпечатки ошибок со счетчиками; /errors <отпечаток> — последний трейсбек этой ошибки."""
+    if not is_admin(update):
+        return
+    if context.args:
+        entries = error_tracker.recent(context.args[0])
+        if not entries:
+            await update.message.reply_text('Трейсбек для этого отпечатка уже вытеснен из буфера или не найден.')
+            return
+        seen, fingerprint, where, formatted = entries[0]
+        header = f"[{fingerprint}] {datetime.fromtimestamp(seen, TIMEZONE):%Y-%m-%d %H:%M:%S} {where}\n\n"
+        # Конец трейсбека информативнее начала: обрезаем сверху
+        await update.message.reply_text(header + formatted[-(4096 - len(header)):])
+        return
+    groups = error_tracker.groups()
+    if not groups:
+        await update.message.reply_text('✅ Ошибок не было.')
+        return
+    lines = [f"Ошибок всего: {error_tracker.total}, отпечатков: {len(groups)}"]
+    lines += [
+        f"• [{g.fingerprint}] {g.type} в {g.location}: {g.count}, последняя {datetime.fromtimestamp(g.last_seen, TIMEZONE):%d.%m %H:%M}"
+        for g in groups[:30]
+    ]
+    await update.message.reply_text('\n'.join(lines)[:4096])
+
+def owner_id(update: Update, context: CallbackContext):
+    """Id, под которым хранятся задачи и подписки: чат из /start (в группах отрицательный), а до /start — текущий чат."""
+    return context.user_data.get('user_id', update.effective_chat.id)
+
+async def search_command(update: Update, context: CallbackContext):
+    """/search <слова> — поиск по задачам, быстрым заметкам и подпискам пользователя."""
+    text = ' '.join(context.args)
+    found = await run_db(search_notes, db, owner_id(update, context), text) if text else None
+    if found is None:
+        await update.message.reply_text('🔎 Укажите, что искать: <code>/search слова</code>', parse_mode=ParseMode.HTML)
+        return
+    await update.message.reply_text(render_search_results(text, *found), parse_mode=ParseMode.HTML)
+
+async def import_help(update: Update, context: CallbackContext):
+    """/import — как импортировать задачи из другого планировщика."""
+    await update.message.reply_text(
+        '📥 <b>Импорт задач</b>\n'
+        'Пришлите файл <code>.csv</code> или <code>.ics</code>.\n\n'
+        'CSV: колонки «тема, время, описание» по порядку или с заголовком (тема/topic, время/time, описание/description); '
+        'время — <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code>.\n'
+        'ICS: события и задачи календаря (SUMMARY, DTSTART/DUE, DESCRIPTION).\n\n'
+        'Для будущих задач будут запланированы напоминания.',
+        parse_mode=ParseMode.HTML
+    )
+
+async def import_document(update: Update, context: CallbackContext):
+    """Принимает файл .csv или .ics и запускает импорт задач в фоне."""
+    document = update.message.document
+    user_id = owner_id(update, context)
+    if document.file_size and document.file_size > IMPORT_MAX_SIZE:
+        await update.message.reply_text('❌ Файл больше 20 МБ: Telegram не отдает боту такие файлы. Разделите его на части.')
+        return
+    if user_id in active_imports:
+        await update.message.reply_text('⏳ Предыдущий импорт еще идет, дождитесь его окончания.')
+        return
+    active_imports.add(user_id)
+    status = await update.message.reply_text('⏳ Загружаю файл…')
+    notification_time = context.user_data.get('notification_time', DEFAULT_NOTIFICATION_TIME)
+    context.application.create_task(
+        run_import(user_id, document, import_format(document.file_name), status, notification_time)
+    )
+
+async def edit_status(status, text):
+    try:
+        await status.edit_text(text, parse_mode=ParseMode.HTML)
+    except Exception as e:
+        logger.warning("Не удалось обновить сообщение о ходе импорта или выгрузки: %s", e)
+
+async def run_import(user_id, document, kind, status, notification_time):
+    """Импортирует задачи из файла пачками; напоминания для будущих задач планируются одной операцией в конце."""
+    fd, path = tempfile.mkstemp(suffix=f'.{kind}')
+    os.close(fd)
+    rows_file = None
+    imported = failed = scheduled = 0
+    errors = []
+    reminder_ids = None
+    try:
+        file = await document.get_file()
+        await file.download_to_drive(path)
+        rows_file, rows = await run_db(importer.open_rows, path, kind, TIMEZONE)
+        now = datetime.now(TIMEZONE)
+        notify_before = timedelta(minutes=notification_time)
+        next_progress = time.monotonic() + IMPORT_PROGRESS_INTERVAL
+        while True:
+            tasks, batch_errors = await run_db(importer.next_batch, rows, now, TIMEZONE, IMPORT_BATCH)
+            if not tasks and not batch_errors:
+                break
+            failed += len(batch_errors)
+            errors += batch_errors[:IMPORT_ERRORS_SHOWN - len(errors)]
+            # Как и schedule_notification, но без немедленной отправки: прошедшие задачи импортируются без напоминаний
+            reminders = [
+                (topic, (task_time - notify_before).timestamp())
+                for topic, _, task_time in tasks if task_time - notify_before > now
+            ]
+            if tasks:
+                ids = await wait_written(writer.call(
+                    partial(importer.insert_batch, user_id=user_id, tasks=tasks, reminders=reminders)
+                ))
+                imported += len(tasks)
+                if ids is not None:
+                    scheduled += len(reminders)
+                    reminder_ids = (reminder_ids[0] if reminder_ids else ids[0], ids[1])
+            if time.monotonic() >= next_progress:
+                next_progress = time.monotonic() + IMPORT_PROGRESS_INTERVAL
+                await edit_status(status, f'⏳ Импорт: сохранено задач {imported:,}, пропущено строк {failed:,}…')
+
+        if reminder_ids is not None:
+            await run_db(reminder_dispatcher.add_range, *reminder_ids)
+        text = f'✅ Импорт завершен: задач {imported:,}, напоминаний запланировано {scheduled:,}.'
+        if failed:
+            text += f'\n\n⚠️ Пропущено строк: {failed:,}\n' + '\n'.join(
+                f'• строка {line_no}: {html.escape(reason)}' for line_no, reason in errors
+            )
+        logger.info("Импорт задач пользователя %s: сохранено %s, пропущено %s", user_id, imported, failed)
+    except Exception as e:
+        logger.error("Ошибка импорта задач пользователя %s: %s", user_id, e)
+        text = f'❌ Импорт прерван из-за ошибки. Сохранено задач: {imported:,}.'
+    finally:
+        if rows_file is not None:
+            rows_file.close()
+        os.remove(path)
+        active_imports.discard(user_id)
+        render_cache.invalidate(user_id, 'tasks')
+    await edit_status(status, text)
+
+async def export_command(update: Update, context: CallbackContext):
+    """/export [csv|jsonl|ics] [gz]: выгрузка своих данных файлом; /export all ... — всех пользователей (администратор)."""
+    args = [arg.lower() for arg in context.args or []]
+    everyone = bool(args) and args[0] == 'all'
+    if everyone:
+        if not is_admin(update):
+            return
+        args = args[1:]
+    formats = [arg for arg in args if arg in EXPORT_FORMATS]
+    compress = 'gz' in args
+    if len(formats) > 1 or len(formats) + compress != len(args):
+        await update.message.reply_text(
+            'Использование: <code>/export [csv|jsonl|ics] [gz]</code>', parse_mode=ParseMode.HTML
+        )
+        return
+    requester = owner_id(update, context)
+    if requester in active_exports:
+        await update.message.reply_text('⏳ Предыдущая выгрузка еще готовится, дождитесь ее.')
+        return
+    active_exports.add(requester)
+    status = await update.message.reply_text('⏳ Готовлю выгрузку…')
+    context.application.create_task(run_export(
+        update.effective_chat.id, requester, None if everyone else requester,
+        formats[0] if formats else 'csv', compress, status
+    ))
+
+async def run_export(chat_id, requester, user_id, fmt, compress, status):
+    """Выгружает данные пользователя user_id (None — всех) во временный файл и присылает его документом."""
+    name = f"tasks-{'all' if user_id is None else user_id}-{datetime.now(TIMEZONE):%Y%m%d-%H%M}.{fmt}"
+    if compress:
+        name += '.gz'
+    fd, path = tempfile.mkstemp(suffix=f'-{name}')
+    os.close(fd)
+    export = None
+    try:
+        export = await run_db(Exporter, db, path, fmt, TIMEZONE, user_id, compress)
+        next_progress = time.monotonic() + EXPORT_PROGRESS_INTERVAL
+        while await run_db(export.step):
+            if time.monotonic() >= next_progress:
+                next_progress = time.monotonic() + EXPORT_PROGRESS_INTERVAL
+                await edit_status(status, f'⏳ Выгрузка: строк {export.rows:,}, пользователей {export.users:,}…')
+        await run_db(export.close)
+        size = os.path.getsize(path)
+        logger.info("Выгрузка %s для %s: строк %s, пользователей %s, %s байт", name, requester, export.rows, export.users, size)
+        if size > EXPORT_MAX_SIZE:
+            hint = '' if compress else ' Попробуйте <code>gz</code>.'
+            await edit_status(status, f'❌ Файл выгрузки {size / 1024 / 1024:.1f} МБ больше 50 МБ, Telegram его не примет.{hint}')
+            return
+        with open(path, 'rb') as f:
+            await application.bot.send_document(chat_id=chat_id, document=f, filename=name)
+        await edit_status(status, f'✅ Выгрузка готова: строк {export.rows:,}.')
+    except Exception as e:
+        logger.error("Ошибка выгрузки для %s: %s", requester, e)
+        await edit_status(status, '❌ Выгрузка прервана из-за ошибки.')
+    finally:
+        if export is not None and not export.file.closed:
+            export.file.close()
+        os.remove(path)
+        active_exports.discard(requester)
+
+async def count_update(update: Update, context: CallbackContext):
+    """Считает входящие обновления; зарегистрирован в группе -1 и не мешает остальным обработчикам."""
+    kind = 'callback_query' if update.callback_query else 'message' if update.message else 'other'
+    updates_total.labels(kind).inc()
+
+def is_admin(update: Update):
+    return bool(ADMIN_CHAT_ID) and str(update.effective_chat.id) == str(ADMIN_CHAT_ID)
+
+async def cache_stats(update: Update, context: CallbackContext):
+    """Показывает администратору попадания и промахи кэша отрисовки."""
+    if not is_admin(update):
+        return
+    stats = render_cache.stats()
+    await update.message.reply_text(
+        f"🗂 Кэш: записей {stats['entries']}, попаданий {stats['hits']}, промахов {stats['misses']}, "
+        f"вытеснено {stats['evictions']}, доля попаданий {stats['hit_ratio']:.1%}"
+    )
 
-def start(update: Update, context: CallbackContext):
+def format_ms(seconds):
+    """Оценка квантиля гистограммы для сводки: верхняя граница корзины."""
+    if not seconds:
+        return '—'
+    return '>10 с' if seconds == float('inf') else f'≤{seconds * 1000:g} мс'
+
+async def metrics_command(update: Update, context: CallbackContext):
+    """Показывает администратору сводку метрик: обработчики, SQL, напоминания и очередь исходящих."""
+    if not is_admin(update):
+        return
+    uptime = time.time() - metrics_started
+    updates = sum(counter.value for _, counter in updates_total.children())
+    lines = [f"📈 Метрики за {uptime / 3600:.1f} ч", f"Обновлений: {updates} ({updates / uptime:.2f}/с)", "", "Обработчики (вызовов, p50, p95):"]
+    handlers = sorted(handler_seconds.children(), key=lambda item: -item[1].count)
+    for (name,), histogram in handlers[:10]:
+        lines.append(f"• {name}: {histogram.count}, {format_ms(histogram.quantile(0.5))}, {format_ms(histogram.quantile(0.95))}")
+    lines += ["", "SQL (запросов, p95):"]
+    statements = sorted(sql_seconds.children(), key=lambda item: -item[1].sum)
+    for (statement, table), histogram in statements[:8]:
+        lines.append(f"• {statement} {table}: {histogram.count}, {format_ms(histogram.quantile(0.95))}")
+    sent = notifications_total.labels('ok').value
+    failed = notifications_total.labels('error').value
+    outbound = outbound_limiter.stats()
+    lines += [
+        "",
+        f"Напоминания: в окне {reminder_dispatcher.loaded}, сработало {reminder_dispatcher.fired}, "
+        f"отставание p95 {format_ms(reminder_lag_seconds.quantile(0.95))}",
+        f"Отправка: успешно {sent}, с ошибкой {failed}, p95 {format_ms(notification_seconds.quantile(0.95))}",
+        f"Очередь исходящих: {outbound['queue_depth']}, {outbound['sent_per_second']:.1f}/с, повторов {outbound['retried_total']}",
+    ]
+    await update.message.reply_text('\n'.join(lines))
+
+async def profile_command(update: Update, context: CallbackContext):
+    """/profile [sample|trace] [секунды]: профилирует бота заданное время и присылает файл и сводку."""
+    if not is_admin(update):
+        return
+    args = context.args or []
+    mode = args[0] if args else 'sample'
+    try:
+        seconds = int(args[1]) if len(args) > 1 else 30
+    except ValueError:
+        seconds = 0
+    if mode not in PROFILE_MODES or seconds <= 0:
+        await update.message.reply_text('Использование: /profile [sample|trace] [секунды]')
+        return
+    if profiler.active:
+        await update.message.reply_text(f'⏱ Профилирование ({profiler.active}) уже идет.')
+        return
+    await update.message.reply_text(f'⏱ Профилирование {mode} на {min(seconds, profiler.max_seconds)} с запущено.')
+    # Окно профилирования не должно держать обработку этого обновления
+    context.application.create_task(send_profile(update.effective_chat.id, mode, seconds))
+
+async def send_profile(chat_id, mode, seconds):
+    try:
+        path, summary = await profiler.run(mode, seconds)
+    except Exception as e:
+        logger.error("Ошибка профилирования: %s", e)
+        await application.bot.send_message(chat_id=chat_id, text=f'Профилирование не удалось: {e}')
+        return
+    logger.info("Результат профилирования сохранен в %s", path)
+    await application.bot.send_message(chat_id=chat_id, text=summary[:4096])
+    with open(path, 'rb') as f:
+        await application.bot.send_document(chat_id=chat_id, document=f, filename=os.path.basename(path))
+
+async def start(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
     context.user_data['user_id'] = chat_id
-    logger.info(f"Пользователь {chat_id} начал взаимодействие с ботом.")
-    return main_menu(update, context)
+    logger.info("Пользователь %s начал взаимодействие с ботом.", chat_id)
+    return await main_menu(update, context)
 
-def main_menu(update: Update, context: CallbackContext):
-    keyboard = [
-        [InlineKeyboardButton('➕ Добавить задачу', callback_data='main_add_task')],
-        [InlineKeyboardButton('📅 Расписание на неделю', callback_data='main_weekly_schedule')],
-        [InlineKeyboardButton('📝 Быстрая заметка', callback_data='main_quick_note')],
-        [InlineKeyboardButton('🔔 Настройки', callback_data='main_settings')],
-        [InlineKeyboardButton('📌 Подписки', callback_data='main_subscriptions')],
-        [InlineKeyboardButton('📋 Мои задачи', callback_data='main_my_tasks')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+async def main_menu(update: Update, context: CallbackContext):
+    reply_markup = InlineKeyboardMarkup(menu_keyboard('main'))
     welcome_text = '👋 <b>Добро пожаловать в To-Do бот!</b>\nВыберите действие:'
     try:
         if update.callback_query:
             query = update.callback_query
-            query.edit_message_text(welcome_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            await query.edit_message_text(welcome_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
         else:
-            update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     except Exception as e:
-        logger.error(f"Ошибка при редактировании главного меню: {e}")
+        logger.error("Ошибка при редактировании главного меню: %s", e)
     return CHOOSING
 
-def button_handler(update: Update, context: CallbackContext):
+async def add_task_start(update: Update, context: CallbackContext):
     query = update.callback_query
-    data = query.data
-    logger.info(f"Получены данные callback_data: {data}")
-    query.answer()
-
-    if data == 'main_add_task':
-        context.user_data['previous_menu'] = 'main_menu'
-        try:
-            query.edit_message_text('📌 <b>Добавление задачи:</b>\nВведите топик задачи.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения для добавления задачи: {e}")
-            query.message.reply_text('📌 <b>Добавление задачи:</b>\nВведите топик задачи.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return ADD_TASK_TOPIC
-
-    elif data == 'main_my_tasks':
-        context.user_data['previous_menu'] = 'main_menu'
-        return my_tasks(update, context)
-
-    elif data == 'main_weekly_schedule':
-        context.user_data['previous_menu'] = 'main_menu'
-        return manage_schedule(update, context)
-
-    elif data == 'main_quick_note':
-        context.user_data['previous_menu'] = 'main_menu'
-        try:
-            query.edit_message_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения для быстрой заметки: {e}")
-            query.message.reply_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return QUICK_NOTE
-
-    elif data == 'main_settings':
-        return settings_menu(update, context)
-
-    elif data == 'main_subscriptions':
-        return subscriptions_menu(update, context)
-
-    elif data == 'back':
-        return main_menu(update, context)
+    try:
+        await query.edit_message_text('📌 <b>Добавление задачи:</b>\nВведите топик задачи.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения для добавления задачи: %s", e)
+        await query.message.reply_text('📌 <b>Добавление задачи:</b>\nВведите топик задачи.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+    return ADD_TASK_TOPIC
 
-    else:
-        logger.warning(f"Неизвестные callback_data: {data}")
-        return CHOOSING
+async def quick_note_start(update: Update, context: CallbackContext):
+    query = update.callback_query
+    try:
+        await query.edit_message_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения для быстрой заметки: %s", e)
+        await query.message.reply_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+    return QUICK_NOTE
 
-def add_task_topic(update: Update, context: CallbackContext):
+async def add_task_topic(update: Update, context: CallbackContext):
     topic = update.message.text
     context.user_data['task_topic'] = topic
-    logger.info(f"Получен топик задачи: {topic}")
+    logger.info("Получен топик задачи: %s", topic)
     # Спрашиваем, нужно ли прикреплять материалы
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Да", callback_data='attach_yes'),
-            InlineKeyboardButton("❌ Нет", callback_data='attach_no')
-        ],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
+    keyboard = menu_keyboard('attach', columns=2) + [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    update.message.reply_text('Хотите прикрепить к задаче файлы, ссылки, видео или фото?', reply_markup=reply_markup)
+    await update.message.reply_text('Хотите прикрепить к задаче файлы, ссылки, видео или фото?', reply_markup=reply_markup)
     return ADD_TASK_ATTACHMENTS
 
-def add_task_attachments_handler(update: Update, context: CallbackContext):
+async def add_task_attach(update: Update, context: CallbackContext):
     query = update.callback_query
-    data = query.data
-    logger.info(f"Получено решение прикреплять материалы: {data}")
-    query.answer()
+    try:
+        await query.edit_message_text('📎 Прикрепите материалы к задаче. Когда закончите, нажмите кнопку "✅ Готово".', reply_markup=done_button(), parse_mode=ParseMode.HTML)
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения для прикрепления материалов: %s", e)
+        await query.message.reply_text('📎 Прикрепите материалы к задаче. Когда закончите, нажмите кнопку "✅ Готово".', reply_markup=done_button(), parse_mode=ParseMode.HTML)
+    context.user_data['attachments'] = []
+    return ADD_TASK_ATTACHMENTS
 
-    if data == 'attach_yes':
-        try:
-            query.edit_message_text('📎 Прикрепите материалы к задаче. Когда закончите, нажмите кнопку "✅ Готово".', reply_markup=done_button(), parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения для прикрепления материалов: {e}")
-            query.message.reply_text('📎 Прикрепите материалы к задаче. Когда закончите, нажмите кнопку "✅ Готово".', reply_markup=done_button(), parse_mode=ParseMode.HTML)
-        context.user_data['attachments'] = []
-        return ADD_TASK_ATTACHMENTS
-    elif data == 'attach_no':
-        context.user_data['attachments'] = []
-        # Запрашиваем время задачи
-        try:
-            query.edit_message_text(
-                '🕒 Теперь отправьте время задачи в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке запроса времени задачи: {e}")
-            query.message.reply_text(
-                '🕒 Теперь отправьте время задачи в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-        return TYPING_TIME
-    elif data == 'back':
-        return add_task_topic(update, context)
-    else:
-        logger.warning(f"Неизвестное callback_data в прикреплениях: {data}")
-        return ADD_TASK_ATTACHMENTS
+async def add_task_skip_attachments(update: Update, context: CallbackContext):
+    context.user_data['attachments'] = []
+    return await add_task_done(update, context)
 
-def add_task_done(update: Update, context: CallbackContext):
+async def add_task_done(update: Update, context: CallbackContext):
     query = update.callback_query
-    query.answer()
     # Запрашиваем время задачи
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             '🕒 Теперь отправьте время задачи в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
             parse_mode=ParseMode.HTML,
             reply_markup=back_button()
         )
     except Exception as e:
-        logger.error(f"Ошибка при отправке запроса времени задачи после прикреплений: {e}")
-        query.message.reply_text(
+        logger.error("Ошибка при отправке запроса времени задачи после прикреплений: %s", e)
+        await query.message.reply_text(
             '🕒 Теперь отправьте время задачи в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
             parse_mode=ParseMode.HTML,
             reply_markup=back_button()
@@ -251,55 +693,65 @@ def back_button():
     return InlineKeyboardMarkup(keyboard)
 
 def done_button():
-    keyboard = [[InlineKeyboardButton('✅ Готово', callback_data='done')]]
-    return InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup(menu_keyboard('attachments'))
+
+def menu_keyboard(menu, columns=1):
+    """Строки кнопок меню из таблицы маршрутов."""
+    return [[InlineKeyboardButton(label, callback_data=data) for label, data in row] for row in router.menu(menu, columns)]
+
+async def route_callback(state, update: Update, context: CallbackContext):
+    """Отвечает на нажатие и вызывает обработчик, найденный в таблице маршрутов состояния state."""
+    query = update.callback_query
+    handler, args = router.resolve(state, query.data)
+    with handler_scope(update, state, handler.__name__):
+        logger.info("Получены данные callback_data: %s", query.data)
+        await query.answer()
+        return await handler(update, context, *args)
+
+def callback_handler(state):
+    """Один CallbackQueryHandler на состояние: кнопка проверяется поиском в словаре, а не регулярным выражением."""
+    return CallbackQueryHandler(partial(route_callback, state), pattern=partial(router.matches, state))
 
-def received_task_attachment(update: Update, context: CallbackContext):
+def main_menu_handler():
+    """Кнопки главного меню открывают диалог из любого состояния (allow_reentry).
+
+    Остальные кнопки, включая «Назад», обрабатывают сами состояния: точки входа проверяются раньше них.
+    """
+    buttons = {data for row in router.menu('main') for _, data in row}
+    return CallbackQueryHandler(partial(route_callback, CHOOSING), pattern=lambda data: data in buttons)
+
+async def received_task_attachment(update: Update, context: CallbackContext):
     user_input = update.message
 
     if user_input.text and user_input.text.lower() == 'готово':
         # Завершение прикрепления
-        update.message.reply_text('📌 Прикрепление материалов завершено. Переходим к времени задачи.', reply_markup=back_button())
+        await update.message.reply_text('📌 Прикрепление материалов завершено. Переходим к времени задачи.', reply_markup=back_button())
         # Запрашиваем время задачи
-        update.message.reply_text(
+        await update.message.reply_text(
             '🕒 Теперь отправьте время задачи в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
             parse_mode=ParseMode.HTML,
             reply_markup=back_button()
         )
         return TYPING_TIME
 
-    # Обработка различных типов вложений
-    attachment = None
-    if user_input.document:
-        attachment = f'📄 Файл: {user_input.document.file_name}'
-    elif user_input.photo:
-        attachment = '🖼️ Фото'
-    elif user_input.video:
-        attachment = '📹 Видео'
-    elif user_input.text and user_input.entities:
-        # Проверка на ссылки
-        for entity in user_input.entities:
-            if entity.type == 'url':
-                attachment = f'🔗 Ссылка: {user_input.text[entity.offset:entity.offset + entity.length]}'
-                break
-    elif user_input.text:
-        attachment = user_input.text
+    # Файлы, фото и видео запоминаем по file_id, чтобы напоминание доставило сам файл
+    attachment = task_attachments.from_message(user_input)
 
     if attachment:
         context.user_data['attachments'].append(attachment)
-        update.message.reply_text(f'✅ Добавлено: {attachment}', reply_markup=done_button())
+        await update.message.reply_text(f'✅ Добавлено: {task_attachments.label(attachment)}', reply_markup=done_button())
     else:
-        update.message.reply_text('❌ Не удалось распознать прикрепленный материал. Попробуйте снова.', reply_markup=done_button())
+        await update.message.reply_text('❌ Не удалось распознать прикрепленный материал. Попробуйте снова.', reply_markup=done_button())
 
     return ADD_TASK_ATTACHMENTS
 
-def received_time(update: Update, context: CallbackContext):
+async def received_time(update: Update, context: CallbackContext):
     input_time = update.message.text
-    logger.info(f"Получено время задачи: {input_time}")
+    logger.info("Получено время задачи: %s", input_time)
     try:
         task_time = parse_time(input_time)
         if not task_time:
-            update.message.reply_text(
+            await update.message.reply_text(
                 '❌ Неверный формат времени. Пожалуйста, используйте формат <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code>',
                 parse_mode=ParseMode.HTML,
                 reply_markup=back_button()
@@ -312,18 +764,12 @@ def received_time(update: Update, context: CallbackContext):
 
         task_info = f"📝 <b>Топик:</b> {context.user_data['task_topic']}\n⏰ <b>Время:</b> {task_time.strftime('%Y-%m-%d %H:%M')}"
         if attachments:
-            task_info += "\n📎 <b>Прикрепленные материалы:</b>\n" + "\n".join(attachments)
-
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Да", callback_data='conf_confirm_yes'),
-                InlineKeyboardButton("❌ Нет", callback_data='conf_confirm_no')
-            ],
-            [InlineKeyboardButton('🔙 Назад', callback_data='conf_back')]
-        ]
+            task_info += "\n📎 <b>Прикрепленные материалы:</b>\n" + "\n".join(map(task_attachments.label, attachments))
+
+        keyboard = menu_keyboard('confirm', columns=2) + menu_keyboard('confirm_back')
         reply_markup = InlineKeyboardMarkup(keyboard)
         # Отправляем новое сообщение с подтверждением
-        update.message.reply_text(
+        await update.message.reply_text(
             f'📋 <b>Проверьте информацию:</b>\n{task_info}\n\nВсе верно?',
             reply_markup=reply_markup,
             parse_mode=ParseMode.HTML
@@ -331,172 +777,147 @@ def received_time(update: Update, context: CallbackContext):
         logger.info("Отправлено подтверждение задачи.")
         return CONFIRMING
     except Exception as e:
-        logger.error(f"Ошибка при обработке времени: {e}")
-        update.message.reply_text(
+        logger.error("Ошибка при обработке времени: %s", e)
+        await update.message.reply_text(
             '⚠️ Произошла ошибка при обработке времени. Пожалуйста, попробуйте снова.',
             reply_markup=back_button()
         )
         return TYPING_TIME
 
 def parse_time(input_time):
-    now = datetime.now(TIMEZONE)
-    try:
-        if len(input_time) == 5:  # Формат ЧЧ:ММ
-            task_time = datetime.strptime(input_time, '%H:%M').replace(
-                year=now.year,
-                month=now.month,
-                day=now.day
-            )
-            task_time = TIMEZONE.localize(task_time)
-            if task_time < now:
-                task_time += timedelta(days=1)
-            logger.info(f"Parsed time (ЧЧ:ММ): {task_time}")
-        elif len(input_time) == 16:  # Формат ГГГГ-ММ-ДД ЧЧ:ММ
-            task_time = datetime.strptime(input_time, '%Y-%m-%d %H:%M')
-            task_time = TIMEZONE.localize(task_time)
-            logger.info(f"Parsed time (ГГГГ-ММ-ДД ЧЧ:ММ): {task_time}")
-        else:
-            logger.warning("Введено время неподходящего формата.")
-            return None
-        return task_time
-    except ValueError:
-        logger.warning("Ошибка при парсинге времени.")
-        return None
+    # Те же правила применяются к строкам импортируемых файлов (importer.next_batch)
+    task_time = parse_task_time(input_time, datetime.now(TIMEZONE), TIMEZONE)
+    if task_time is None:
+        logger.warning("Введено время неподходящего формата.")
+    else:
+        logger.info("Parsed time: %s", task_time)
+    return task_time
 
-def confirm_task(update: Update, context: CallbackContext):
+async def confirm_task(update: Update, context: CallbackContext):
     query = update.callback_query
-    data = query.data
-    logger.info(f"Получено подтверждение задачи: {data}")
-    query.answer()
-
-    if data == 'conf_confirm_yes':
-        user_id = context.user_data.get('user_id')
-        topic = context.user_data.get('task_topic')
-        time = context.user_data.get('task_time')
-        attachments = context.user_data.get('attachments', [])
-
-        if topic and time:
-            # Сохраняем задачу в базу данных
-            cursor.execute('INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)',
-                           (user_id, topic, '', '; '.join(attachments), time.strftime('%Y-%m-%d %H:%M')))
-            conn.commit()
-
-            # Планируем напоминание
-            notification_time = context.user_data.get('notification_time', DEFAULT_NOTIFICATION_TIME)
-            schedule_notification(user_id, topic, time, notification_time, attachments)
+    user_id = context.user_data.get('user_id')
+    topic = context.user_data.get('task_topic')
+    time = context.user_data.get('task_time')
+    attachments = context.user_data.get('attachments', [])
 
-            try:
-                query.edit_message_text('✅ Задача сохранена! Уведомление будет отправлено вовремя.')
-                logger.info("Задача успешно сохранена и напоминание запланировано.")
-            except Exception as e:
-                logger.error(f"Ошибка при редактировании сообщения после сохранения задачи: {e}")
-                query.message.reply_text('✅ Задача сохранена! Уведомление будет отправлено вовремя.')
+    if topic and time:
+        # Сохраняем задачу в базу данных вместе с вложениями
+        stored = await wait_written(writer.call(
+            lambda conn: save_task(conn, user_id, topic, attachments, time)
+        ))
+        render_cache.invalidate(user_id, 'tasks')
 
-            return main_menu(update, context)
+        # Планируем напоминание
+        notification_time = context.user_data.get('notification_time', DEFAULT_NOTIFICATION_TIME)
+        await schedule_notification(user_id, topic, time, notification_time, stored)
 
-        else:
-            try:
-                query.edit_message_text('❌ Ошибка: отсутствуют данные задачи или времени.')
-                logger.error("Отсутствуют данные задачи или времени.")
-            except Exception as e:
-                logger.error(f"Ошибка при редактировании сообщения об ошибке: {e}")
-                query.message.reply_text('❌ Ошибка: отсутствуют данные задачи или времени.')
-            return main_menu(update, context)
-
-    elif data == 'conf_confirm_no':
         try:
-            query.edit_message_text('❌ Добавление задачи отменено.', reply_markup=back_button())
-            logger.info("Добавление задачи отменено пользователем.")
+            await query.edit_message_text('✅ Задача сохранена! Уведомление будет отправлено вовремя.')
+            logger.info("Задача успешно сохранена и напоминание запланировано.")
         except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения после отмены задачи: {e}")
-            query.message.reply_text('❌ Добавление задачи отменено.', reply_markup=back_button())
-        return main_menu(update, context)
+            logger.error("Ошибка при редактировании сообщения после сохранения задачи: %s", e)
+            await query.message.reply_text('✅ Задача сохранена! Уведомление будет отправлено вовремя.')
 
-    elif data == 'conf_back':
-        # Возвращаемся к вводу времени
+        return await main_menu(update, context)
+
+    else:
         try:
-            query.edit_message_text(
-                '🕒 Отправьте время задачи в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-            logger.info("Возврат к вводу времени.")
+            await query.edit_message_text('❌ Ошибка: отсутствуют данные задачи или времени.')
+            logger.error("Отсутствуют данные задачи или времени.")
         except Exception as e:
-            logger.error(f"Ошибка при возврате к вводу времени: {e}")
-            query.message.reply_text(
-                '🕒 Отправьте время задачи в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-        return TYPING_TIME
+            logger.error("Ошибка при редактировании сообщения об ошибке: %s", e)
+            await query.message.reply_text('❌ Ошибка: отсутствуют данные задачи или времени.')
+        return await main_menu(update, context)
+
+def save_task(conn, user_id, topic, attachments, task_time):
+    """Сохраняет задачу и ее вложения одной транзакцией; возвращает вложения с id.
+
+    В tasks.attachments остаются подписи вложений — по ним отрисовывается список задач.
+    """
+    cur = conn.execute(
+        'INSERT INTO tasks (user_id, topic, description, attachments, time, due_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (user_id, topic, '', '; '.join(map(task_attachments.label, attachments)),
+         task_time.strftime('%Y-%m-%d %H:%M'), int(task_time.timestamp()))
+    )
+    return task_attachments.store(conn, cur.lastrowid, attachments)
 
-    else:
-        logger.warning(f"Неизвестное подтверждение задачи: {data}")
-        return CONFIRMING
+async def cancel_task(update: Update, context: CallbackContext):
+    query = update.callback_query
+    try:
+        await query.edit_message_text('❌ Добавление задачи отменено.', reply_markup=back_button())
+        logger.info("Добавление задачи отменено пользователем.")
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения после отмены задачи: %s", e)
+        await query.message.reply_text('❌ Добавление задачи отменено.', reply_markup=back_button())
+    return await main_menu(update, context)
+
+async def return_to_task_time(update: Update, context: CallbackContext):
+    query = update.callback_query
+    # Возвращаемся к вводу времени
+    try:
+        await query.edit_message_text(
+            '🕒 Отправьте время задачи в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
+            parse_mode=ParseMode.HTML,
+            reply_markup=back_button()
+        )
+        logger.info("Возврат к вводу времени.")
+    except Exception as e:
+        logger.error("Ошибка при возврате к вводу времени: %s", e)
+        await query.message.reply_text(
+            '🕒 Отправьте время задачи в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
+            parse_mode=ParseMode.HTML,
+            reply_markup=back_button()
+        )
+    return TYPING_TIME
 
-def manage_schedule(update: Update, context: CallbackContext):
+async def manage_schedule(update: Update, context: CallbackContext):
     """Менеджер расписания: просмотр, добавление, сброс."""
-    keyboard = [
-        [InlineKeyboardButton('➕ Добавить расписание', callback_data='schedule_add')],
-        [InlineKeyboardButton('🗑️ Сбросить расписание', callback_data='schedule_reset')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
+    keyboard = menu_keyboard('schedule') + [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     try:
         if update.callback_query:
             query = update.callback_query
-            query.edit_message_text('📅 <b>Управление расписанием:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            await query.edit_message_text('📅 <b>Управление расписанием:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
         else:
-            update.message.reply_text('📅 <b>Управление расписанием:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            await update.message.reply_text('📅 <b>Управление расписанием:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     except Exception as e:
-        logger.error(f"Ошибка при редактировании меню управления расписанием: {e}")
+        logger.error("Ошибка при редактировании меню управления расписанием: %s", e)
         if update.callback_query:
-            update.callback_query.message.reply_text('📅 <b>Управление расписанием:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            await update.callback_query.message.reply_text('📅 <b>Управление расписанием:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
         else:
-            update.message.reply_text('📅 <b>Управление расписанием:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            await update.message.reply_text('📅 <b>Управление расписанием:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    return SELECT_DAY
+
+async def choose_schedule_day(update: Update, context: CallbackContext):
+    """Выбор дня недели для нового расписания."""
+    query = update.callback_query
+    keyboard = menu_keyboard('schedule_days', columns=2) + [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    try:
+        await query.edit_message_text('📅 Выберите день недели:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения выбора дня: %s", e)
+        await query.message.reply_text('📅 Выберите день недели:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     return SELECT_DAY
 
-def select_schedule_day(update: Update, context: CallbackContext):
+async def select_schedule_day(update: Update, context: CallbackContext, day):
     query = update.callback_query
-    data = query.data
-    day = data.split('_')[1]  # 'schedule_Monday' -> 'Monday'
     context.user_data['schedule_day'] = day
-    logger.info(f"Выбран день для расписания: {day}")
+    logger.info("Выбран день для расписания: %s", day)
 
-    keyboard = [
-        [InlineKeyboardButton('🌅 Утро (6-12)', callback_data='schedule_time_Morning')],
-        [InlineKeyboardButton('🌇 День (12-18)', callback_data='schedule_time_Afternoon')],
-        [InlineKeyboardButton('🌃 Вечер (18-24)', callback_data='schedule_time_Evening')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
+    keyboard = menu_keyboard('schedule_times') + [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     try:
-        query.edit_message_text(f'📅 Выберите время суток для добавления расписания в {day}:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        await query.edit_message_text(f'📅 Выберите время суток для добавления расписания в {day}:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения выбора времени суток: {e}")
-        query.message.reply_text(f'📅 Выберите время суток для добавления расписания в {day}:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        logger.error("Ошибка при редактировании сообщения выбора времени суток: %s", e)
+        await query.message.reply_text(f'📅 Выберите время суток для добавления расписания в {day}:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     return SELECT_TIME_OF_DAY
 
-def select_schedule_time_of_day(update: Update, context: CallbackContext):
+async def select_schedule_time_of_day(update: Update, context: CallbackContext, time_of_day):
     query = update.callback_query
-    if query:
-        data = query.data
-    else:
-        data = update.message.text
-
-    parts = data.split('_')
-    if len(parts) < 3:
-        logger.error(f"Некорректный формат callback_data: {data}")
-        if query:
-            query.answer()
-            query.message.reply_text('❌ Некорректный формат данных. Пожалуйста, попробуйте снова.', reply_markup=back_button())
-        else:
-            update.message.reply_text('❌ Некорректный формат данных. Пожалуйста, попробуйте снова.', reply_markup=back_button())
-        return SELECT_TIME_OF_DAY
-
-    time_of_day = parts[2]  # 'schedule_time_Morning' -> 'Morning'
     context.user_data['schedule_time_of_day'] = time_of_day
-    logger.info(f"Выбрано время суток для расписания: {time_of_day}")
+    logger.info("Выбрано время суток для расписания: %s", time_of_day)
 
     # Определяем диапазон времени суток
     time_ranges = {
@@ -505,36 +926,20 @@ def select_schedule_time_of_day(update: Update, context: CallbackContext):
         'Evening': (18, 24)
     }
 
-    start_hour, end_hour = time_ranges.get(time_of_day, (6, 12))
+    start_hour, end_hour = time_ranges[time_of_day]
     hours = list(range(start_hour, end_hour))  # Например, 6-12 -> 6,7,...11
 
     context.user_data['schedule_hours'] = hours
     context.user_data['current_schedule_hour'] = 0
     context.user_data['schedule_tasks'] = {}
 
-    if hours:
-        current_hour = hours[0]
-        context.user_data['current_schedule_hour'] = 0
-        message = f'🕒 Введите задачу для {time_of_day} в {current_hour}:00:'
-        logger.info(f"Запрошена задача для {time_of_day} в {current_hour}:00")
-
-        if query:
-            query.answer()
-            query.edit_message_text(message, reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        else:
-            update.message.reply_text(message, reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return SET_SCHEDULE_HOUR
-    else:
-        error_message = '❌ Некорректный диапазон времени.'
-        logger.error("Некорректный диапазон времени.")
-        if query:
-            query.answer()
-            query.edit_message_text(error_message, reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        else:
-            update.message.reply_text(error_message, reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return manage_schedule(update, context)
+    current_hour = hours[0]
+    message = f'🕒 Введите задачу для {time_of_day} в {current_hour}:00:'
+    logger.info("Запрошена задача для %s в %s:00", time_of_day, current_hour)
+    await query.edit_message_text(message, reply_markup=back_button(), parse_mode=ParseMode.HTML)
+    return SET_SCHEDULE_HOUR
 
-def set_schedule_hour(update: Update, context: CallbackContext):
+async def set_schedule_hour(update: Update, context: CallbackContext):
     task = update.message.text
     hour_index = context.user_data['current_schedule_hour']
     hours = context.user_data['schedule_hours']
@@ -543,197 +948,255 @@ def set_schedule_hour(update: Update, context: CallbackContext):
 
     current_hour = hours[hour_index]
     context.user_data['schedule_tasks'][current_hour] = task
-    logger.info(f"Задача для {day} {time_of_day} в {current_hour}:00 установлена: {task}")
+    logger.info("Задача для %s %s в %s:00 установлена: %s", day, time_of_day, current_hour, task)
 
     # Переходим к следующему часу или завершению
     if hour_index + 1 < len(hours):
         context.user_data['current_schedule_hour'] += 1
         next_hour = hours[hour_index + 1]
         message = f'🕒 Введите задачу для {time_of_day} в {next_hour}:00:'
-        logger.info(f"Запрошена задача для {time_of_day} в {next_hour}:00")
+        logger.info("Запрошена задача для %s в %s:00", time_of_day, next_hour)
 
-        update.message.reply_text(message, reply_markup=back_button(), parse_mode=ParseMode.HTML)
+        await update.message.reply_text(message, reply_markup=back_button(), parse_mode=ParseMode.HTML)
         return SET_SCHEDULE_HOUR
     else:
         # Все задачи для выбранного времени суток введены
-        keyboard = [
-            [InlineKeyboardButton('✅ Сохранить расписание', callback_data='schedule_save')],
-            [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-        ]
+        keyboard = menu_keyboard('schedule_save') + [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text('📅 Все задачи для этого времени суток введены. Сохранить расписание?', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        await update.message.reply_text('📅 Все задачи для этого времени суток введены. Сохранить расписание?', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
         logger.info("Запрошено сохранение расписания.")
         return SAVE_SCHEDULE
 
-def save_schedule(update: Update, context: CallbackContext):
+async def save_schedule(update: Update, context: CallbackContext):
     query = update.callback_query
-    query.answer()
     user_id = context.user_data.get('user_id')
     day = context.user_data.get('schedule_day')
     time_of_day = context.user_data.get('schedule_time_of_day')
     tasks = context.user_data.get('schedule_tasks', {})
 
-    for hour, task in tasks.items():
-        cursor.execute('INSERT INTO schedules (user_id, day, time_of_day, hour, task) VALUES (?, ?, ?, ?, ?)',
-                       (user_id, day, time_of_day, hour, task))
-    conn.commit()
+    await wait_written(writer.write_many(
+        'INSERT INTO schedules (user_id, day, time_of_day, hour, task) VALUES (?, ?, ?, ?, ?)',
+        [(user_id, day, time_of_day, hour, task) for hour, task in tasks.items()]
+    ))
 
     try:
-        query.edit_message_text('✅ Расписание сохранено.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+        await query.edit_message_text('✅ Расписание сохранено.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
         logger.info("Расписание успешно сохранено.")
     except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения после сохранения расписания: {e}")
-        query.message.reply_text('✅ Расписание сохранено.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+        logger.error("Ошибка при редактировании сообщения после сохранения расписания: %s", e)
+        await query.message.reply_text('✅ Расписание сохранено.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
 
-    return manage_schedule(update, context)
+    return await manage_schedule(update, context)
 
-def reset_schedule(update: Update, context: CallbackContext):
+async def reset_schedule(update: Update, context: CallbackContext):
     """Функция для сброса расписания пользователя."""
     query = update.callback_query
-    query.answer()
     user_id = context.user_data.get('user_id')
-    cursor.execute('DELETE FROM schedules WHERE user_id = ?', (user_id,))
-    conn.commit()
+    await wait_written(writer.write('DELETE FROM schedules WHERE user_id = ?', (user_id,)))
     try:
-        query.edit_message_text('🗑️ Расписание сброшено.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+        await query.edit_message_text('🗑️ Расписание сброшено.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
         logger.info("Расписание сброшено пользователем.")
     except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения после сброса расписания: {e}")
-        query.message.reply_text('🗑️ Расписание сброшено.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-    return manage_schedule(update, context)
+        logger.error("Ошибка при редактировании сообщения после сброса расписания: %s", e)
+        await query.message.reply_text('🗑️ Расписание сброшено.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+    return await manage_schedule(update, context)
 
-def schedule_notification(chat_id, task, time, notification_time, attachments):
+async def schedule_notification(chat_id, task, time, notification_time, attachments):
     notify_time = time - timedelta(minutes=notification_time)
     now = datetime.now(TIMEZONE)
     if notify_time < now:
-        send_notification(chat_id, task, attachments)
-        logger.info(f"Напоминание отправлено сразу для задачи '{task}'.")
+        await send_notification(chat_id, task, attachments)
+        logger.info("Напоминание отправлено сразу для задачи '%s'.", task)
     else:
         try:
-            job_id = f"notif_{chat_id}_{task}_{notify_time.timestamp()}"
-            scheduler.add_job(
-                send_notification,
-                'date',
-                run_date=notify_time,
-                args=[chat_id, task, attachments],
-                timezone=TIMEZONE,
-                id=job_id
+            # Сохраняем напоминание в базе, чтобы оно пережило перезапуск бота
+            reminder_id = await wait_written(writer.call(
+                lambda conn: add_reminder(conn, chat_id, task, task_attachments.refs(attachments), notify_time.timestamp())
+            ))
+            reminder_dispatcher.add(reminder_id, int(notify_time.timestamp()))
+            logger.info("Запланировано напоминание для задачи '%s' на %s.", task, notify_time)
+        except Exception as e:
+            logger.error("Ошибка при планировании напоминания: %s", e)
+
+async def send_reminders(rows):
+    """Отправляет пачку наступивших напоминаний (строки уже удалены из базы диспетчером).
+
+    Все сообщения пачки ставятся в исходящую очередь сразу; темп отправки задает outbound_limiter.
+    """
+    now = time.time()
+    for row in rows:
+        reminder_lag_seconds.observe(now - row[4])
+    # Вложения всей пачки читаем одним запросом
+    ids = {ref for row in rows for ref in row[3] if not isinstance(ref, str)}
+    loaded = await run_db(task_attachments.load, db, ids) if ids else {}
+    await asyncio.gather(*(
+        send_notification(chat_id, task, task_attachments.resolve(attachments, loaded))
+        for reminder_id, chat_id, task, attachments, due_at in rows
+    ))
+    logger.info("Отправлено напоминаний в пачке: %s", len(rows))
+
+async def send_weekly_schedule(day, hour, users):
+    """Отправляет пачке пользователей их задачи из недельного расписания на наступивший час."""
+    async def send(user_id, tasks):
+        text = f'📅 <b>Расписание на {hour}:00:</b>\n' + '\n'.join(f'• {task}' for _, _, task in tasks)
+        try:
+            await application.bot.send_message(
+                chat_id=user_id, text=text, parse_mode=ParseMode.HTML,
+                rate_limit_args={'priority': PRIORITY_REMINDER}
             )
-            logger.info(f"Запланировано напоминание для задачи '{task}' на {notify_time}.")
         except Exception as e:
-            logger.error(f"Ошибка при планировании напоминания: {e}")
+            logger.error("Ошибка при отправке расписания пользователю %s: %s", user_id, e)
+
+    await asyncio.gather(*(send(user_id, tasks) for user_id, tasks in users))
 
-def send_notification(chat_id, task, attachments):
+# Отправка одиночного вложения и элемент альбома sendMediaGroup по виду вложения
+SEND_MEDIA = {'photo': 'send_photo', 'video': 'send_video', 'document': 'send_document'}
+INPUT_MEDIA = {'photo': InputMediaPhoto, 'video': InputMediaVideo, 'document': InputMediaDocument}
+
+async def send_notification(chat_id, task, attachments):
+    """Отправляет напоминание: текст со ссылками, затем файлы альбомами sendMediaGroup."""
+    labels, albums = task_attachments.split(attachments)
     notification_text = f'🔔 <b>Напоминание о задаче:</b>\n📝 {task}'
-    if attachments:
-        notification_text += '\n\n📎 <b>Прикрепленные материалы:</b>\n' + '\n'.join(attachments)
+    if labels:
+        notification_text += '\n\n📎 <b>Прикрепленные материалы:</b>\n' + '\n'.join(labels)
+    started = time.perf_counter()
     try:
-        updater.bot.send_message(chat_id=chat_id, text=notification_text, parse_mode=ParseMode.HTML)
-        logger.info(f"Напоминание отправлено для задачи: {task}")
+        await application.bot.send_message(
+            chat_id=chat_id, text=notification_text, parse_mode=ParseMode.HTML,
+            rate_limit_args={'priority': PRIORITY_REMINDER}
+        )
+        for album in albums:
+            if len(album) == 1:
+                send = getattr(application.bot, SEND_MEDIA[album[0]['kind']])
+                await send(chat_id, album[0]['file_id'], rate_limit_args={'priority': PRIORITY_REMINDER})
+            else:
+                await application.bot.send_media_group(
+                    chat_id=chat_id, media=[INPUT_MEDIA[item['kind']](item['file_id']) for item in album],
+                    rate_limit_args={'priority': PRIORITY_REMINDER}
+                )
+        notifications_total.labels('ok').inc()
+        logger.info("Напоминание отправлено для задачи: %s", task)
     except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления: {e}")
+        notifications_total.labels('error').inc()
+        logger.error("Ошибка при отправке уведомления: %s", e)
+    notification_seconds.observe(time.perf_counter() - started)
 
-def my_tasks(update: Update, context: CallbackContext):
+async def my_tasks(update: Update, context: CallbackContext, kind=None, page=None):
     query = update.callback_query
-    query.answer()
     user_id = context.user_data.get('user_id')
 
-    cursor.execute('SELECT topic, description, attachments, time FROM tasks WHERE user_id = ? ORDER BY time', (user_id,))
-    tasks = cursor.fetchall()
-    if tasks:
-        message = '📋 <b>Ваши задачи:</b>\n\n'
-        for task in tasks:
-            topic, description, attachments, time_str = task
-            message += f"• 📝 <b>Топик:</b> {topic}\n  ⏰ <b>Время:</b> {time_str}\n"
-            if attachments:
-                message += f"  📎 <b>Прикрепления:</b> {attachments}\n"
-            message += "\n"
-    else:
+    # Кнопки листания передают ключ (time, id) соседней страницы
+    after = before = None
+    if kind == 'after':
+        after = parse_page_key(page)
+    elif kind == 'before':
+        before = parse_page_key(page)
+
+    cache_key = (user_id, 'tasks', f'{kind}:{page}' if kind else 'first')
+    page = render_cache.get(cache_key)
+    if page is None:
+        token = render_cache.begin()
+        page = await run_db(tasks_page, db, user_id, after, before)
+        render_cache.put(cache_key, page, token)
+    message, first_key, last_key, has_prev, has_next = page
+    if message is None:
         message = '📋 У вас нет задач.'
 
-    keyboard = [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
+    keyboard = []
+    page_buttons = []
+    if has_prev:
+        page_buttons.append(InlineKeyboardButton('⬅️ Предыдущие', callback_data=encode_page_key('before', first_key)))
+    if has_next:
+        page_buttons.append(InlineKeyboardButton('Следующие ➡️', callback_data=encode_page_key('after', last_key)))
+    if page_buttons:
+        keyboard.append(page_buttons)
+    keyboard += menu_keyboard('task_ranges', columns=3)
+    keyboard.append([InlineKeyboardButton('🔙 Назад', callback_data='back')])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+        await query.edit_message_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
         logger.info("Отображены текущие задачи пользователя.")
     except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения с задачами: {e}")
-        query.message.reply_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+        logger.error("Ошибка при редактировании сообщения с задачами: %s", e)
+        await query.message.reply_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
     return CHOOSING
 
-def quick_note_handler(update: Update, context: CallbackContext):
-    context.user_data['quick_note'] = update.message.text
-    logger.info(f"Получена быстрая заметка: {update.message.text}")
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Установить напоминание", callback_data='quick_confirm_yes'),
-            InlineKeyboardButton("❌ Без напоминания", callback_data='quick_confirm_no')
-        ],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
+async def tasks_range(update: Update, context: CallbackContext, view):
+    """Задачи на сегодня, на эту неделю или просроченные: один проход по индексу (user_id, due_at)."""
+    query = update.callback_query
+    user_id = context.user_data.get('user_id')
+    # Границы зависят от текущего времени, поэтому выборки не кэшируются
+    start, end = range_bounds(view, datetime.now(TIMEZONE), TIMEZONE)
+    message, more = await run_db(range_page, db, user_id, view, start, end)
+    if message is None:
+        message = RANGE_HEADERS[view] + 'Задач нет.'
+    elif more:
+        message += '<i>…и другие задачи</i>'
+
+    keyboard = menu_keyboard('task_ranges', columns=3) + [
+        [InlineKeyboardButton('📋 Все задачи', callback_data='main_my_tasks')],
+        [InlineKeyboardButton('🔙 Назад', callback_data='back')],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    update.message.reply_text('Хотите установить напоминание для этой заметки?', reply_markup=reply_markup)
+    try:
+        await query.edit_message_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения с выборкой задач: %s", e)
+        await query.message.reply_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+    return CHOOSING
+
+async def quick_note_handler(update: Update, context: CallbackContext):
+    context.user_data['quick_note'] = update.message.text
+    logger.info("Получена быстрая заметка: %s", update.message.text)
+    keyboard = menu_keyboard('quick_note', columns=2) + [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text('Хотите установить напоминание для этой заметки?', reply_markup=reply_markup)
     return QUICK_NOTE_CONFIRM
 
-def handle_quick_note_confirmation(update: Update, context: CallbackContext):
+async def quick_note_ask_time(update: Update, context: CallbackContext):
     query = update.callback_query
-    data = query.data
-    logger.info(f"Получено подтверждение для быстрой заметки: {data}")
-    query.answer()
-
-    if data == 'quick_confirm_yes':
-        try:
-            query.edit_message_text(
-                '🕒 Введите время напоминания для заметки в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-            logger.info("Запрошено время напоминания для быстрой заметки.")
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения для ввода времени напоминания: {e}")
-            query.message.reply_text(
-                '🕒 Введите время напоминания для заметки в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-        return QUICK_NOTE_TIME
-
-    elif data == 'quick_confirm_no':
-        # Сохраняем заметку без напоминания
-        user_id = context.user_data.get('user_id')
-        note = context.user_data.get('quick_note')
-        cursor.execute('INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)',
-                       (user_id, 'Быстрая заметка', note, '', ''))
-        conn.commit()
-        try:
-            query.edit_message_text('✅ Заметка сохранена без напоминания.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-            logger.info("Заметка сохранена без напоминания.")
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения после сохранения заметки без напоминания: {e}")
-            query.message.reply_text('✅ Заметка сохранена без напоминания.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return main_menu(update, context)
-
-    elif data == 'back':
-        try:
-            query.edit_message_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-            logger.info("Возврат к вводу заметки.")
-        except Exception as e:
-            logger.error(f"Ошибка при возврате к вводу заметки: {e}")
-            query.message.reply_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return QUICK_NOTE
+    try:
+        await query.edit_message_text(
+            '🕒 Введите время напоминания для заметки в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
+            parse_mode=ParseMode.HTML,
+            reply_markup=back_button()
+        )
+        logger.info("Запрошено время напоминания для быстрой заметки.")
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения для ввода времени напоминания: %s", e)
+        await query.message.reply_text(
+            '🕒 Введите время напоминания для заметки в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
+            parse_mode=ParseMode.HTML,
+            reply_markup=back_button()
+        )
+    return QUICK_NOTE_TIME
 
-    else:
-        logger.warning(f"Неизвестное подтверждение для быстрой заметки: {data}")
-        return QUICK_NOTE_CONFIRM
+async def quick_note_save(update: Update, context: CallbackContext):
+    query = update.callback_query
+    # Сохраняем заметку без напоминания
+    user_id = context.user_data.get('user_id')
+    note = context.user_data.get('quick_note')
+    await wait_written(writer.write(
+        'INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)',
+        (user_id, 'Быстрая заметка', note, '', '')
+    ))
+    render_cache.invalidate(user_id, 'tasks')
+    try:
+        await query.edit_message_text('✅ Заметка сохранена без напоминания.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+        logger.info("Заметка сохранена без напоминания.")
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения после сохранения заметки без напоминания: %s", e)
+        await query.message.reply_text('✅ Заметка сохранена без напоминания.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+    return await main_menu(update, context)
 
-def quick_note_time_handler(update: Update, context: CallbackContext):
+async def quick_note_time_handler(update: Update, context: CallbackContext):
     input_time = update.message.text
-    logger.info(f"Получено время напоминания для заметки: {input_time}")
+    logger.info("Получено время напоминания для заметки: %s", input_time)
     try:
         task_time = parse_time(input_time)
         if not task_time:
-            update.message.reply_text(
+            await update.message.reply_text(
                 '❌ Неверный формат времени. Пожалуйста, используйте формат <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code>',
                 parse_mode=ParseMode.HTML,
                 reply_markup=back_button()
@@ -746,125 +1209,121 @@ def quick_note_time_handler(update: Update, context: CallbackContext):
 
         # Сохраняем заметку в базу данных
         user_id = context.user_data.get('user_id')
-        cursor.execute('INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)',
-                       (user_id, 'Быстрая заметка', note, '', task_time.strftime('%Y-%m-%d %H:%M')))
-        conn.commit()
+        await wait_written(writer.write(
+            'INSERT INTO tasks (user_id, topic, description, attachments, time, due_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (user_id, 'Быстрая заметка', note, '', task_time.strftime('%Y-%m-%d %H:%M'), int(task_time.timestamp()))
+        ))
+        render_cache.invalidate(user_id, 'tasks')
 
         # Планируем напоминание
         notification_time = context.user_data.get('notification_time', DEFAULT_NOTIFICATION_TIME)
-        schedule_notification(user_id, note, task_time, notification_time, [])
+        await schedule_notification(user_id, note, task_time, notification_time, [])
 
         # Отправляем подтверждение
         try:
-            update.message.reply_text('✅ Заметка сохранена с напоминанием!', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+            await update.message.reply_text('✅ Заметка сохранена с напоминанием!', reply_markup=back_button(), parse_mode=ParseMode.HTML)
             logger.info("Заметка сохранена с напоминанием.")
         except Exception as e:
-            logger.error(f"Ошибка при отправке подтверждения сохранения заметки с напоминанием: {e}")
-            update.message.reply_text('✅ Заметка сохранена с напоминанием!', reply_markup=back_button(), parse_mode=ParseMode.HTML)
+            logger.error("Ошибка при отправке подтверждения сохранения заметки с напоминанием: %s", e)
+            await update.message.reply_text('✅ Заметка сохранена с напоминанием!', reply_markup=back_button(), parse_mode=ParseMode.HTML)
 
-        return main_menu(update, context)
+        return await main_menu(update, context)
 
     except Exception as e:
-        logger.error(f"Ошибка при обработке времени для заметки: {e}")
-        update.message.reply_text(
+        logger.error("Ошибка при обработке времени для заметки: %s", e)
+        await update.message.reply_text(
             '⚠️ Произошла ошибка при обработке времени. Пожалуйста, попробуйте снова.',
             reply_markup=back_button()
         )
         return QUICK_NOTE_TIME
 
-def settings_menu(update: Update, context: CallbackContext):
-    keyboard = [
-        [InlineKeyboardButton('⏰ Настроить время напоминания', callback_data='set_notification_time')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
+async def settings_menu(update: Update, context: CallbackContext):
+    keyboard = menu_keyboard('settings') + [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    query = update.callback_query
+    # Меню открывается и кнопкой, и после ввода времени напоминания сообщением
     try:
-        query.edit_message_text('🔔 <b>Настройки:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        if update.callback_query:
+            await update.callback_query.edit_message_text('🔔 <b>Настройки:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        else:
+            await update.message.reply_text('🔔 <b>Настройки:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
         logger.info("Отображено меню настроек.")
     except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения настроек: {e}")
-        query.message.reply_text('🔔 <b>Настройки:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        logger.error("Ошибка при редактировании сообщения настроек: %s", e)
+        await update.effective_message.reply_text('🔔 <b>Настройки:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     return SETTINGS
 
-def set_notification_time(update: Update, context: CallbackContext):
+async def set_notification_time(update: Update, context: CallbackContext):
     input_minutes = update.message.text
-    logger.info(f"Устанавливается время напоминания: {input_minutes} минут")
+    logger.info("Устанавливается время напоминания: %s минут", input_minutes)
     try:
         minutes = int(input_minutes)
         if minutes <= 0:
             raise ValueError("Время должно быть положительным числом.")
         context.user_data['notification_time'] = minutes
-        update.message.reply_text(f'⏰ Время напоминания установлено на {minutes} минут(ы) перед задачей.', reply_markup=back_button())
-        logger.info(f"Время напоминания установлено: {minutes} минут")
-        return settings_menu(update, context)
+        await update.message.reply_text(f'⏰ Время напоминания установлено на {minutes} минут(ы) перед задачей.', reply_markup=back_button())
+        logger.info("Время напоминания установлено: %s минут", minutes)
+        return await settings_menu(update, context)
     except ValueError:
-        update.message.reply_text('❌ Пожалуйста, введите положительное число.', reply_markup=back_button())
+        await update.message.reply_text('❌ Пожалуйста, введите положительное число.', reply_markup=back_button())
         logger.warning("Пользователь ввел некорректное значение времени напоминания.")
         return SET_NOTIFICATION_TIME
     except Exception as e:
-        logger.error(f"Ошибка при установке времени напоминания: {e}")
-        update.message.reply_text('⚠️ Произошла ошибка при установке времени. Попробуйте снова.', reply_markup=back_button())
+        logger.error("Ошибка при установке времени напоминания: %s", e)
+        await update.message.reply_text('⚠️ Произошла ошибка при установке времени. Попробуйте снова.', reply_markup=back_button())
         return SET_NOTIFICATION_TIME
 
-def subscriptions_menu(update: Update, context: CallbackContext):
-    query = update.callback_query
-    query.answer()
-    user_id = context.user_data.get('user_id')
-
-    keyboard = [
-        [InlineKeyboardButton('🏋️‍♂️ Спорт', callback_data='subscription_Sport')],
-        [InlineKeyboardButton('📚 Учеба', callback_data='subscription_Study')],
-        [InlineKeyboardButton('🎉 Отдых', callback_data='subscription_Rest')],
-        [InlineKeyboardButton('💌 Личное', callback_data='subscription_Personal')],
-        [InlineKeyboardButton('➕ Добавить подписку', callback_data='add_subscription')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
+async def subscriptions_menu(update: Update, context: CallbackContext):
+    keyboard = (
+        menu_keyboard('subscription_categories') + menu_keyboard('subscriptions')
+        + [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
+    )
     reply_markup = InlineKeyboardMarkup(keyboard)
 
+    # Меню открывается и кнопкой, и после добавления подписки сообщением
     try:
-        query.edit_message_text('📌 <b>Подписки:</b>\nВыберите категорию:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        if update.callback_query:
+            await update.callback_query.edit_message_text('📌 <b>Подписки:</b>\nВыберите категорию:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        else:
+            await update.message.reply_text('📌 <b>Подписки:</b>\nВыберите категорию:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
         logger.info("Отображено меню подписок с категориями.")
     except Exception as e:
-        logger.error(f"Ошибка при редактировании меню подписок: {e}")
-        query.message.reply_text('📌 <b>Подписки:</b>\nВыберите категорию:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        logger.error("Ошибка при редактировании меню подписок: %s", e)
+        await update.effective_message.reply_text('📌 <b>Подписки:</b>\nВыберите категорию:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     return SUBSCRIPTION_CATEGORY
 
-def subscription_category_handler(update: Update, context: CallbackContext):
+async def subscription_category_handler(update: Update, context: CallbackContext, category):
     query = update.callback_query
-    data = query.data
-    category = data.split('_')[1]  # 'subscription_Sport' -> 'Sport'
     context.user_data['subscription_category'] = category
-    logger.info(f"Выбрана категория подписок: {category}")
+    logger.info("Выбрана категория подписок: %s", category)
 
-    keyboard = [
-        [InlineKeyboardButton('📄 Просмотр подписок', callback_data='view_subscriptions')],
-        [InlineKeyboardButton('➕ Добавить подписку', callback_data='add_subscription')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
+    keyboard = menu_keyboard('subscription_actions') + [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(f'📌 <b>Категория:</b> {category}\nВыберите действие:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-        logger.info(f"Отображено меню действий для категории {category}.")
+        await query.edit_message_text(f'📌 <b>Категория:</b> {category}\nВыберите действие:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        logger.info("Отображено меню действий для категории %s.", category)
     except Exception as e:
-        logger.error(f"Ошибка при редактировании меню действий для категории {category}: {e}")
-        query.message.reply_text(f'📌 <b>Категория:</b> {category}\nВыберите действие:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        logger.error("Ошибка при редактировании меню действий для категории %s: %s", category, e)
+        await query.message.reply_text(f'📌 <b>Категория:</b> {category}\nВыберите действие:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     return VIEW_SUBSCRIPTION
 
-def view_subscriptions(update: Update, context: CallbackContext):
+async def view_subscriptions(update: Update, context: CallbackContext):
     query = update.callback_query
     category = context.user_data.get('subscription_category')
     user_id = context.user_data.get('user_id')
 
-    cursor.execute('SELECT content FROM subscriptions WHERE user_id = ? AND category = ?', (user_id, category))
-    subs = cursor.fetchall()
-    if subs:
-        message = f'📌 <b>Ваши подписки в категории "{category}":</b>\n\n'
-        for sub in subs:
-            message += f"• {sub[0]}\n"
-    else:
-        message = f'📌 У вас нет подписок в категории "{category}".'
+    cache_key = (user_id, 'subscriptions', category)
+    message = render_cache.get(cache_key)
+    if message is None:
+        token = render_cache.begin()
+        subs = await run_db(db.query, 'SELECT content FROM subscriptions WHERE user_id = ? AND category = ?', (user_id, category))
+        if subs:
+            message = f'📌 <b>Ваши подписки в категории "{category}":</b>\n\n'
+            for sub in subs:
+                message += f"• {sub[0]}\n"
+        else:
+            message = f'📌 У вас нет подписок в категории "{category}".'
+        render_cache.put(cache_key, message, token)
 
     keyboard = [
         [InlineKeyboardButton('➕ Добавить подписку', callback_data='add_subscription')],
@@ -873,732 +1332,421 @@ def view_subscriptions(update: Update, context: CallbackContext):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-        logger.info(f"Отображены подписки в категории {category}.")
+        await query.edit_message_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+        logger.info("Отображены подписки в категории %s.", category)
     except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения с подписками в категории {category}: {e}")
-        query.message.reply_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+        logger.error("Ошибка при редактировании сообщения с подписками в категории %s: %s", category, e)
+        await query.message.reply_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
     return VIEW_SUBSCRIPTION
 
-def add_subscription_handler(update: Update, context: CallbackContext):
+async def add_subscription_handler(update: Update, context: CallbackContext):
     query = update.callback_query
-    data = query.data
-    if data == 'add_subscription':
-        try:
-            query.edit_message_text('📌 <b>Добавление подписки:</b>\nВыберите категорию:', reply_markup=subscription_categories_buttons(), parse_mode=ParseMode.HTML)
-            logger.info("Запрошена категория для новой подписки.")
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения для добавления подписки: {e}")
-            query.message.reply_text('📌 <b>Добавление подписки:</b>\nВыберите категорию:', reply_markup=subscription_categories_buttons(), parse_mode=ParseMode.HTML)
-        return ADD_SUBSCRIPTION
-    elif data.startswith('subscription_'):
-        return subscription_category_handler(update, context)
-    elif data == 'back':
-        return subscriptions_menu(update, context)
-    else:
-        logger.warning(f"Неизвестные callback_data в добавлении подписки: {data}")
-        return SUBSCRIPTION_CATEGORY
+    try:
+        await query.edit_message_text('📌 <b>Добавление подписки:</b>\nВыберите категорию:', reply_markup=subscription_categories_buttons(), parse_mode=ParseMode.HTML)
+        logger.info("Запрошена категория для новой подписки.")
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения для добавления подписки: %s", e)
+        await query.message.reply_text('📌 <b>Добавление подписки:</b>\nВыберите категорию:', reply_markup=subscription_categories_buttons(), parse_mode=ParseMode.HTML)
+    return ADD_SUBSCRIPTION
+
+async def ask_subscription_content(update: Update, context: CallbackContext, category=None):
+    """Запрашивает содержимое подписки; category передает кнопка выбора категории."""
+    query = update.callback_query
+    if category is not None:
+        context.user_data['subscription_category'] = category
+    category = context.user_data.get('subscription_category')
+    text = f'📌 <b>Новая подписка в категории "{category}":</b>\nОтправьте текст, ссылку, фото или видео.'
+    try:
+        await query.edit_message_text(text, reply_markup=back_button(), parse_mode=ParseMode.HTML)
+        logger.info("Запрошено содержимое подписки для категории %s.", category)
+    except Exception as e:
+        logger.error("Ошибка при запросе содержимого подписки: %s", e)
+        await query.message.reply_text(text, reply_markup=back_button(), parse_mode=ParseMode.HTML)
+    return ADD_SUBSCRIPTION
 
 def subscription_categories_buttons():
-    categories = ['Sport', 'Study', 'Rest', 'Personal']
-    keyboard = [[InlineKeyboardButton(cat, callback_data=f'subscription_{cat}')] for cat in categories]
+    keyboard = menu_keyboard('subscription_categories')
     keyboard.append([InlineKeyboardButton('🔙 Назад', callback_data='back')])
     return InlineKeyboardMarkup(keyboard)
 
-def add_subscription_entry(update: Update, context: CallbackContext):
+async def add_subscription_entry(update: Update, context: CallbackContext):
     category = context.user_data.get('subscription_category')
     user_id = context.user_data.get('user_id')
     user_input = update.message
 
     if user_input.text:
         content = user_input.text
-        logger.info(f"Добавлена подписка в категории {category}: {content}")
+        logger.info("Добавлена подписка в категории %s: %s", category, content)
     elif user_input.caption:
         content = user_input.caption
-        logger.info(f"Добавлена подписка с подписью в категории {category}: {content}")
+        logger.info("Добавлена подписка с подписью в категории %s: %s", category, content)
     elif user_input.photo or user_input.video:
         content = 'Медиа контент'
-        logger.info(f"Добавлена медиа подписка в категории {category}.")
+        logger.info("Добавлена медиа подписка в категории %s.", category)
     else:
-        update.message.reply_text('❌ Не удалось определить контент. Попробуйте еще раз.', reply_markup=back_button())
+        await update.message.reply_text('❌ Не удалось определить контент. Попробуйте еще раз.', reply_markup=back_button())
         logger.warning("Не удалось определить контент для подписки.")
         return ADD_SUBSCRIPTION
 
-    cursor.execute('INSERT INTO subscriptions (user_id, category, content) VALUES (?, ?, ?)', (user_id, category, content))
-    conn.commit()
-    update.message.reply_text('✅ Подписка добавлена.', reply_markup=back_button())
+    await wait_written(writer.write(
+        'INSERT INTO subscriptions (user_id, category, content) VALUES (?, ?, ?)', (user_id, category, content)
+    ))
+    render_cache.invalidate(user_id, 'subscriptions', category)
+    await update.message.reply_text('✅ Подписка добавлена.', reply_markup=back_button())
     logger.info("Подписка успешно добавлена.")
-    return subscriptions_menu(update, context)
-
-def schedule_notification(chat_id, task, time, notification_time, attachments):
-    notify_time = time - timedelta(minutes=notification_time)
-    now = datetime.now(TIMEZONE)
-    if notify_time < now:
-        send_notification(chat_id, task, attachments)
-        logger.info(f"Напоминание отправлено сразу для задачи '{task}'.")
-    else:
-        try:
-            job_id = f"notif_{chat_id}_{task}_{notify_time.timestamp()}"
-            scheduler.add_job(
-                send_notification,
-                'date',
-                run_date=notify_time,
-                args=[chat_id, task, attachments],
-                timezone=TIMEZONE,
-                id=job_id
-            )
-            logger.info(f"Запланировано напоминание для задачи '{task}' на {notify_time}.")
-        except Exception as e:
-            logger.error(f"Ошибка при планировании напоминания: {e}")
-
-def send_notification(chat_id, task, attachments):
-    notification_text = f'🔔 <b>Напоминание о задаче:</b>\n📝 {task}'
-    if attachments:
-        notification_text += '\n\n📎 <b>Прикрепленные материалы:</b>\n' + '\n'.join(attachments)
-    try:
-        updater.bot.send_message(chat_id=chat_id, text=notification_text, parse_mode=ParseMode.HTML)
-        logger.info(f"Напоминание отправлено для задачи: {task}")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления: {e}")
-
-def my_tasks(update: Update, context: CallbackContext):
-    query = update.callback_query
-    query.answer()
-    user_id = context.user_data.get('user_id')
-
-    cursor.execute('SELECT topic, description, attachments, time FROM tasks WHERE user_id = ? ORDER BY time', (user_id,))
-    tasks = cursor.fetchall()
-    if tasks:
-        message = '📋 <b>Ваши задачи:</b>\n\n'
-        for task in tasks:
-            topic, description, attachments, time_str = task
-            message += f"• 📝 <b>Топик:</b> {topic}\n  ⏰ <b>Время:</b> {time_str}\n"
-            if attachments:
-                message += f"  📎 <b>Прикрепления:</b> {attachments}\n"
-            message += "\n"
-    else:
-        message = '📋 У вас нет задач.'
-
-    keyboard = [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    try:
-        query.edit_message_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-        logger.info("Отображены текущие задачи пользователя.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения с задачами: {e}")
-        query.message.reply_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-    return CHOOSING
-
-def quick_note_handler(update: Update, context: CallbackContext):
-    context.user_data['quick_note'] = update.message.text
-    logger.info(f"Получена быстрая заметка: {update.message.text}")
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Установить напоминание", callback_data='quick_confirm_yes'),
-            InlineKeyboardButton("❌ Без напоминания", callback_data='quick_confirm_no')
-        ],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    update.message.reply_text('Хотите установить напоминание для этой заметки?', reply_markup=reply_markup)
-    return QUICK_NOTE_CONFIRM
-
-def handle_quick_note_confirmation(update: Update, context: CallbackContext):
-    query = update.callback_query
-    data = query.data
-    logger.info(f"Получено подтверждение для быстрой заметки: {data}")
-    query.answer()
-
-    if data == 'quick_confirm_yes':
-        try:
-            query.edit_message_text(
-                '🕒 Введите время напоминания для заметки в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-            logger.info("Запрошено время напоминания для быстрой заметки.")
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения для ввода времени напоминания: {e}")
-            query.message.reply_text(
-                '🕒 Введите время напоминания для заметки в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-        return QUICK_NOTE_TIME
-
-    elif data == 'quick_confirm_no':
-        # Сохраняем заметку без напоминания
-        user_id = context.user_data.get('user_id')
-        note = context.user_data.get('quick_note')
-        cursor.execute('INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)',
-                       (user_id, 'Быстрая заметка', note, '', ''))
-        conn.commit()
-        try:
-            query.edit_message_text('✅ Заметка сохранена без напоминания.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-            logger.info("Заметка сохранена без напоминания.")
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения после сохранения заметки без напоминания: {e}")
-            query.message.reply_text('✅ Заметка сохранена без напоминания.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return main_menu(update, context)
-
-    elif data == 'back':
-        try:
-            query.edit_message_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-            logger.info("Возврат к вводу заметки.")
-        except Exception as e:
-            logger.error(f"Ошибка при возврате к вводу заметки: {e}")
-            query.message.reply_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return QUICK_NOTE
-
-    else:
-        logger.warning(f"Неизвестное подтверждение для быстрой заметки: {data}")
-        return QUICK_NOTE_CONFIRM
-
-def quick_note_time_handler(update: Update, context: CallbackContext):
-    input_time = update.message.text
-    logger.info(f"Получено время напоминания для заметки: {input_time}")
-    try:
-        task_time = parse_time(input_time)
-        if not task_time:
-            update.message.reply_text(
-                '❌ Неверный формат времени. Пожалуйста, используйте формат <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code>',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-            logger.warning("Некорректный формат времени для заметки.")
-            return QUICK_NOTE_TIME
-
-        context.user_data['quick_note_time'] = task_time
-        note = context.user_data.get('quick_note')
-
-        # Сохраняем заметку в базу данных
-        user_id = context.user_data.get('user_id')
-        cursor.execute('INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)',
-                       (user_id, 'Быстрая заметка', note, '', task_time.strftime('%Y-%m-%d %H:%M')))
-        conn.commit()
-
-        # Планируем напоминание
-        notification_time = context.user_data.get('notification_time', DEFAULT_NOTIFICATION_TIME)
-        schedule_notification(user_id, note, task_time, notification_time, [])
-
-        # Отправляем подтверждение
-        try:
-            update.message.reply_text('✅ Заметка сохранена с напоминанием!', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-            logger.info("Заметка сохранена с напоминанием.")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке подтверждения сохранения заметки с напоминанием: {e}")
-            update.message.reply_text('✅ Заметка сохранена с напоминанием!', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-
-        return main_menu(update, context)
-
-    except Exception as e:
-        logger.error(f"Ошибка при обработке времени для заметки: {e}")
-        update.message.reply_text(
-            '⚠️ Произошла ошибка при обработке времени. Пожалуйста, попробуйте снова.',
-            reply_markup=back_button()
-        )
-        return QUICK_NOTE_TIME
-
-def settings_menu(update: Update, context: CallbackContext):
-    keyboard = [
-        [InlineKeyboardButton('⏰ Настроить время напоминания', callback_data='set_notification_time')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    query = update.callback_query
-    try:
-        query.edit_message_text('🔔 <b>Настройки:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-        logger.info("Отображено меню настроек.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения настроек: {e}")
-        query.message.reply_text('🔔 <b>Настройки:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-    return SETTINGS
-
-def set_notification_time(update: Update, context: CallbackContext):
-    input_minutes = update.message.text
-    logger.info(f"Устанавливается время напоминания: {input_minutes} минут")
-    try:
-        minutes = int(input_minutes)
-        if minutes <= 0:
-            raise ValueError("Время должно быть положительным числом.")
-        context.user_data['notification_time'] = minutes
-        update.message.reply_text(f'⏰ Время напоминания установлено на {minutes} минут(ы) перед задачей.', reply_markup=back_button())
-        logger.info(f"Время напоминания установлено: {minutes} минут")
-        return settings_menu(update, context)
-    except ValueError:
-        update.message.reply_text('❌ Пожалуйста, введите положительное число.', reply_markup=back_button())
-        logger.warning("Пользователь ввел некорректное значение времени напоминания.")
-        return SET_NOTIFICATION_TIME
-    except Exception as e:
-        logger.error(f"Ошибка при установке времени напоминания: {e}")
-        update.message.reply_text('⚠️ Произошла ошибка при установке времени. Попробуйте снова.', reply_markup=back_button())
-        return SET_NOTIFICATION_TIME
-
-def subscriptions_menu(update: Update, context: CallbackContext):
-    query = update.callback_query
-    query.answer()
-    user_id = context.user_data.get('user_id')
-
-    keyboard = [
-        [InlineKeyboardButton('🏋️‍♂️ Спорт', callback_data='subscription_Sport')],
-        [InlineKeyboardButton('📚 Учеба', callback_data='subscription_Study')],
-        [InlineKeyboardButton('🎉 Отдых', callback_data='subscription_Rest')],
-        [InlineKeyboardButton('💌 Личное', callback_data='subscription_Personal')],
-        [InlineKeyboardButton('➕ Добавить подписку', callback_data='add_subscription')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    try:
-        query.edit_message_text('📌 <b>Подписки:</b>\nВыберите категорию:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-        logger.info("Отображено меню подписок с категориями.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании меню подписок: {e}")
-        query.message.reply_text('📌 <b>Подписки:</b>\nВыберите категорию:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-    return SUBSCRIPTION_CATEGORY
-
-def subscription_category_handler(update: Update, context: CallbackContext):
-    query = update.callback_query
-    data = query.data
-    category = data.split('_')[1]  # 'subscription_Sport' -> 'Sport'
-    context.user_data['subscription_category'] = category
-    logger.info(f"Выбрана категория подписок: {category}")
-
-    keyboard = [
-        [InlineKeyboardButton('📄 Просмотр подписок', callback_data='view_subscriptions')],
-        [InlineKeyboardButton('➕ Добавить подписку', callback_data='add_subscription')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    try:
-        query.edit_message_text(f'📌 <b>Категория:</b> {category}\nВыберите действие:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-        logger.info(f"Отображено меню действий для категории {category}.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании меню действий для категории {category}: {e}")
-        query.message.reply_text(f'📌 <b>Категория:</b> {category}\nВыберите действие:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-    return VIEW_SUBSCRIPTION
-
-def view_subscriptions(update: Update, context: CallbackContext):
-    query = update.callback_query
-    category = context.user_data.get('subscription_category')
-    user_id = context.user_data.get('user_id')
-
-    cursor.execute('SELECT content FROM subscriptions WHERE user_id = ? AND category = ?', (user_id, category))
-    subs = cursor.fetchall()
-    if subs:
-        message = f'📌 <b>Ваши подписки в категории "{category}":</b>\n\n'
-        for sub in subs:
-            message += f"• {sub[0]}\n"
-    else:
-        message = f'📌 У вас нет подписок в категории "{category}".'
-
-    keyboard = [
-        [InlineKeyboardButton('➕ Добавить подписку', callback_data='add_subscription')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    try:
-        query.edit_message_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-        logger.info(f"Отображены подписки в категории {category}.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения с подписками в категории {category}: {e}")
-        query.message.reply_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-    return VIEW_SUBSCRIPTION
-
-def add_subscription_handler(update: Update, context: CallbackContext):
-    query = update.callback_query
-    data = query.data
-    if data == 'add_subscription':
-        try:
-            query.edit_message_text('📌 <b>Добавление подписки:</b>\nВыберите категорию:', reply_markup=subscription_categories_buttons(), parse_mode=ParseMode.HTML)
-            logger.info("Запрошена категория для новой подписки.")
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения для добавления подписки: {e}")
-            query.message.reply_text('📌 <b>Добавление подписки:</b>\nВыберите категорию:', reply_markup=subscription_categories_buttons(), parse_mode=ParseMode.HTML)
-        return ADD_SUBSCRIPTION
-    elif data.startswith('subscription_'):
-        return subscription_category_handler(update, context)
-    elif data == 'back':
-        return subscriptions_menu(update, context)
-    else:
-        logger.warning(f"Неизвестные callback_data в добавлении подписки: {data}")
-        return SUBSCRIPTION_CATEGORY
-
-def subscription_categories_buttons():
-    categories = ['Sport', 'Study', 'Rest', 'Personal']
-    keyboard = [[InlineKeyboardButton(cat, callback_data=f'subscription_{cat}')] for cat in categories]
-    keyboard.append([InlineKeyboardButton('🔙 Назад', callback_data='back')])
-    return InlineKeyboardMarkup(keyboard)
-
-def add_subscription_entry(update: Update, context: CallbackContext):
-    category = context.user_data.get('subscription_category')
-    user_id = context.user_data.get('user_id')
-    user_input = update.message
-
-    if user_input.text:
-        content = user_input.text
-        logger.info(f"Добавлена подписка в категории {category}: {content}")
-    elif user_input.caption:
-        content = user_input.caption
-        logger.info(f"Добавлена подписка с подписью в категории {category}: {content}")
-    elif user_input.photo or user_input.video:
-        content = 'Медиа контент'
-        logger.info(f"Добавлена медиа подписка в категории {category}.")
-    else:
-        update.message.reply_text('❌ Не удалось определить контент. Попробуйте еще раз.', reply_markup=back_button())
-        logger.warning("Не удалось определить контент для подписки.")
-        return ADD_SUBSCRIPTION
-
-    cursor.execute('INSERT INTO subscriptions (user_id, category, content) VALUES (?, ?, ?)', (user_id, category, content))
-    conn.commit()
-    update.message.reply_text('✅ Подписка добавлена.', reply_markup=back_button())
-    logger.info("Подписка успешно добавлена.")
-    return subscriptions_menu(update, context)
-
-def schedule_notification(chat_id, task, time, notification_time, attachments):
-    notify_time = time - timedelta(minutes=notification_time)
-    now = datetime.now(TIMEZONE)
-    if notify_time < now:
-        send_notification(chat_id, task, attachments)
-        logger.info(f"Напоминание отправлено сразу для задачи '{task}'.")
-    else:
-        try:
-            job_id = f"notif_{chat_id}_{task}_{notify_time.timestamp()}"
-            scheduler.add_job(
-                send_notification,
-                'date',
-                run_date=notify_time,
-                args=[chat_id, task, attachments],
-                timezone=TIMEZONE,
-                id=job_id
-            )
-            logger.info(f"Запланировано напоминание для задачи '{task}' на {notify_time}.")
-        except Exception as e:
-            logger.error(f"Ошибка при планировании напоминания: {e}")
-
-def send_notification(chat_id, task, attachments):
-    notification_text = f'🔔 <b>Напоминание о задаче:</b>\n📝 {task}'
-    if attachments:
-        notification_text += '\n\n📎 <b>Прикрепленные материалы:</b>\n' + '\n'.join(attachments)
-    try:
-        updater.bot.send_message(chat_id=chat_id, text=notification_text, parse_mode=ParseMode.HTML)
-        logger.info(f"Напоминание отправлено для задачи: {task}")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления: {e}")
-
-def my_tasks(update: Update, context: CallbackContext):
-    query = update.callback_query
-    query.answer()
-    user_id = context.user_data.get('user_id')
-
-    cursor.execute('SELECT topic, description, attachments, time FROM tasks WHERE user_id = ? ORDER BY time', (user_id,))
-    tasks = cursor.fetchall()
-    if tasks:
-        message = '📋 <b>Ваши задачи:</b>\n\n'
-        for task in tasks:
-            topic, description, attachments, time_str = task
-            message += f"• 📝 <b>Топик:</b> {topic}\n  ⏰ <b>Время:</b> {time_str}\n"
-            if attachments:
-                message += f"  📎 <b>Прикрепления:</b> {attachments}\n"
-            message += "\n"
-    else:
-        message = '📋 У вас нет задач.'
-
-    keyboard = [[InlineKeyboardButton('🔙 Назад', callback_data='back')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    try:
-        query.edit_message_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-        logger.info("Отображены текущие задачи пользователя.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения с задачами: {e}")
-        query.message.reply_text(text=message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-    return CHOOSING
-
-def quick_note_handler(update: Update, context: CallbackContext):
-    context.user_data['quick_note'] = update.message.text
-    logger.info(f"Получена быстрая заметка: {update.message.text}")
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Установить напоминание", callback_data='quick_confirm_yes'),
-            InlineKeyboardButton("❌ Без напоминания", callback_data='quick_confirm_no')
-        ],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    update.message.reply_text('Хотите установить напоминание для этой заметки?', reply_markup=reply_markup)
-    return QUICK_NOTE_CONFIRM
-
-def handle_quick_note_confirmation(update: Update, context: CallbackContext):
-    query = update.callback_query
-    data = query.data
-    logger.info(f"Получено подтверждение для быстрой заметки: {data}")
-    query.answer()
-
-    if data == 'quick_confirm_yes':
-        try:
-            query.edit_message_text(
-                '🕒 Введите время напоминания для заметки в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-            logger.info("Запрошено время напоминания для быстрой заметки.")
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения для ввода времени напоминания: {e}")
-            query.message.reply_text(
-                '🕒 Введите время напоминания для заметки в формате <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code> для сегодняшней даты.',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-        return QUICK_NOTE_TIME
-
-    elif data == 'quick_confirm_no':
-        # Сохраняем заметку без напоминания
-        user_id = context.user_data.get('user_id')
-        note = context.user_data.get('quick_note')
-        cursor.execute('INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)',
-                       (user_id, 'Быстрая заметка', note, '', ''))
-        conn.commit()
-        try:
-            query.edit_message_text('✅ Заметка сохранена без напоминания.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-            logger.info("Заметка сохранена без напоминания.")
-        except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения после сохранения заметки без напоминания: {e}")
-            query.message.reply_text('✅ Заметка сохранена без напоминания.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return main_menu(update, context)
-
-    elif data == 'back':
-        try:
-            query.edit_message_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-            logger.info("Возврат к вводу заметки.")
-        except Exception as e:
-            logger.error(f"Ошибка при возврате к вводу заметки: {e}")
-            query.message.reply_text('📝 <b>Быстрая заметка:</b>\nВведите вашу заметку.', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-        return QUICK_NOTE
-
-    else:
-        logger.warning(f"Неизвестное подтверждение для быстрой заметки: {data}")
-        return QUICK_NOTE_CONFIRM
-
-def quick_note_time_handler(update: Update, context: CallbackContext):
-    input_time = update.message.text
-    logger.info(f"Получено время напоминания для заметки: {input_time}")
-    try:
-        task_time = parse_time(input_time)
-        if not task_time:
-            update.message.reply_text(
-                '❌ Неверный формат времени. Пожалуйста, используйте формат <code>ГГГГ-ММ-ДД ЧЧ:ММ</code> или <code>ЧЧ:ММ</code>',
-                parse_mode=ParseMode.HTML,
-                reply_markup=back_button()
-            )
-            logger.warning("Некорректный формат времени для заметки.")
-            return QUICK_NOTE_TIME
-
-        context.user_data['quick_note_time'] = task_time
-        note = context.user_data.get('quick_note')
-
-        # Сохраняем заметку в базу данных
-        user_id = context.user_data.get('user_id')
-        cursor.execute('INSERT INTO tasks (user_id, topic, description, attachments, time) VALUES (?, ?, ?, ?, ?)',
-                       (user_id, 'Быстрая заметка', note, '', task_time.strftime('%Y-%m-%d %H:%M')))
-        conn.commit()
-
-        # Планируем напоминание
-        notification_time = context.user_data.get('notification_time', DEFAULT_NOTIFICATION_TIME)
-        schedule_notification(user_id, note, task_time, notification_time, [])
-
-        # Отправляем подтверждение
-        try:
-            update.message.reply_text('✅ Заметка сохранена с напоминанием!', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-            logger.info("Заметка сохранена с напоминанием.")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке подтверждения сохранения заметки с напоминанием: {e}")
-            update.message.reply_text('✅ Заметка сохранена с напоминанием!', reply_markup=back_button(), parse_mode=ParseMode.HTML)
-
-        return main_menu(update, context)
-
-    except Exception as e:
-        logger.error(f"Ошибка при обработке времени для заметки: {e}")
-        update.message.reply_text(
-            '⚠️ Произошла ошибка при обработке времени. Пожалуйста, попробуйте снова.',
-            reply_markup=back_button()
-        )
-        return QUICK_NOTE_TIME
-
-def settings_menu(update: Update, context: CallbackContext):
-    keyboard = [
-        [InlineKeyboardButton('⏰ Настроить время напоминания', callback_data='set_notification_time')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    query = update.callback_query
-    try:
-        query.edit_message_text('🔔 <b>Настройки:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-        logger.info("Отображено меню настроек.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения настроек: {e}")
-        query.message.reply_text('🔔 <b>Настройки:</b>', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-    return SETTINGS
-
-def set_notification_time(update: Update, context: CallbackContext):
-    input_minutes = update.message.text
-    logger.info(f"Устанавливается время напоминания: {input_minutes} минут")
-    try:
-        minutes = int(input_minutes)
-        if minutes <= 0:
-            raise ValueError("Время должно быть положительным числом.")
-        context.user_data['notification_time'] = minutes
-        update.message.reply_text(f'⏰ Время напоминания установлено на {minutes} минут(ы) перед задачей.', reply_markup=back_button())
-        logger.info(f"Время напоминания установлено: {minutes} минут")
-        return settings_menu(update, context)
-    except ValueError:
-        update.message.reply_text('❌ Пожалуйста, введите положительное число.', reply_markup=back_button())
-        logger.warning("Пользователь ввел некорректное значение времени напоминания.")
-        return SET_NOTIFICATION_TIME
-    except Exception as e:
-        logger.error(f"Ошибка при установке времени напоминания: {e}")
-        update.message.reply_text('⚠️ Произошла ошибка при установке времени. Попробуйте снова.', reply_markup=back_button())
-        return SET_NOTIFICATION_TIME
-
-def subscriptions_menu(update: Update, context: CallbackContext):
-    query = update.callback_query
-    query.answer()
-    user_id = context.user_data.get('user_id')
-
-    keyboard = [
-        [InlineKeyboardButton('🏋️‍♂️ Спорт', callback_data='subscription_Sport')],
-        [InlineKeyboardButton('📚 Учеба', callback_data='subscription_Study')],
-        [InlineKeyboardButton('🎉 Отдых', callback_data='subscription_Rest')],
-        [InlineKeyboardButton('💌 Личное', callback_data='subscription_Personal')],
-        [InlineKeyboardButton('➕ Добавить подписку', callback_data='add_subscription')],
-        [InlineKeyboardButton('🔙 Назад', callback_data='back')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    try:
-        query.edit_message_text('📌 <b>Подписки:</b>\nВыберите категорию:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-        logger.info("Отображено меню подписок с категориями.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании меню подписок: {e}")
-        query.message.reply_text('📌 <b>Подписки:</b>\nВыберите категорию:', reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-    return SUBSCRIPTION_CATEGORY
-
-def add_subscription(update: Update, context: CallbackContext):
-    # Эта функция теперь обрабатывает добавление подписок через меню
-    return add_subscription_handler(update, context)
+    return await subscriptions_menu(update, context)
 
 def ConversationHandler_states():
-    # Обновленный ConversationHandler с добавленными состояниями
-    return {
-        CHOOSING: [
-            CallbackQueryHandler(button_handler, pattern='^(main_add_task|main_weekly_schedule|main_quick_note|main_settings|main_subscriptions|main_my_tasks)$')
-        ],
+    # Обработчики сообщений по состояниям; нажатия кнопок разбирает таблица маршрутов router
+    states = {
         ADD_TASK_TOPIC: [
-            MessageHandler(filters.text & ~filters.command, add_task_topic)
+            MessageHandler(filters.TEXT & ~filters.COMMAND, add_task_topic)
         ],
         ADD_TASK_ATTACHMENTS: [
-            CallbackQueryHandler(add_task_attachments_handler, pattern='^(attach_yes|attach_no|back|done)$'),
-            MessageHandler(filters.ALL & ~filters.command, received_task_attachment)
+            MessageHandler(filters.ALL & ~filters.COMMAND, received_task_attachment)
         ],
         TYPING_TIME: [
-            MessageHandler(filters.text & ~filters.command, received_time),
-            CallbackQueryHandler(button_handler, pattern='^back$')
-        ],
-        CONFIRMING: [
-            CallbackQueryHandler(confirm_task, pattern='^(conf_confirm_yes|conf_confirm_no|conf_back)$')
-        ],
-        SELECT_DAY: [
-            CallbackQueryHandler(select_schedule_day, pattern='^(schedule_add|schedule_reset|schedule_Monday|schedule_Tuesday|schedule_Wednesday|schedule_Thursday|schedule_Friday|schedule_Saturday|schedule_Sunday|back)$')
-        ],
-        SELECT_TIME_OF_DAY: [
-            CallbackQueryHandler(select_schedule_time_of_day, pattern='^(schedule_time_Morning|schedule_time_Afternoon|schedule_time_Evening|back)$')
+            MessageHandler(filters.TEXT & ~filters.COMMAND, received_time)
         ],
         SET_SCHEDULE_HOUR: [
-            MessageHandler(filters.text & ~filters.command, set_schedule_hour),
-            CallbackQueryHandler(button_handler, pattern='^back$')
-        ],
-        SAVE_SCHEDULE: [
-            CallbackQueryHandler(save_schedule, pattern='^schedule_save$'),
-            CallbackQueryHandler(reset_schedule, pattern='^schedule_reset$'),
-            CallbackQueryHandler(button_handler, pattern='^back$')
+            MessageHandler(filters.TEXT & ~filters.COMMAND, set_schedule_hour)
         ],
         QUICK_NOTE: [
-            MessageHandler(filters.text & ~filters.command, quick_note_handler),
-            CallbackQueryHandler(button_handler, pattern='^back$')
-        ],
-        QUICK_NOTE_CONFIRM: [
-            CallbackQueryHandler(handle_quick_note_confirmation, pattern='^(quick_confirm_yes|quick_confirm_no|back)$')
+            MessageHandler(filters.TEXT & ~filters.COMMAND, quick_note_handler)
         ],
         QUICK_NOTE_TIME: [
-            MessageHandler(filters.text & ~filters.command, quick_note_time_handler),
-            CallbackQueryHandler(button_handler, pattern='^back$')
-        ],
-        SETTINGS: [
-            CallbackQueryHandler(settings_menu_handler, pattern='^(set_notification_time|back)$')
+            MessageHandler(filters.TEXT & ~filters.COMMAND, quick_note_time_handler)
         ],
         SET_NOTIFICATION_TIME: [
-            MessageHandler(filters.text & ~filters.command, set_notification_time),
-            CallbackQueryHandler(button_handler, pattern='^back$')
-        ],
-        SUBSCRIPTION_CATEGORY: [
-            CallbackQueryHandler(subscription_category_handler, pattern='^(subscription_Sport|subscription_Study|subscription_Rest|subscription_Personal|back)$')
-        ],
-        VIEW_SUBSCRIPTION: [
-            CallbackQueryHandler(view_subscriptions, pattern='^(view_subscriptions|add_subscription|back)$')
+            MessageHandler(filters.TEXT & ~filters.COMMAND, set_notification_time)
         ],
         ADD_SUBSCRIPTION: [
-            MessageHandler(filters.ALL & ~filters.command, add_subscription_entry),
-            CallbackQueryHandler(button_handler, pattern='^back$')
+            MessageHandler(filters.ALL & ~filters.COMMAND, add_subscription_entry)
         ]
     }
-
-def settings_menu_handler(update: Update, context: CallbackContext):
+    # Обработчики сообщений выполняются в handler_scope (нажатия оборачивает route_callback)
+    for state, handlers in states.items():
+        for handler in handlers:
+            handler.callback = timed(state, handler.callback)
+    for state in router.states():
+        states.setdefault(state, []).append(callback_handler(state))
+    return states
+
+async def ask_notification_time(update: Update, context: CallbackContext):
     query = update.callback_query
-    data = query.data
-    if data == 'set_notification_time':
+    try:
+        await query.edit_message_text('⏰ Введите время напоминания в минутах:', reply_markup=back_button())
+        logger.info("Запрошено время напоминания.")
+    except Exception as e:
+        logger.error("Ошибка при редактировании сообщения для настройки времени напоминания: %s", e)
+        await query.message.reply_text('⏰ Введите время напоминания в минутах:', reply_markup=back_button())
+    return SET_NOTIFICATION_TIME
+
+def register_routes():
+    """Заполняет таблицу маршрутов inline-кнопок; из нее же строятся клавиатуры меню."""
+    # Главное меню
+    router.add((CHOOSING,), 'main_add_task', add_task_start, label='➕ Добавить задачу', menu='main')
+    router.add((CHOOSING,), 'main_weekly_schedule', manage_schedule, label='📅 Расписание на неделю', menu='main')
+    router.add((CHOOSING,), 'main_quick_note', quick_note_start, label='📝 Быстрая заметка', menu='main')
+    router.add((CHOOSING,), 'main_settings', settings_menu, label='🔔 Настройки', menu='main')
+    router.add((CHOOSING,), 'main_subscriptions', subscriptions_menu, label='📌 Подписки', menu='main')
+    router.add((CHOOSING,), 'main_my_tasks', my_tasks, label='📋 Мои задачи', menu='main')
+    router.add_prefix((CHOOSING,), 'tasks_after', my_tasks, 'after')
+    router.add_prefix((CHOOSING,), 'tasks_before', my_tasks, 'before')
+    router.add_choice((CHOOSING,), 'tasks_range', tasks_range, TASK_RANGES, menu='task_ranges')
+
+    # Добавление задачи
+    router.add((ADD_TASK_ATTACHMENTS,), 'attach_yes', add_task_attach, label='✅ Да', menu='attach')
+    router.add((ADD_TASK_ATTACHMENTS,), 'attach_no', add_task_skip_attachments, label='❌ Нет', menu='attach')
+    router.add((ADD_TASK_ATTACHMENTS,), 'done', add_task_done, label='✅ Готово', menu='attachments')
+    router.add((ADD_TASK_ATTACHMENTS,), 'back', add_task_start)
+    router.add((CONFIRMING,), 'conf_confirm_yes', confirm_task, label='✅ Да', menu='confirm')
+    router.add((CONFIRMING,), 'conf_confirm_no', cancel_task, label='❌ Нет', menu='confirm')
+    router.add((CONFIRMING,), 'conf_back', return_to_task_time, label='🔙 Назад', menu='confirm_back')
+
+    # Недельное расписание
+    router.add((SELECT_DAY,), 'schedule_add', choose_schedule_day, label='➕ Добавить расписание', menu='schedule')
+    router.add((SELECT_DAY, SAVE_SCHEDULE), 'schedule_reset', reset_schedule, label='🗑️ Сбросить расписание', menu='schedule')
+    router.add_choice((SELECT_DAY,), 'schedule', select_schedule_day, SCHEDULE_DAYS, menu='schedule_days')
+    router.add_choice((SELECT_TIME_OF_DAY,), 'schedule_time', select_schedule_time_of_day, SCHEDULE_TIMES_OF_DAY, menu='schedule_times')
+    router.add((SELECT_TIME_OF_DAY,), 'back', manage_schedule)
+    router.add((SAVE_SCHEDULE,), 'schedule_save', save_schedule, label='✅ Сохранить расписание', menu='schedule_save')
+
+    # Быстрая заметка
+    router.add((QUICK_NOTE_CONFIRM,), 'quick_confirm_yes', quick_note_ask_time, label='✅ Установить напоминание', menu='quick_note')
+    router.add((QUICK_NOTE_CONFIRM,), 'quick_confirm_no', quick_note_save, label='❌ Без напоминания', menu='quick_note')
+    router.add((QUICK_NOTE_CONFIRM,), 'back', quick_note_start)
+
+    # Настройки
+    router.add((SETTINGS,), 'set_notification_time', ask_notification_time, label='⏰ Настроить время напоминания', menu='settings')
+
+    # Подписки
+    router.add_choice((SUBSCRIPTION_CATEGORY,), 'subscription', subscription_category_handler, SUBSCRIPTION_CATEGORIES, menu='subscription_categories')
+    router.add((SUBSCRIPTION_CATEGORY,), 'add_subscription', add_subscription_handler, label='➕ Добавить подписку', menu='subscriptions')
+    router.add((VIEW_SUBSCRIPTION,), 'view_subscriptions', view_subscriptions, label='📄 Просмотр подписок', menu='subscription_actions')
+    router.add((VIEW_SUBSCRIPTION,), 'add_subscription', ask_subscription_content, label='➕ Добавить подписку', menu='subscription_actions')
+    router.add((VIEW_SUBSCRIPTION,), 'back', subscriptions_menu)
+    router.add_choice((ADD_SUBSCRIPTION,), 'subscription', ask_subscription_content, SUBSCRIPTION_CATEGORIES)
+
+    # С остальных экранов «Назад» ведет в главное меню
+    router.add((CHOOSING, ADD_TASK_TOPIC, TYPING_TIME, SELECT_DAY, SET_SCHEDULE_HOUR, SAVE_SCHEDULE, QUICK_NOTE,
+                QUICK_NOTE_TIME, SETTINGS, SET_NOTIFICATION_TIME, SUBSCRIPTION_CATEGORY, ADD_SUBSCRIPTION), 'back', main_menu)
+
+register_routes()
+
+async def evict_idle_users(application: Application):
+    """Периодически выгружает из памяти данные пользователей, давно не писавших боту."""
+    while True:
+        await asyncio.sleep(PERSISTENCE_INTERVAL)
+        evicted = persistence.evict_idle(application)
+        if evicted:
+            logger.info("Выгружено из памяти неактивных пользователей и чатов: %s", evicted)
+
+async def backfill_task_due_at():
+    """Заполняет due_at у задач, сохраненных до миграции 9, короткими пачками между записями бота.
+
+    Продолжает с места, где остановился прошлый запуск; законченный проход больше не запускается.
+    """
+    after_id, total = await run_db(backfill_progress, db), 0
+    while after_id is not None:
+        result = await run_db(backfill_due_at, db, TIMEZONE, after_id, DUE_AT_BACKFILL_BATCH)
+        if result is None:
+            logger.info("Заполнение due_at закончено.")
+            break
+        after_id, updated = result
+        total += updated
+        await asyncio.sleep(DUE_AT_BACKFILL_PAUSE)
+    if total:
+        logger.info("Заполнено due_at у задач: %s", total)
+
+async def on_startup(application: Application):
+    """Запускает фоновые диспетчеры, когда цикл событий бота уже работает."""
+    global bot_loop, eviction_task, digest_task, backfill_task
+    bot_loop = asyncio.get_running_loop()
+    # Диспетчер сам подхватит из базы напоминания, сохраненные до перезапуска.
+    # В кластере диспетчеры запускает только лидер (on_leader в run_cluster)
+    if WORKER_MODE != 'cluster':
+        reminder_dispatcher.start()
+        weekly_dispatcher.start()
+    eviction_task = asyncio.create_task(evict_idle_users(application))
+    digest_task = asyncio.create_task(send_error_digests())
+    backfill_task = asyncio.create_task(backfill_task_due_at())
+    if metrics_server is not None:
+        await metrics_server.start()
+
+async def on_stop(application: Application):
+    """Останавливает фоновые задачи и диспетчеры, пока бот еще может отправлять сообщения.
+
+    Ожидание вынесено из цикла, чтобы диспетчеры могли доотправить пачку: строки напоминаний удаляются до отправки.
+    """
+    for task in (eviction_task, digest_task, backfill_task):
+        if task is not None:
+            task.cancel()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await asyncio.to_thread(reminder_dispatcher.stop)
+    await asyncio.to_thread(weekly_dispatcher.stop)
+
+async def on_shutdown(application: Application):
+    """Дописывает очередь записи и закрывает базу."""
+    await asyncio.to_thread(writer.stop)
+    db_executor.shutdown()
+    db.close_all()
+
+def accept_update(data):
+    """Кладет обновление из вебхука в ограниченную очередь приложения (в кластере — в update_inbox)."""
+    if cluster_worker is not None:
+        cluster_worker.inbox.put(data)
+        return True
+    try:
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+    except asyncio.QueueFull:
+        logger.warning("Очередь обновлений заполнена, вебхук отвечает 503.")
+        return False
+    return True
+
+async def run_webhook():
+    """Запускает бота в режиме вебхука со встроенным HTTP-сервером."""
+    global webhook_server
+    server = webhook_server = WebhookServer(accept_update, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_LISTEN, WEBHOOK_PORT)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        await on_startup(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info("Бот запущен в режиме вебхука.")
+        await stop.wait()
+        await server.stop()
+        await application.stop()
+        await on_stop(application)
+    # Выход из async with вызывает shutdown(): он последний раз записывает user_data и состояния диалогов
+    # через writer, поэтому writer и база закрываются только после него
+    await on_shutdown(application)
+
+async def on_cluster_update(data):
+    await application.update_queue.put(Update.de_json(data, application.bot))
+
+async def on_cluster_release(slots):
+    """Слоты переехали в другой процесс: записываем данные их пользователей и выгружаем из памяти."""
+    await application.update_persistence()
+    await persistence.flush()
+    evicted = persistence.evict(application, lambda key: slot_of(key) in slots)
+    # Пока слоты у другого процесса, он меняет задачи и подписки этих пользователей: отрисовки здесь устареют
+    render_cache.invalidate_where(lambda user_id: slot_of(user_id) in slots)
+    logger.info("Отдано слотов: %s, выгружено пользователей и чатов: %s", len(slots), evicted)
+
+async def on_cluster_acquire(slots):
+    """Слоты переехали сюда: состояния диалогов их пользователей берем из базы — их менял прежний владелец."""
+    states = await persistence.get_conversations(main_conversation.name)
+    states = {key: state for key, state in states.items() if slot_of(key[-1]) in slots}
+    # У ConversationHandler нет публичного способа перечитать состояния после initialize();
+    # update_no_track — тот же путь, которым он сам загружает их из persistence
+    conversations = main_conversation._conversations
+    for key in [key for key in conversations if slot_of(key[-1]) in slots and key not in states]:
+        del conversations.data[key]
+    conversations.update_no_track(states)
+
+async def ingest_updates():
+    """Лидер при long polling забирает обновления через getUpdates и складывает их в update_inbox."""
+    inbox = cluster_worker.inbox
+    await application.bot.delete_webhook()
+    offset = await run_db(inbox.offset)
+    while True:
         try:
-            query.edit_message_text('⏰ Введите время напоминания в минутах:', reply_markup=back_button())
-            logger.info("Запрошено время напоминания.")
+            updates = await application.bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
         except Exception as e:
-            logger.error(f"Ошибка при редактировании сообщения для настройки времени напоминания: {e}")
-            query.message.reply_text('⏰ Введите время напоминания в минутах:', reply_markup=back_button())
-        return SET_NOTIFICATION_TIME
-    elif data == 'back':
-        return main_menu(update, context)
-    else:
-        logger.warning(f"Неизвестные callback_data в настройках: {data}")
-        return SETTINGS
-
-def main():
-    # Вставьте свой токен бота здесь
-    TOKEN = ''  # Замените на ваш реальный токен бота
-
-    global updater
-    updater = Updater(TOKEN)
-    dp = updater.dispatcher
-
-    # Добавляем обработчик ошибок
-    dp.add_error_handler(error_handler)
-
-    # Определяем ConversationHandler
-    conv_handler = ConversationHandler(
+            logger.error("Ошибка получения обновлений: %s", e)
+            await asyncio.sleep(1)
+            continue
+        if updates:
+            offset = updates[-1].update_id + 1
+            # Обновления и следующий offset пишутся вместе: новый лидер продолжит с того же места
+            await run_db(inbox.put_many, [update.to_dict() for update in updates], offset)
+
+async def run_cluster():
+    """Запускает процесс кластера: обрабатывает свои слоты из update_inbox, лидер отправляет напоминания."""
+    global cluster_worker, webhook_server
+    ingest_task = None
+
+    async def on_leader(is_leader):
+        nonlocal ingest_task
+        if is_leader:
+            reminder_dispatcher.start()
+            weekly_dispatcher.start()
+            if BOT_MODE != 'webhook':
+                ingest_task = asyncio.create_task(ingest_updates())
+            return
+        if ingest_task is not None:
+            ingest_task.cancel()
+            ingest_task = None
+        await asyncio.to_thread(reminder_dispatcher.stop)
+        await asyncio.to_thread(weekly_dispatcher.stop)
+
+    cluster_worker = ClusterWorker(
+        db, WORKER_ID, on_cluster_update, on_cluster_release, on_cluster_acquire, on_leader,
+        executor=db_executor, writer=writer, heartbeat=CLUSTER_HEARTBEAT, ttl=CLUSTER_TTL
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        await on_startup(application)
+        await application.start()
+        if BOT_MODE == 'webhook':
+            # Каждый процесс принимает вебхук (за балансировщиком) и складывает обновления в общую очередь
+            webhook_server = WebhookServer(accept_update, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_LISTEN, WEBHOOK_PORT)
+            await webhook_server.start()
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None, allowed_updates=Update.ALL_TYPES
+            )
+        logger.info("Процесс кластера %s запущен.", WORKER_ID)
+        await cluster_worker.run(stop)
+        if ingest_task is not None:
+            ingest_task.cancel()
+        await cluster_worker.leave()
+        if webhook_server is not None:
+            await webhook_server.stop()
+        await application.stop()
+        await on_stop(application)
+    # Как и в run_webhook: writer и база нужны последнему сохранению persistence в shutdown()
+    await on_shutdown(application)
+
+async def cancel(update: Update, context: CallbackContext):
+    await update.message.reply_text('❌ Действие отменено. Нажмите /start, чтобы открыть меню.')
+    return ConversationHandler.END
+
+def conversation_handler(persistent=True):
+    """Основной ConversationHandler бота; без persistent используется в benchmarks.replay."""
+    return ConversationHandler(
         entry_points=[
             CommandHandler('start', start),
-            CallbackQueryHandler(button_handler, pattern='^(main_add_task|main_weekly_schedule|main_quick_note|main_settings|main_subscriptions|main_my_tasks)$')
+            main_menu_handler()
         ],
         states=ConversationHandler_states(),
         fallbacks=[CommandHandler('cancel', cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name='main',
+        persistent=persistent
     )
 
-    dp.add_handler(conv_handler)
+def main():
+    # Вставьте свой токен бота здесь
+    TOKEN = ''  # Замените на ваш реальный токен бота
 
-    updater.start_polling()
-    logger.info("Бот запущен и начал опрос.")
-    updater.idle()
+    global application, main_conversation
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(True)
+        .rate_limiter(outbound_limiter)
+        .persistence(persistence)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if BOT_MODE == 'webhook' or WORKER_MODE == 'cluster':
+        # Обновления приходят во встроенный сервер или из update_inbox, Updater для long polling не нужен
+        builder = builder.updater(None).update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+    application = builder.build()
+
+    # Добавляем обработчик ошибок
+    application.add_error_handler(error_handler)
+
+    # Счетчик входящих обновлений выполняется раньше остальных обработчиков
+    application.add_handler(TypeHandler(Update, count_update), group=-1)
+
+    main_conversation = conversation_handler()
+    application.add_handler(main_conversation)
+    application.add_handler(CommandHandler('search', search_command))
+    application.add_handler(CommandHandler('import', import_help))
+    application.add_handler(CommandHandler('export', export_command))
+    # Файлы, присланные вне шага прикрепления материалов к задаче, импортируются как списки задач
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension('csv') | filters.Document.FileExtension('ics'), import_document
+    ))
+    application.add_handler(CommandHandler('cache_stats', cache_stats))
+    application.add_handler(CommandHandler('metrics', metrics_command))
+    application.add_handler(CommandHandler('profile', profile_command))
+    application.add_handler(CommandHandler('errors', errors_command))
+
+    if WORKER_MODE == 'cluster':
+        asyncio.run(run_cluster())
+    elif BOT_MODE == 'webhook':
+        asyncio.run(run_webhook())
+    else:
+        logger.info("Бот запущен и начал опрос.")
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,237 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Счетчики и гистограммы — простые объекты без блокировок: гистограмма хранит
+заранее заданные границы корзин, наблюдение — один bisect и три сложения.
+Под GIL одновременное наблюдение из двух потоков изредка может потерять
+инкремент; для мониторинга это допустимо, зато инструментирование дешево
+настолько, что его не нужно выключать. Значения, которые уже считают сами
+компоненты (очередь исходящих, кэш, писатель, диспетчеры), не дублируются:
+они читаются функциями-источниками в момент запроса /metrics.
+
+MetricsServer отдает registry.render() по HTTP на asyncio-потоках, как и
+сервер вебхука, без внешних зависимостей.
+"""
+import asyncio
+import bisect
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин по умолчанию, в секундах: от миллисекунды до десяти секунд
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_STATEMENT = re.compile(r'\s*(\w+)')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+)', re.IGNORECASE)
+_statements = {}
+
+
+def statement_labels(sql):
+    """Тип запроса и таблица для SQL: ('SELECT', 'tasks'). Результат кэшируется по тексту запроса."""
+    labels = _statements.get(sql)
+    if labels is None:
+        kind = _STATEMENT.match(sql)
+        table = _TABLE.search(sql)
+        labels = _statements[sql] = (
+            kind.group(1).upper() if kind else 'OTHER',
+            table.group(1) if table else '',
+        )
+    return labels
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        # Последняя корзина — значения больше последней границы (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Оценка квантиля сверху: граница корзины, в которую попало q-е наблюдение (inf — за последней)."""
+        counts = list(self.counts)
+        rank = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return 0.0
+
+
+class _Family:
+    """Метрика с метками: по дочернему счетчику или гистограмме на каждый набор значений меток."""
+
+    def __init__(self, kind, name, help, labelnames, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._factory())
+        return child
+
+    def children(self):
+        return list(self._children.items())
+
+
+class _Callback:
+    """Метрика, значение которой при каждом запросе вычисляет fn(): число или {значения меток: число}."""
+
+    def __init__(self, kind, name, help, labelnames, fn):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.fn = fn
+
+    def children(self):
+        value = self.fn()
+        if value is None:
+            return []
+        if not self.labelnames:
+            return [((), value)]
+        return list(value.items())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        """Счетчик; без меток возвращается сам Counter, с метками — семейство с labels(...)."""
+        family = self._add(_Family('counter', self.prefix + name, help, tuple(labelnames), Counter))
+        return family if labelnames else family.labels()
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        family = self._add(_Family('histogram', self.prefix + name, help, tuple(labelnames),
+                                   lambda: Histogram(tuple(buckets))))
+        return family if labelnames else family.labels()
+
+    def gauge_fn(self, name, help, fn, labelnames=(), kind='gauge'):
+        """Метрика-источник: fn() вызывается при каждом render(); kind='counter' для накопительных значений."""
+        self._add(_Callback(kind, self.prefix + name, help, tuple(labelnames), fn))
+
+    def get(self, name):
+        return self._metrics.get(self.prefix + name)
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus 0.0.4."""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                children = metric.children()
+            except Exception as e:
+                logger.error("Не удалось снять метрику %s: %s", metric.name, e)
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for values, child in children:
+                if metric.kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(child.bounds + (math.inf,), list(child.counts)):
+                        cumulative += count
+                        le = _labels(metric.labelnames, values, f'le="{_number(bound)}"')
+                        lines.append(f'{metric.name}_bucket{le} {cumulative}')
+                    labels = _labels(metric.labelnames, values)
+                    lines.append(f'{metric.name}_sum{labels} {_number(child.sum)}')
+                    lines.append(f'{metric.name}_count{labels} {cumulative}')
+                else:
+                    value = child.value if isinstance(child, Counter) else child
+                    lines.append(f'{metric.name}{_labels(metric.labelnames, values)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """HTTP-сервер для сборщика Prometheus: GET path отдает registry.render()."""
+
+    def __init__(self, registry, host='127.0.0.1', port=9108, path='/metrics'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Метрики доступны на %s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split(' ')
+            if len(parts) < 2 or parts[1].split('?', 1)[0] != self.path:
+                status, body = '404 Not Found', b''
+            elif parts[0] != 'GET':
+                status, body = '405 Method Not Allowed', b''
+            else:
+                status, body = '200 OK', self.registry.render().encode()
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
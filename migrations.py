@@ -0,0 +1,436 @@
+"""Версионированные миграции схемы tasks.db.
+
+Каждая миграция применяется ровно один раз в отдельной транзакции, номер
+последней применённой версии хранится в таблице schema_version. Старые файлы
+tasks.db обновляются на месте при запуске бота.
+
+Проверка планов горячих запросов:
+    python migrations.py tasks.db
+"""
+import logging
+import sys
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+
+def fts_sync_statements(owner):
+    """Представления и триггеры, поддерживающие tasks_fts и subscriptions_fts; owner — SQL токена владельца от {row}."""
+    new, old = owner.format(row='new.'), owner.format(row='old.')
+    return [
+        f"CREATE VIEW tasks_search AS SELECT id, {owner.format(row='')} AS owner, topic, description FROM tasks",
+        f"CREATE VIEW subscriptions_search AS SELECT id, {owner.format(row='')} AS owner, content FROM subscriptions",
+        f'''
+        CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, owner, topic, description) VALUES (new.id, {new}, new.topic, new.description);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, owner, topic, description)
+            VALUES ('delete', old.id, {old}, old.topic, old.description);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER tasks_fts_update AFTER UPDATE OF user_id, topic, description ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, owner, topic, description)
+            VALUES ('delete', old.id, {old}, old.topic, old.description);
+            INSERT INTO tasks_fts (rowid, owner, topic, description) VALUES (new.id, {new}, new.topic, new.description);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER subscriptions_fts_insert AFTER INSERT ON subscriptions BEGIN
+            INSERT INTO subscriptions_fts (rowid, owner, content) VALUES (new.id, {new}, new.content);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER subscriptions_fts_delete AFTER DELETE ON subscriptions BEGIN
+            INSERT INTO subscriptions_fts (subscriptions_fts, rowid, owner, content) VALUES ('delete', old.id, {old}, old.content);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER subscriptions_fts_update AFTER UPDATE OF user_id, content ON subscriptions BEGIN
+            INSERT INTO subscriptions_fts (subscriptions_fts, rowid, owner, content) VALUES ('delete', old.id, {old}, old.content);
+            INSERT INTO subscriptions_fts (rowid, owner, content) VALUES (new.id, {new}, new.content);
+        END
+        ''',
+    ]
+
+
+FTS_OBJECTS = (
+    'TRIGGER tasks_fts_insert', 'TRIGGER tasks_fts_delete', 'TRIGGER tasks_fts_update',
+    'TRIGGER subscriptions_fts_insert', 'TRIGGER subscriptions_fts_delete', 'TRIGGER subscriptions_fts_update',
+    'VIEW tasks_search', 'VIEW subscriptions_search',
+)
+
+# (версия, описание, список SQL-команд)
+MIGRATIONS = [
+    (1, 'Базовые таблицы', [
+        '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            topic TEXT,
+            description TEXT,
+            attachments TEXT,
+            time TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            day TEXT,
+            time_of_day TEXT,
+            hour INTEGER,
+            task TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            category TEXT,
+            content TEXT
+        )
+        ''',
+    ]),
+    (2, 'Индексы для горячих запросов', [
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_time ON tasks (user_id, time)',
+        'CREATE INDEX IF NOT EXISTS idx_subscriptions_user_category ON subscriptions (user_id, category)',
+        'CREATE INDEX IF NOT EXISTS idx_schedules_user_day_hour ON schedules (user_id, day, hour)',
+    ]),
+    (3, 'Постоянное хранилище напоминаний', [
+        '''
+        CREATE TABLE IF NOT EXISTS reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT,
+            attachments TEXT,
+            due_at INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_reminders_due_at ON reminders (due_at)',
+    ]),
+    (4, 'Индекс слотов недельного расписания', [
+        'CREATE INDEX IF NOT EXISTS idx_schedules_day_hour_user ON schedules (day, hour, user_id)',
+    ]),
+    (5, 'Хранилище user_data, chat_data и состояний диалогов', [
+        '''
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS chat_data (
+            chat_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (name, key)
+        )
+        ''',
+    ]),
+    (6, 'Несколько процессов: очередь обновлений, процессы и аренда лидера', [
+        '''
+        CREATE TABLE IF NOT EXISTS update_inbox (
+            update_id INTEGER PRIMARY KEY,
+            slot INTEGER NOT NULL,
+            payload TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_update_inbox_slot ON update_inbox (slot, update_id)',
+        '''
+        CREATE TABLE IF NOT EXISTS workers (
+            worker_id TEXT PRIMARY KEY,
+            seen_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS cluster_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+        ''',
+    ]),
+    (7, 'Вложения задач с file_id Telegram', [
+        '''
+        CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            file_id TEXT,
+            file_unique_id TEXT UNIQUE,
+            name TEXT,
+            url TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS task_attachments (
+            task_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            attachment_id INTEGER NOT NULL,
+            PRIMARY KEY (task_id, position)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (8, 'Полнотекстовый поиск по задачам и подпискам (FTS5)', [
+        # Содержимое индексов берется из представлений: колонка owner есть только в индексе
+        "CREATE VIEW IF NOT EXISTS tasks_search AS "
+        "SELECT id, 'u' || user_id AS owner, topic, description FROM tasks",
+        "CREATE VIEW IF NOT EXISTS subscriptions_search AS "
+        "SELECT id, 'u' || user_id AS owner, content FROM subscriptions",
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            owner, topic, description,
+            content='tasks_search', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+        )
+        ''',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS subscriptions_fts USING fts5(
+            owner, content,
+            content='subscriptions_search', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, owner, topic, description)
+            VALUES (new.id, 'u' || new.user_id, new.topic, new.description);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, owner, topic, description)
+            VALUES ('delete', old.id, 'u' || old.user_id, old.topic, old.description);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF user_id, topic, description ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, owner, topic, description)
+            VALUES ('delete', old.id, 'u' || old.user_id, old.topic, old.description);
+            INSERT INTO tasks_fts (rowid, owner, topic, description)
+            VALUES (new.id, 'u' || new.user_id, new.topic, new.description);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS subscriptions_fts_insert AFTER INSERT ON subscriptions BEGIN
+            INSERT INTO subscriptions_fts (rowid, owner, content) VALUES (new.id, 'u' || new.user_id, new.content);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS subscriptions_fts_delete AFTER DELETE ON subscriptions BEGIN
+            INSERT INTO subscriptions_fts (subscriptions_fts, rowid, owner, content)
+            VALUES ('delete', old.id, 'u' || old.user_id, old.content);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS subscriptions_fts_update AFTER UPDATE OF user_id, content ON subscriptions BEGIN
+            INSERT INTO subscriptions_fts (subscriptions_fts, rowid, owner, content)
+            VALUES ('delete', old.id, 'u' || old.user_id, old.content);
+            INSERT INTO subscriptions_fts (rowid, owner, content) VALUES (new.id, 'u' || new.user_id, new.content);
+        END
+        ''',
+        # Ранжирование по умолчанию (ORDER BY rank): колонка owner не влияет, совпадение в топике весит больше
+        "INSERT INTO tasks_fts (tasks_fts, rank) VALUES ('rank', 'bm25(0.0, 10.0, 1.0)')",
+        "INSERT INTO subscriptions_fts (subscriptions_fts, rank) VALUES ('rank', 'bm25(0.0, 1.0)')",
+        # Индексируем строки, сохраненные до миграции
+        "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')",
+        "INSERT INTO subscriptions_fts (subscriptions_fts) VALUES ('rebuild')",
+    ]),
+    # Значения для старых строк заполняет backfill_due_at() после запуска бота
+    (9, 'Время задачи в UTC (due_at) для выборок по диапазону', [
+        'ALTER TABLE tasks ADD COLUMN due_at INTEGER',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_due ON tasks (user_id, due_at)',
+    ]),
+    # У групповых чатов id отрицательный: токен 'u-100' токенизатор делит на два, а в запросе owner:u-100
+    # минус — синтаксическая ошибка FTS5. Минус заменяется на 'n' (search.owner_token), индексы пересобираются
+    (10, 'Токен владельца FTS для отрицательных id чатов', [
+        *(f'DROP {kind} IF EXISTS {name}' for kind, name in (obj.split() for obj in FTS_OBJECTS)),
+        *fts_sync_statements("'u' || replace({row}user_id, '-', 'n')"),
+        "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')",
+        "INSERT INTO subscriptions_fts (subscriptions_fts) VALUES ('rebuild')",
+    ]),
+]
+
+# Запросы обработчиков, которые обязаны идти по индексу: имя -> (SQL, параметры)
+HOT_QUERIES = {
+    'my_tasks_next_page': (
+        'SELECT id, topic, description, attachments, time FROM tasks '
+        'WHERE user_id = ? AND (time, id) > (?, ?) ORDER BY time, id LIMIT ?', (1, '', -1, 51)),
+    'my_tasks_prev_page': (
+        'SELECT id, topic, description, attachments, time FROM tasks '
+        'WHERE user_id = ? AND (time, id) < (?, ?) ORDER BY time DESC, id DESC LIMIT ?', (1, '2030-01-01 00:00', 1, 51)),
+    'view_subscriptions': (
+        'SELECT content FROM subscriptions WHERE user_id = ? AND category = ?', (1, 'Sport')),
+    'reset_schedule': (
+        'DELETE FROM schedules WHERE user_id = ?', (1,)),
+    'reminder_window': (
+        'SELECT due_at, id FROM reminders WHERE (due_at, id) > (?, ?) AND due_at <= ? '
+        'ORDER BY due_at, id LIMIT ?', (0, 0, 100, 1000)),
+    'weekly_slot_users': (
+        'SELECT DISTINCT user_id FROM schedules WHERE day = ? AND hour = ? AND user_id > ? ORDER BY user_id LIMIT ?',
+        ('Monday', 9, 0, 1000)),
+    'weekly_slot': (
+        'SELECT user_id, time_of_day, hour, task FROM schedules '
+        'WHERE day = ? AND hour = ? AND user_id BETWEEN ? AND ? ORDER BY user_id', ('Monday', 9, 1, 1000)),
+    'tasks_due_range': (
+        'SELECT id, topic, description, attachments, time FROM tasks '
+        'WHERE user_id = ? AND due_at >= ? AND due_at < ? ORDER BY due_at, id LIMIT ?', (1, 0, 100, 51)),
+    'tasks_overdue': (
+        'SELECT id, topic, description, attachments, time FROM tasks '
+        'WHERE user_id = ? AND due_at < ? ORDER BY due_at DESC, id DESC LIMIT ?', (1, 100, 51)),
+    'export_tasks_page': (
+        'SELECT id, topic, description, time, due_at FROM tasks '
+        'WHERE user_id = ? AND (time, id) > (?, ?) ORDER BY time, id LIMIT ?', (1, '', -1, 5000)),
+    'export_schedules_page': (
+        'SELECT id, day, time_of_day, hour, task FROM schedules '
+        'WHERE user_id = ? AND (day, hour, id) > (?, ?, ?) ORDER BY day, hour, id LIMIT ?', (1, '', -1, -1, 5000)),
+    'export_subscriptions_page': (
+        'SELECT id, category, content FROM subscriptions '
+        'WHERE user_id = ? AND (category, id) > (?, ?) ORDER BY category, id LIMIT ?', (1, '', -1, 5000)),
+    'export_next_user': (
+        'SELECT MIN(user_id) FROM ('
+        'SELECT MIN(user_id) AS user_id FROM tasks WHERE user_id > :after UNION ALL '
+        'SELECT MIN(user_id) FROM schedules WHERE user_id > :after UNION ALL '
+        'SELECT MIN(user_id) FROM subscriptions WHERE user_id > :after)', {'after': 0}),
+    'load_conversations': (
+        'SELECT key, state FROM conversations WHERE name = ? AND updated_at >= ?', ('main', 0)),
+}
+
+
+def current_version(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def migrate(db):
+    """Применяет к базе все ещё не применённые миграции. Возвращает итоговую версию схемы."""
+    with db.transaction() as conn:
+        version = current_version(conn)
+    for target, description, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        with db.transaction() as conn:
+            # Повторная проверка внутри транзакции: другой процесс мог успеть раньше
+            if current_version(conn) >= target:
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute('INSERT INTO schema_version (version) VALUES (?)', (target,))
+        logger.info("Применена миграция %s: %s", target, description)
+        version = target
+    return version
+
+
+# Ключ cluster_state с последним id, просмотренным backfill_due_at; BACKFILL_DONE — проход закончен.
+# Все пути записи после миграции 9 сами заполняют due_at, поэтому законченный проход не возобновляется
+BACKFILL_KEY = 'due_at_backfill'
+BACKFILL_DONE = -1
+
+
+def due_at_of(time_str, timezone):
+    """UTC timestamp для tasks.time ('ГГГГ-ММ-ДД ЧЧ:ММ' в часовом поясе бота) или None для пустого/неверного."""
+    try:
+        return int(timezone.localize(datetime.strptime(time_str, '%Y-%m-%d %H:%M')).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def backfill_progress(db):
+    """Id, после которого продолжить заполнение due_at, или None, если оно уже закончено."""
+    row = db.query_one('SELECT value FROM cluster_state WHERE key = ?', (BACKFILL_KEY,))
+    if row is None:
+        return 0
+    return None if row[0] == BACKFILL_DONE else row[0]
+
+
+def backfill_due_at(db, timezone, after_id=0, batch=1000):
+    """Заполняет due_at у следующих batch задач с id > after_id, у которых он еще пуст.
+
+    Каждая пачка — отдельная короткая транзакция, поэтому бот продолжает писать
+    между пачками. Вместе с пачкой в cluster_state записывается последний
+    просмотренный id: после перезапуска проход продолжается с него, а строки с
+    неразбираемым time остаются позади курсора и больше не читаются. Возвращает
+    (последний просмотренный id, обновлено строк) или None, если задач без due_at
+    больше нет, — тогда проход отмечается законченным.
+    """
+    rows = db.query(
+        "SELECT id, time FROM tasks WHERE id > ? AND due_at IS NULL AND time != '' ORDER BY id LIMIT ?",
+        (after_id, batch)
+    )
+    last_id = rows[-1][0] if rows else BACKFILL_DONE
+    updates = []
+    for task_id, time_str in rows:
+        due_at = due_at_of(time_str, timezone)
+        if due_at is not None:
+            updates.append((due_at, task_id))
+    with db.transaction() as conn:
+        # Условие на due_at: строку могли обновить с новым временем, пока пачка считалась
+        conn.executemany('UPDATE tasks SET due_at = ? WHERE id = ? AND due_at IS NULL', updates)
+        conn.execute(
+            'INSERT INTO cluster_state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+            (BACKFILL_KEY, last_id)
+        )
+    if not rows:
+        return None
+    return last_id, len(updates)
+
+
+def explain(conn, sql, params=()):
+    """Возвращает строки EXPLAIN QUERY PLAN для запроса."""
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def uses_index(plan):
+    """Запрос идёт по индексу: нет полного сканирования и временной сортировки."""
+    return (
+        any('USING INDEX' in step or 'USING COVERING INDEX' in step for step in plan)
+        and not any(step.startswith('SCAN') and 'USING' not in step for step in plan)
+        and not any('TEMP B-TREE' in step for step in plan)
+    )
+
+
+def check_query_plans(conn, queries=None):
+    """Проверяет планы горячих запросов. Возвращает словарь имя -> (план, по индексу ли)."""
+    results = {}
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        plan = explain(conn, sql, params)
+        results[name] = (plan, uses_index(plan))
+    return results
+
+
+def main(path='tasks.db'):
+    from db import Database
+
+    db = Database(path)
+    version = migrate(db)
+    print(f'Версия схемы: {version}')
+    failed = False
+    for name, (plan, ok) in check_query_plans(db.conn).items():
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {' | '.join(plan)}")
+        failed = failed or not ok
+    db.close_all()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,189 @@
+"""Очередь исходящих запросов к Telegram с ограничением скорости.
+
+OutboundLimiter подключается к Application через rate_limiter(), поэтому через
+него проходят все вызовы Bot API: ответы обработчиков, правки меню,
+напоминания и рассылка расписания. Новые сообщения в конкретный чат
+ограничиваются персональным токен-бакетом; правки уже отправленных сообщений
+(навигация по inline-меню) и ответы на нажатия кнопок его не расходуют, иначе
+быстрое листание меню упиралось бы в 1 сообщение в секунду. Общий поток
+запросов с chat_id, включая правки, ограничивается глобальным бакетом; за глобальные
+токены ожидающие запросы конкурируют по приоритету (напоминания раньше
+правок меню). Ответ 429 выдерживает паузу retry_after для всего бота и
+повторяет запрос.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — раньше. Передаются в bot.send_message(..., rate_limit_args={'priority': ...})
+PRIORITY_REMINDER = 0
+PRIORITY_DEFAULT = 1
+
+# Методы, которые не создают новых сообщений и не расходуют лимит чата
+CHAT_EXEMPT_ENDPOINTS = frozenset((
+    'editMessageText', 'editMessageCaption', 'editMessageMedia', 'editMessageReplyMarkup',
+    'deleteMessage', 'sendChatAction', 'answerCallbackQuery',
+))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def take(self):
+        """Забирает токен и возвращает 0 или возвращает, сколько секунд ждать до появления токена."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    async def acquire(self):
+        while (delay := self.take()) > 0:
+            await asyncio.sleep(delay)
+
+
+class OutboundLimiter(BaseRateLimiter):
+    """Приоритетный ограничитель исходящих запросов: глобальный лимит, лимит на чат и повтор после 429."""
+
+    def __init__(self, global_rate=30, global_burst=30, chat_rate=1, chat_burst=3, max_retries=3,
+                 max_idle_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_idle_chats = max_idle_chats
+        self._chats = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._pump_task = None
+        self._paused_until = 0.0
+        self._sent_times = deque()
+        self.waiting = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def initialize(self):
+        self._wakeup = asyncio.Event()
+        self._pump_task = asyncio.create_task(self._pump())
+
+    async def shutdown(self):
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+            self._pump_task = None
+
+    def stats(self):
+        """Глубина очереди и пропускная способность для мониторинга."""
+        now = time.monotonic()
+        while self._sent_times and self._sent_times[0] < now - 60:
+            self._sent_times.popleft()
+        return {
+            'queue_depth': self.waiting,
+            'sent_total': self.sent,
+            'sent_per_second': len(self._sent_times) / 60,
+            'retried_total': self.retried,
+            'failed_total': self.failed,
+            'paused_for': max(0.0, self._paused_until - now),
+        }
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_idle_chats:
+                # Чаты с полным бакетом ничем не отличаются от новых — их можно забыть
+                self._chats = {key: b for key, b in self._chats.items() if not b.full}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire_global(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    async def _pump(self):
+        """Раздает глобальные токены ожидающим запросам в порядке приоритета."""
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            delay = self.global_bucket.take()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                self.global_bucket.give_back()
+            else:
+                future.set_result(None)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            # getMe, answerCallbackQuery и т.п. не расходуют лимиты сообщений
+            return await callback(*args, **kwargs)
+        priority = (rate_limit_args or {}).get('priority', PRIORITY_DEFAULT)
+        chat_limited = endpoint not in CHAT_EXEMPT_ENDPOINTS
+
+        for attempt in range(self.max_retries + 1):
+            self.waiting += 1
+            try:
+                if chat_limited:
+                    await self._chat_bucket(chat_id).acquire()
+                await self._acquire_global(priority)
+            finally:
+                self.waiting -= 1
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                retry_after = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else retry_after
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                self.retried += 1
+                logger.warning("Telegram просит подождать %s с перед %s для чата %s.", retry_after, endpoint, chat_id)
+                continue
+            self.sent += 1
+            now = time.monotonic()
+            self._sent_times.append(now)
+            while self._sent_times[0] < now - 60:
+                self._sent_times.popleft()
+            return result
@@ -0,0 +1,242 @@
+"""Хранение user_data, chat_data и состояний диалогов в tasks.db.
+
+SQLitePersistence подключается к Application через persistence(). Данные
+пользователя не читаются при старте целиком: они подгружаются из базы при
+первом обновлении от пользователя (refresh_user_data вызывается перед каждым
+обработчиком). Application раз в update_interval секунд передает данные
+пользователей, которых касались обработчики; в базу уходят только те, чей
+сериализованный снимок действительно изменился, — одной групповой транзакцией
+через WriteBehindWriter. Пользователи, не писавшие боту дольше idle_ttl,
+выгружаются из памяти методом evict_idle(): их данные уже лежат в базе и будут
+подгружены снова при следующем обновлении.
+
+Состояния диалогов хранятся только пока диалог не завершён, поэтому они
+загружаются при старте; состояния старше conversation_ttl отбрасываются.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+UPSERT_SQL = (
+    'INSERT INTO {table} ({column}, data, updated_at) VALUES (?, ?, ?) '
+    'ON CONFLICT ({column}) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at'
+)
+SELECT_SQL = 'SELECT data FROM {table} WHERE {column} = ?'
+DELETE_SQL = 'DELETE FROM {table} WHERE {column} = ?'
+
+CONVERSATION_UPSERT_SQL = (
+    'INSERT INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?) '
+    'ON CONFLICT (name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at'
+)
+CONVERSATION_DELETE_SQL = 'DELETE FROM conversations WHERE name = ? AND key = ?'
+CONVERSATIONS_SQL = 'SELECT key, state FROM conversations WHERE name = ? AND updated_at >= ?'
+
+
+class _Store:
+    """Данные одного вида (user_data или chat_data): что загружено, когда использовалось, что записано."""
+
+    def __init__(self, table, column):
+        self.upsert_sql = UPSERT_SQL.format(table=table, column=column)
+        self.select_sql = SELECT_SQL.format(table=table, column=column)
+        self.delete_sql = DELETE_SQL.format(table=table, column=column)
+        # id -> Future загрузки; завершённый Future означает, что данные уже в памяти
+        self.loading = {}
+        self.seen = {}
+        # id -> хэш последнего записанного снимка
+        self.digests = {}
+        # Выгружаемые из памяти id: drop_*_data для них не должен удалять строку
+        self.evicting = {}
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для python-telegram-bot поверх tasks.db с ленивой загрузкой и записью только изменений."""
+
+    def __init__(self, db, writer, executor=None, update_interval=60, idle_ttl=3600,
+                 conversation_ttl=7 * 24 * 3600, clock=time.time):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.writer = writer
+        self.executor = executor
+        self.idle_ttl = idle_ttl
+        self.conversation_ttl = conversation_ttl
+        self.clock = clock
+        self._users = _Store('user_data', 'user_id')
+        self._chats = _Store('chat_data', 'chat_id')
+        self._pending = set()
+        self.loaded = 0
+        self.written = 0
+        self.skipped = 0
+        self.evicted = 0
+
+    def stats(self):
+        return {
+            'users_in_memory': len(self._users.loading),
+            'chats_in_memory': len(self._chats.loading),
+            'loaded_total': self.loaded,
+            'written_total': self.written,
+            'unchanged_total': self.skipped,
+            'evicted_total': self.evicted,
+        }
+
+    def _write(self, sql, params):
+        future = self.writer.write(sql, params)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+    def _read(self, store, key):
+        row = self.db.query_one(store.select_sql, (key,))
+        return row[0] if row else None
+
+    # Загрузка при старте: только состояния незавершённых диалогов
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        since = int(self.clock() - self.conversation_ttl)
+        rows = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.db.query, CONVERSATIONS_SQL, (name, since))
+        logger.info("Восстановлено незавершённых диалогов %s: %s", name, len(rows))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    # Ленивая загрузка перед обработчиком
+
+    async def _refresh(self, store, key, data):
+        store.seen[key] = self.clock()
+        loading = store.loading.get(key)
+        if loading is None:
+            # Параллельные обновления того же пользователя ждут одну загрузку
+            loading = store.loading[key] = asyncio.get_running_loop().create_future()
+            try:
+                blob = await asyncio.get_running_loop().run_in_executor(self.executor, self._read, store, key)
+            except Exception as e:
+                del store.loading[key]
+                loading.set_exception(e)
+                raise
+            if blob is not None:
+                data.update(pickle.loads(blob))
+                store.digests[key] = hashlib.blake2b(blob, digest_size=16).digest()
+                self.loaded += 1
+            loading.set_result(None)
+        elif not loading.done():
+            await asyncio.shield(loading)
+        if key in store.evicting:
+            # Пользователь вернулся, пока выгрузка ждала цикла сохранения: запомним его данные
+            store.evicting[key] = data
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh(self._users, user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh(self._chats, chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # Запись изменений
+
+    def _update(self, store, key, data):
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.blake2b(blob, digest_size=16).digest()
+        if store.digests.get(key) == digest:
+            self.skipped += 1
+            return
+        store.digests[key] = digest
+        self._write(store.upsert_sql, (key, blob, int(self.clock())))
+        self.written += 1
+
+    async def update_user_data(self, user_id, data):
+        self._update(self._users, user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._update(self._chats, chat_id, data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is None:
+            self._write(CONVERSATION_DELETE_SQL, (name, json.dumps(key)))
+        else:
+            self._write(CONVERSATION_UPSERT_SQL, (name, json.dumps(key), json.dumps(new_state), int(self.clock())))
+
+    def _drop(self, store, key):
+        if key in store.evicting:
+            revived = store.evicting.pop(key)
+            if revived is not None:
+                # Application не сохранит данные, изменённые между выгрузкой и этим вызовом
+                store.digests.pop(key, None)
+                self._update(store, key, revived)
+            return
+        store.loading.pop(key, None)
+        store.seen.pop(key, None)
+        store.digests.pop(key, None)
+        self._write(store.delete_sql, (key,))
+
+    async def drop_user_data(self, user_id):
+        self._drop(self._users, user_id)
+
+    async def drop_chat_data(self, chat_id):
+        self._drop(self._chats, chat_id)
+
+    async def flush(self):
+        """Дожидается записи всех изменений, поставленных в очередь."""
+        if self._pending:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in list(self._pending)))
+
+    # Выгрузка неактивных пользователей
+
+    def _select(self, store, predicate):
+        keys = [key for key, seen in store.seen.items() if predicate(key, seen) and key in store.digests]
+        for key in keys:
+            store.loading.pop(key, None)
+            store.seen.pop(key, None)
+            store.digests.pop(key, None)
+            store.evicting[key] = None
+        return keys
+
+    def _evict(self, application, predicate):
+        users = self._select(self._users, predicate)
+        for user_id in users:
+            application.drop_user_data(user_id)
+        chats = self._select(self._chats, predicate)
+        for chat_id in chats:
+            application.drop_chat_data(chat_id)
+        self.evicted += len(users) + len(chats)
+        return len(users) + len(chats)
+
+    def evict_idle(self, application):
+        """Выгружает из памяти данные пользователей и чатов, давно не писавших боту. Возвращает их число.
+
+        Выгружаются только уже записанные в базу данные: пользователь без
+        сохранённого снимка остаётся в памяти до ближайшего цикла сохранения.
+        """
+        deadline = self.clock() - self.idle_ttl
+        return self._evict(application, lambda key, seen: seen < deadline)
+
+    def evict(self, application, predicate):
+        """Выгружает из памяти уже записанные данные пользователей и чатов с predicate(id) — например,
+        переехавших в другой процесс кластера. Возвращает их число."""
+        return self._evict(application, lambda key, seen: predicate(key))
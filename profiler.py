@@ -0,0 +1,131 @@
+"""Профилирование работающего бота по команде администратора.
+
+Два режима на фиксированное окно в seconds секунд:
+
+- sample — отдельный поток раз в interval секунд снимает стеки всех потоков
+  (sys._current_frames): цикл событий с обработчиками, пул db, поток-писатель,
+  диспетчеры напоминаний и расписания. Результат — файл .collapsed в формате
+  flamegraph.pl / speedscope: «поток;функция;...;функция число_снимков».
+- trace — детерминированный cProfile в потоке цикла событий: обработчики,
+  отрисовка и вызовы Bot API, включая отправку напоминаний, которую диспетчеры
+  передают в цикл. Результат — файл .pstats для pstats/snakeviz. Из-за
+  переключения корутин cumtime ожидающих функций включает чужую работу;
+  надежнее смотреть на tottime. Другие потоки в trace не попадают: cProfile
+  включается только в своем потоке, а threading.setprofile действует лишь на
+  потоки, запущенные позже, — пул db, писатель и диспетчеры к этому моменту
+  уже работают. Их время видно только в режиме sample; в trace запросы к базе
+  выглядят как ожидание future в цикле событий.
+
+Вне окна ничего не установлено: ни потока-сэмплера, ни профилировщика, так
+что накладных расходов нет.
+"""
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+MODES = ('sample', 'trace')
+
+
+def _frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Profiler:
+    def __init__(self, directory='profiles', interval=0.005, top=15, max_seconds=300):
+        self.directory = directory
+        self.interval = interval
+        self.top = top
+        self.max_seconds = max_seconds
+        self.active = None
+
+    async def run(self, mode, seconds):
+        """Профилирует seconds секунд и возвращает (путь к файлу, текст сводки top-N)."""
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим профилирования: {mode}")
+        if self.active is not None:
+            raise RuntimeError(f"Профилирование ({self.active}) уже идет")
+        seconds = max(1, min(seconds, self.max_seconds))
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{mode}")
+        self.active = mode
+        try:
+            if mode == 'trace':
+                return await self._trace(path + '.pstats', seconds)
+            return await self._sample(path + '.collapsed', seconds)
+        finally:
+            self.active = None
+
+    async def _trace(self, path, seconds):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        profile.dump_stats(path)
+        stats = pstats.Stats(profile).stats
+        total = sum(tt for _, _, tt, _, _ in stats.values()) or 1
+        rows = sorted(stats.items(), key=lambda item: -item[1][2])[:self.top]
+        lines = [
+            f"trace {seconds} с, функций: {len(stats)}; только поток цикла событий — "
+            f"время пула db, писателя и диспетчеров смотрите в режиме sample",
+            "По собственному времени (tottime, cumtime, вызовов):",
+        ]
+        for (filename, line, name), (_, calls, tt, ct, _) in rows:
+            lines.append(
+                f"{tt / total:6.1%} {tt * 1000:8.1f} мс {ct * 1000:8.1f} мс {calls:>7} "
+                f"{name} ({os.path.basename(filename)}:{line})"
+            )
+        return path, '\n'.join(lines)
+
+    async def _sample(self, path, seconds):
+        stacks = Counter()
+        stop = threading.Event()
+        thread = threading.Thread(target=self._sampler, args=(stacks, stop), name='profiler', daemon=True)
+        thread.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(thread.join)
+
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+        samples = sum(stacks.values()) or 1
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames[1:]):
+                inclusive[frame] += count
+        lines = [f"sample {seconds} с, снимков стека: {sum(stacks.values())}; на вершине стека:"]
+        lines += [f"{count / samples:6.1%} {frame}" for frame, count in own.most_common(self.top)]
+        lines.append("Включая вызванные функции:")
+        lines += [f"{count / samples:6.1%} {frame}" for frame, count in inclusive.most_common(self.top)]
+        return path, '\n'.join(lines)
+
+    def _sampler(self, stacks, stop):
+        me = threading.get_ident()
+        names = {}
+        while not stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    names.update((t.ident, t.name) for t in threading.enumerate())
+                    name = names.get(ident, str(ident))
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                frames.append(name)
+                stacks[';'.join(reversed(frames))] += 1
@@ -0,0 +1,213 @@
+"""Постоянное хранилище напоминаний и диспетчер их отправки.
+
+Напоминание живёт в таблице reminders, пока не будет отправлено, поэтому
+перезапуск или деплой бота ничего не теряет. Диспетчер держит в памяти только
+ближайшее окно напоминаний в куче (due_at, id), подгружая его из индекса
+idx_reminders_due_at, и отправляет всё, что наступило к одному тику, одной
+пачкой. Память не зависит от общего числа ожидающих напоминаний.
+"""
+import heapq
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INSERT_SQL = 'INSERT INTO reminders (chat_id, text, attachments, due_at) VALUES (?, ?, ?, ?)'
+
+# Больше любого реального id: ключ (due_at, MAX_ID) покрывает все напоминания на момент due_at
+MAX_ID = 2 ** 63 - 1
+
+
+def add_reminder(conn, chat_id, text, attachments, due_at):
+    """Сохраняет напоминание (due_at — UTC timestamp) и возвращает его id. Вызывается внутри транзакции."""
+    cur = conn.execute(INSERT_SQL, (chat_id, text, json.dumps(attachments, ensure_ascii=False), int(due_at)))
+    return cur.lastrowid
+
+
+class ReminderDispatcher:
+    """Поток, отправляющий напоминания из таблицы reminders по наступлении due_at.
+
+    fire_batch(rows) получает список (id, chat_id, text, attachments, due_at)
+    всех напоминаний, наступивших к одному тику. Строки удаляются из базы до
+    вызова fire_batch, поэтому каждое напоминание отправляется не более одного раза.
+
+    Если напоминания добавляют другие процессы (без add()), poll_interval задает,
+    как часто искать в таблице новые id, попадающие в уже загруженное окно.
+
+    Куча и курсор принадлежат потоку диспетчера, и запросы к базе он выполняет
+    без блокировки: add() из цикла событий только кладет ключ в список _added
+    под короткой блокировкой, а поток разбирает его после очередной подгрузки окна.
+    """
+
+    def __init__(self, db, fire_batch, window=300, max_loaded=50000, poll_interval=None, clock=time.time):
+        self.db = db
+        self.fire_batch = fire_batch
+        self.window = window
+        self.max_loaded = max_loaded
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._heap = []
+        # Всё с ключом (due_at, id) <= _cursor уже загружено в кучу или отправлено
+        self._cursor = (float('-inf'), 0)
+        self._cond = threading.Condition()
+        # Ключи (due_at, id) из add() и add_range(), еще не разобранные потоком; защищены _cond
+        self._added = []
+        self._thread = None
+        self._stopping = False
+        # Наибольший id, уже просмотренный _poll_new
+        self._last_id = None
+        self._next_poll = 0.0
+        self.fired = 0
+        self.last_skew = 0.0
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='reminder-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def loaded(self):
+        """Сколько напоминаний сейчас в окне."""
+        return len(self._heap)
+
+    def add(self, reminder_id, due_at):
+        """Сообщает о новом напоминании, уже сохраненном в базе."""
+        if self._thread is None:
+            # Диспетчер не запущен (процесс не лидер): напоминание найдет _poll_new лидера
+            return
+        with self._cond:
+            self._added.append((due_at, reminder_id))
+            self._cond.notify()
+
+    def add_range(self, first_id, last_id):
+        """Сообщает о пачке напоминаний с id в [first_id, last_id], уже сохраненных в базе (массовый импорт).
+
+        Курсор потока не бывает дальше now + window, поэтому достаточно напоминаний до этой границы;
+        остальные подгрузит refill.
+        """
+        if self._thread is None:
+            return
+        rows = self.db.query(
+            'SELECT due_at, id FROM reminders WHERE id BETWEEN ? AND ? AND due_at <= ?',
+            (first_id, last_id, self.clock() + self.window)
+        )
+        if rows:
+            with self._cond:
+                self._added.extend(rows)
+                self._cond.notify()
+
+    def _take_added(self):
+        """Переносит в кучу добавленные напоминания, попадающие в загруженное окно. Вызывается под _cond.
+
+        Разбирается после подгрузки окна: ключ за курсором точно закоммичен до следующего refill и попадет в него,
+        а ключ, который refill уже загрузил, повторно в куче безвреден — _take_due собирает id во множество.
+        """
+        added, self._added = self._added, []
+        for key in added:
+            if key <= self._cursor:
+                heapq.heappush(self._heap, key)
+
+    def _refill(self, now):
+        """Догружает окно [курсор, now + window] из индекса due_at."""
+        limit = self.max_loaded - len(self._heap)
+        bound = now + self.window
+        if limit <= 0 or self._cursor >= (bound, MAX_ID):
+            return
+        due_from, id_from = self._cursor
+        rows = self.db.query(
+            'SELECT due_at, id FROM reminders WHERE (due_at, id) > (?, ?) AND due_at <= ? '
+            'ORDER BY due_at, id LIMIT ?',
+            (max(due_from, -MAX_ID), id_from, bound, limit)
+        )
+        for row in rows:
+            heapq.heappush(self._heap, row)
+        if len(rows) < limit:
+            self._cursor = (bound, MAX_ID)
+        else:
+            self._cursor = rows[-1]
+
+    def _poll_new(self):
+        """Загружает в кучу напоминания, добавленные в базу после прошлой проверки, если они уже в окне."""
+        if self._last_id is None:
+            # Всё, что было в таблице до первого запуска, подгружает _refill
+            self._last_id = self.db.query_one('SELECT COALESCE(MAX(id), 0) FROM reminders')[0]
+            return
+        while True:
+            rows = self.db.query(
+                'SELECT id, due_at FROM reminders WHERE id > ? ORDER BY id LIMIT 1000', (self._last_id,))
+            for reminder_id, due_at in rows:
+                if (due_at, reminder_id) <= self._cursor:
+                    heapq.heappush(self._heap, (due_at, reminder_id))
+            if rows:
+                self._last_id = rows[-1][0]
+            if len(rows) < 1000:
+                return
+
+    def _take_due(self, now):
+        ids = set()
+        while self._heap and self._heap[0][0] <= now:
+            ids.add(heapq.heappop(self._heap)[1])
+        return ids
+
+    def _fire(self, ids, now):
+        rows = []
+        ids = list(ids)
+        # Забираем строки и удаляем их одной транзакцией; чанки — из-за лимита параметров SQLite
+        with self.db.transaction() as conn:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                rows.extend(conn.execute(
+                    f'SELECT id, chat_id, text, attachments, due_at FROM reminders WHERE id IN ({marks})', chunk
+                ).fetchall())
+                conn.execute(f'DELETE FROM reminders WHERE id IN ({marks})', chunk)
+        if not rows:
+            return
+        rows = [
+            (reminder_id, chat_id, text, json.loads(attachments) if attachments else [], due_at)
+            for reminder_id, chat_id, text, attachments, due_at in rows
+        ]
+        self.fired += len(rows)
+        self.last_skew = now - min(row[4] for row in rows)
+        try:
+            self.fire_batch(rows)
+        except Exception as e:
+            logger.error("Ошибка при отправке пачки напоминаний: %s", e)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+            now = self.clock()
+            # Запросы идут без блокировки, чтобы add() не ждал их в цикле событий
+            try:
+                if self.poll_interval is not None and now >= self._next_poll:
+                    self._poll_new()
+                    self._next_poll = now + self.poll_interval
+                if self._cursor[0] < now + self.window / 2:
+                    self._refill(now)
+            except Exception as e:
+                logger.error("Ошибка при загрузке окна напоминаний: %s", e)
+            with self._cond:
+                self._take_added()
+                due = self._take_due(now)
+                if not due:
+                    # Спим до ближайшего напоминания, но не дольше четверти окна
+                    timeout = self.window / 4 if self.poll_interval is None else min(self.window / 4, self.poll_interval)
+                    if self._heap:
+                        timeout = min(timeout, self._heap[0][0] - now)
+                    self._cond.wait(max(timeout, 0.01))
+                    continue
+            self._fire(due, now)
@@ -0,0 +1,70 @@
+"""Таблица маршрутов для callback_data inline-кнопок.
+
+Для каждого состояния диалога хранится словарь callback_data -> (обработчик,
+аргументы). Параметрические кнопки ('schedule_Monday', 'subscription_Sport')
+раскрываются в точные ключи при регистрации, поэтому параметр разбирается один
+раз при старте, а не на каждом нажатии. Кнопки с произвольным хвостом
+('tasks_after:<time>:<id>') ищутся по префиксу до первого ':'. Поиск
+обработчика — одно-два обращения к словарю вместо перебора регулярных
+выражений. Из тех же записей строятся клавиатуры меню, так что кнопка не может
+оказаться без обработчика.
+"""
+
+_EMPTY = {}
+
+
+class CallbackRouter:
+    def __init__(self):
+        # состояние -> {callback_data: (обработчик, аргументы)}
+        self._exact = {}
+        # состояние -> {префикс: (обработчик, аргументы)}; хвост после ':' добавляется последним аргументом
+        self._prefixed = {}
+        # меню -> [(подпись, callback_data)]
+        self._menus = {}
+
+    def add(self, states, data, handler, *args, label=None, menu=None):
+        """Регистрирует кнопку data в состояниях states; нажатие вызывает handler(update, context, *args)."""
+        for state in states:
+            table = self._exact.setdefault(state, {})
+            if data in table:
+                raise ValueError(f"callback_data {data!r} уже зарегистрирована в состоянии {state}")
+            table[data] = (handler, args)
+        if menu is not None:
+            self._menus.setdefault(menu, []).append((label, data))
+
+    def add_choice(self, states, prefix, handler, choices, menu=None):
+        """Регистрирует семейство кнопок f'{prefix}_{value}' из choices {value: подпись}; handler получает value."""
+        for value, label in choices.items():
+            self.add(states, f'{prefix}_{value}', handler, value, label=label, menu=menu)
+
+    def add_prefix(self, states, prefix, handler, *args):
+        """Регистрирует кнопки вида f'{prefix}:<хвост>'; handler получает *args и хвост."""
+        for state in states:
+            table = self._prefixed.setdefault(state, {})
+            if prefix in table:
+                raise ValueError(f"Префикс {prefix!r} уже зарегистрирован в состоянии {state}")
+            table[prefix] = (handler, args)
+
+    def resolve(self, state, data):
+        """Возвращает (обработчик, аргументы) для нажатия data в состоянии state или None."""
+        route = self._exact.get(state, _EMPTY).get(data)
+        if route is not None:
+            return route
+        prefix, sep, rest = data.partition(':')
+        if sep:
+            route = self._prefixed.get(state, _EMPTY).get(prefix)
+            if route is not None:
+                return route[0], route[1] + (rest,)
+        return None
+
+    def matches(self, state, data):
+        """Есть ли у кнопки обработчик в состоянии state."""
+        return isinstance(data, str) and self.resolve(state, data) is not None
+
+    def states(self):
+        return self._exact.keys() | self._prefixed.keys()
+
+    def menu(self, name, columns=1):
+        """Кнопки меню построчно: [[(подпись, callback_data), ...], ...]."""
+        buttons = self._menus.get(name, [])
+        return [buttons[i:i + columns] for i in range(0, len(buttons), columns)]
@@ -0,0 +1,119 @@
+"""Полнотекстовый поиск по задачам, быстрым заметкам и подпискам (SQLite FTS5).
+
+Индексы tasks_fts и subscriptions_fts — FTS5 с внешним содержимым: текст
+хранится только в самих таблицах (через представления tasks_search и
+subscriptions_search), а индексы поддерживаются триггерами на вставку,
+изменение и удаление. Владелец строки индексируется отдельной колонкой owner
+(токен «u<user_id>», см. owner_token), поэтому запрос «owner:u<id> AND ...»
+пересекает списки документов внутри FTS и не перебирает совпадения других
+пользователей.
+Сортировка по колонке rank (bm25 с весами, заданными в миграции) выполняется
+внутри FTS5, поэтому сниппеты строятся только для LIMIT выданных строк, а не
+для всех совпадений. Чтобы частое слово у пользователя с десятками тысяч
+заметок не заставляло считать bm25 для каждой, ранжируются только
+RANK_WINDOW самых новых совпадений: граница по rowid находится обходом
+индекса в обратном порядке, без ранжирования.
+
+Пользовательский текст разбивается на слова, каждое ищется как префикс
+("слово"*) в текстовых колонках; результаты упорядочены по bm25 (совпадение в
+топике весит больше, чем в описании), а найденные слова выделяются в
+сниппетах.
+"""
+import html
+import re
+
+from views import MESSAGE_LIMIT, telegram_length
+
+# Сколько результатов каждого вида показывать
+LIMIT = 10
+# Больше слов в запросе не учитываем: длинный запрос почти ничего не найдет, а пересечение дорогое
+MAX_TERMS = 8
+# Сколько самых новых совпадений ранжировать по bm25
+RANK_WINDOW = 500
+# Длина сниппета в токенах: топик показываем почти целиком, из описания — окрестность совпадения
+TOPIC_TOKENS = 32
+SNIPPET_TOKENS = 12
+
+# Границы выделения в сниппете; заменяются на теги после экранирования HTML
+_OPEN, _CLOSE = '\x02', '\x03'
+_WORD = re.compile(r'\w+')
+
+TASKS_SQL = (
+    "SELECT t.time, snippet(tasks_fts, 1, :open, :close, '…', :topic_tokens), "
+    "snippet(tasks_fts, 2, :open, :close, '…', :tokens) "
+    'FROM tasks_fts JOIN tasks t ON t.id = tasks_fts.rowid '
+    'WHERE tasks_fts MATCH :query AND tasks_fts.rowid >= :floor ORDER BY tasks_fts.rank LIMIT :limit'
+)
+SUBSCRIPTIONS_SQL = (
+    "SELECT s.category, snippet(subscriptions_fts, 1, :open, :close, '…', :tokens) "
+    'FROM subscriptions_fts JOIN subscriptions s ON s.id = subscriptions_fts.rowid '
+    'WHERE subscriptions_fts MATCH :query AND subscriptions_fts.rowid >= :floor '
+    'ORDER BY subscriptions_fts.rank LIMIT :limit'
+)
+# rowid совпадения номер RANK_WINDOW с конца; имя таблицы подставляется из констант ниже
+FLOOR_SQL = 'SELECT rowid FROM {table} WHERE {table} MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?'
+# LIKE-поиск без индекса: для сравнения в benchmarks/bench_search.py
+LIKE_TASKS_SQL = (
+    'SELECT time, topic, description FROM tasks '
+    'WHERE user_id = ? AND (topic LIKE ? OR description LIKE ?) LIMIT ?'
+)
+
+
+def owner_token(user_id):
+    """Токен владельца в колонке owner: 'u<id>', у отрицательных id групповых чатов минус заменен на 'n'."""
+    return f'u{int(user_id)}'.replace('-', 'n')
+
+
+def match_query(user_id, text, columns):
+    """Запрос FTS5 для слов из text в колонках columns строк владельца user_id; None, если слов нет."""
+    words = _WORD.findall(text.lower())[:MAX_TERMS]
+    if not words:
+        return None
+    terms = ' '.join(f'"{word}"*' for word in words)
+    return f'owner:{owner_token(user_id)} AND {{{" ".join(columns)}}}: ({terms})'
+
+
+def _marked(text):
+    """Экранирует HTML и превращает границы выделения в <b>."""
+    return html.escape(text or '').replace(_OPEN, '<b>').replace(_CLOSE, '</b>')
+
+
+def _floor(db, table, query):
+    """Наименьший rowid среди RANK_WINDOW самых новых совпадений (0, если совпадений меньше)."""
+    row = db.query_one(FLOOR_SQL.format(table=table), (query, RANK_WINDOW - 1))
+    return row[0] if row else 0
+
+
+def search(db, user_id, text, limit=LIMIT):
+    """Ищет text среди задач и подписок пользователя. Возвращает (задачи, подписки) или None без слов."""
+    params = {'open': _OPEN, 'close': _CLOSE, 'topic_tokens': TOPIC_TOKENS, 'tokens': SNIPPET_TOKENS, 'limit': limit}
+    tasks_query = match_query(user_id, text, ('topic', 'description'))
+    if tasks_query is None:
+        return None
+    tasks = db.query(TASKS_SQL, {**params, 'query': tasks_query, 'floor': _floor(db, 'tasks_fts', tasks_query)})
+    subscriptions_query = match_query(user_id, text, ('content',))
+    subscriptions = db.query(SUBSCRIPTIONS_SQL, {
+        **params, 'query': subscriptions_query, 'floor': _floor(db, 'subscriptions_fts', subscriptions_query)
+    })
+    return tasks, subscriptions
+
+
+def render_results(text, tasks, subscriptions):
+    """Сообщение с результатами поиска в HTML."""
+    if not tasks and not subscriptions:
+        return f'🔎 По запросу «{html.escape(text)}» ничего не найдено.'
+    lines = [f'🔎 <b>Результаты по запросу «{html.escape(text)}»:</b>', '']
+    for time_str, topic, description in tasks:
+        line = f"• 📝 {_marked(topic)}" + (f" — {time_str}" if time_str else '')
+        if description:
+            line += f"\n  {_marked(description)}"
+        lines.append(line)
+    if subscriptions:
+        lines += ['', '📬 <b>Подписки:</b>']
+        lines += [f"• {html.escape(category)}: {_marked(content)}" for category, content in subscriptions]
+    message = '\n'.join(lines)
+    # Сниппеты ограничены по токенам, но не по символам: при длинных словах отбрасываем последние строки
+    while telegram_length(message) > MESSAGE_LIMIT and len(lines) > 3:
+        lines.pop(-1)
+        message = '\n'.join(lines)
+    return message
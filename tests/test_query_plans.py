@@ -0,0 +1,24 @@
+"""Горячие запросы идут по индексам: регрессия планировщика или пропавший индекс роняет тест."""
+import pytest
+
+from db import Database
+from migrations import HOT_QUERIES, check_query_plans, explain, migrate, uses_index
+
+
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    db = Database(str(tmp_path_factory.mktemp('plans') / 'tasks.db'))
+    migrate(db)
+    yield db.conn
+    db.close_all()
+
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_query_uses_index(conn, name):
+    plan, ok = check_query_plans(conn, {name: HOT_QUERIES[name]})[name]
+    assert ok, f"{name}: {' | '.join(plan)}"
+
+
+def test_full_scan_is_rejected(conn):
+    assert not uses_index(explain(conn, 'SELECT * FROM tasks WHERE description = ?', ('x',)))
+    assert not uses_index(explain(conn, 'SELECT * FROM tasks WHERE user_id = ? ORDER BY description', (1,)))
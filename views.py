@@ -0,0 +1,150 @@
+"""Постраничные представления списков пользователя.
+
+Страница «Мои задачи» выбирается keyset-пагинацией по (time, id) через индекс
+idx_tasks_user_time: читается не больше PAGE_ROWS + 1 строк, а сама страница
+обрезается по длине отрисованного текста, чтобы уложиться в лимит Telegram на
+одно сообщение. Время отрисовки страницы не зависит от общего числа задач.
+
+Выборки «сегодня», «эта неделя» и «просроченные» идут одним проходом по
+диапазону индекса idx_tasks_user_due (user_id, due_at); due_at — UTC timestamp,
+у заметок без напоминания он NULL, и в диапазоны они не попадают.
+"""
+from datetime import datetime, time, timedelta
+
+# Telegram ограничивает сообщение 4096 символами (в единицах UTF-16)
+MESSAGE_LIMIT = 4096
+# Запас под заголовок страницы
+PAGE_BUDGET = MESSAGE_LIMIT - 200
+# Сколько строк читать из базы на одну страницу
+PAGE_ROWS = 50
+# Длинные поля задачи обрезаются, чтобы одна задача всегда помещалась на страницу
+MAX_FIELD_LENGTH = 1000
+
+TASKS_HEADER = '📋 <b>Ваши задачи:</b>\n\n'
+
+_FORWARD_SQL = (
+    'SELECT id, topic, description, attachments, time FROM tasks '
+    'WHERE user_id = ? AND (time, id) > (?, ?) ORDER BY time, id LIMIT ?'
+)
+_BACKWARD_SQL = (
+    'SELECT id, topic, description, attachments, time FROM tasks '
+    'WHERE user_id = ? AND (time, id) < (?, ?) ORDER BY time DESC, id DESC LIMIT ?'
+)
+_RANGE_SQL = (
+    'SELECT id, topic, description, attachments, time FROM tasks '
+    'WHERE user_id = ? AND due_at >= ? AND due_at < ? ORDER BY due_at, id LIMIT ?'
+)
+# Просроченные — самые недавние первыми
+_OVERDUE_SQL = (
+    'SELECT id, topic, description, attachments, time FROM tasks '
+    'WHERE user_id = ? AND due_at < ? ORDER BY due_at DESC, id DESC LIMIT ?'
+)
+
+# Выборки по диапазону due_at: имя -> заголовок страницы
+RANGE_HEADERS = {
+    'today': '📅 <b>Задачи на сегодня:</b>\n\n',
+    'week': '🗓️ <b>Задачи на эту неделю:</b>\n\n',
+    'overdue': '⏰ <b>Просроченные задачи:</b>\n\n',
+}
+
+
+def telegram_length(text):
+    """Длина текста так, как ее считает Telegram (единицы UTF-16)."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _clip(value):
+    if value and len(value) > MAX_FIELD_LENGTH:
+        return value[:MAX_FIELD_LENGTH] + '…'
+    return value
+
+
+def render_task(topic, attachments, time_str):
+    text = f"• 📝 <b>Топик:</b> {_clip(topic)}\n  ⏰ <b>Время:</b> {time_str}\n"
+    if attachments:
+        text += f"  📎 <b>Прикрепления:</b> {_clip(attachments)}\n"
+    return text + "\n"
+
+
+def _fill(rows):
+    """Набирает задачи в страницу, пока не кончится бюджет. Возвращает (строки страницы, остались ли еще)."""
+    page, size = [], 0
+    for row in rows:
+        rendered = render_task(row[1], row[3], row[4])
+        length = telegram_length(rendered)
+        if page and size + length > PAGE_BUDGET:
+            return page, True
+        page.append((row, rendered))
+        size += length
+    return page, False
+
+
+def tasks_page(db, user_id, after=None, before=None):
+    """Возвращает страницу задач: (текст, ключ первой задачи, ключ последней, есть ли предыдущая, есть ли следующая).
+
+    after/before — ключи (time, id) соседней страницы; без них отдается первая страница.
+    Ключ страницы — None, если задач нет.
+    """
+    if before is not None:
+        rows = db.query(_BACKWARD_SQL, (user_id, before[0], before[1], PAGE_ROWS + 1))
+        page, more = _fill(rows[:PAGE_ROWS])
+        has_prev = more or len(rows) > PAGE_ROWS
+        has_next = True
+        page.reverse()
+    else:
+        key = after if after is not None else ('', -1)
+        # Задачи с пустым временем сортируются первыми; (time, id) > ('', -1) их тоже включает
+        rows = db.query(_FORWARD_SQL, (user_id, key[0], key[1], PAGE_ROWS + 1))
+        page, more = _fill(rows[:PAGE_ROWS])
+        has_prev = after is not None
+        has_next = more or len(rows) > PAGE_ROWS
+    if not page:
+        return None, None, None, has_prev, False
+    text = TASKS_HEADER + ''.join(rendered for _, rendered in page)
+    first, last = page[0][0], page[-1][0]
+    return text, (first[4], first[0]), (last[4], last[0]), has_prev, has_next
+
+
+def range_bounds(view, now, timezone):
+    """Границы [start, end) выборки view в UTC timestamp; now — текущее время в часовом поясе timezone."""
+    midnight = timezone.localize(datetime.combine(now.date(), time.min))
+    if view == 'today':
+        start, end = midnight, timezone.localize(datetime.combine(now.date() + timedelta(days=1), time.min))
+    elif view == 'week':
+        monday = now.date() - timedelta(days=now.weekday())
+        start = timezone.localize(datetime.combine(monday, time.min))
+        end = timezone.localize(datetime.combine(monday + timedelta(days=7), time.min))
+    elif view == 'overdue':
+        return None, int(now.timestamp())
+    else:
+        raise ValueError(f"Неизвестная выборка задач: {view}")
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def range_page(db, user_id, view, start, end):
+    """Задачи выборки view с due_at в [start, end) (для 'overdue' — до end). Возвращает (текст или None, есть ли еще)."""
+    if view == 'overdue':
+        rows = db.query(_OVERDUE_SQL, (user_id, end, PAGE_ROWS + 1))
+    else:
+        rows = db.query(_RANGE_SQL, (user_id, start, end, PAGE_ROWS + 1))
+    page, more = _fill(rows[:PAGE_ROWS])
+    if not page:
+        return None, False
+    return RANGE_HEADERS[view] + ''.join(rendered for _, rendered in page), more or len(rows) > PAGE_ROWS
+
+
+def encode_page_key(kind, key):
+    """callback_data для кнопки листания: 'tasks_after:<time>:<id>' или 'tasks_before:<time>:<id>'."""
+    return f'tasks_{kind}:{key[0]}:{key[1]}'
+
+
+def parse_page_key(rest):
+    """Разбирает хвост callback_data кнопки листания '<time>:<id>' в ключ (time, id)."""
+    time_str, task_id = rest.rsplit(':', 1)
+    return time_str, int(task_id)
+
+
+def decode_page_key(data):
+    """Разбирает callback_data кнопки листания в ('after' | 'before', (time, id))."""
+    prefix, rest = data.split(':', 1)
+    return prefix[len('tasks_'):], parse_page_key(rest)
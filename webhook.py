@@ -0,0 +1,111 @@
+"""Встроенный HTTP-сервер для приёма обновлений Telegram через вебхук.
+
+Сервер на asyncio-потоках без внешних зависимостей: принимает POST на
+заданный путь, сверяет заголовок X-Telegram-Bot-Api-Secret-Token и передаёт
+JSON обновления в on_update. Если on_update вернул False (очередь обновлений
+заполнена), отвечает 503 — Telegram повторит доставку позже, а память бота
+остаётся ограниченной. Соединения keep-alive обслуживаются в цикле.
+"""
+import asyncio
+import hmac
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large', 503: 'Service Unavailable',
+}
+
+
+class WebhookServer:
+    """HTTP-сервер вебхука. on_update(data) -> bool: True, если обновление принято в очередь."""
+
+    def __init__(self, on_update, path='/telegram', secret_token='', host='0.0.0.0', port=8443,
+                 max_body=1024 * 1024, idle_timeout=75):
+        self.on_update = on_update
+        self.path = path
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self._server = None
+        self.accepted = 0
+        self.rejected = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Вебхук слушает %s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await self._respond(writer, 400, close=True)
+                    break
+                if length > self.max_body:
+                    await self._respond(writer, 413, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, self._dispatch(method, target, headers, body), close=not keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _dispatch(self, method, target, headers, body):
+        if target.split('?', 1)[0] != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if self.secret_token and not hmac.compare_digest(
+                headers.get(SECRET_HEADER, '').encode(), self.secret_token.encode()):
+            logger.warning("Запрос к вебхуку с неверным секретным токеном.")
+            return 403
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+        if not self.on_update(data):
+            self.rejected += 1
+            return 503
+        self.accepted += 1
+        return 200
+
+    @staticmethod
+    async def _respond(writer, status, close=False):
+        writer.write(
+            f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: 0\r\n'
+            f'Connection: {"close" if close else "keep-alive"}\r\n\r\n'.encode('latin-1')
+        )
+        await writer.drain()
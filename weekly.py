@@ -0,0 +1,110 @@
+"""Исполнение недельного расписания из таблицы schedules.
+
+Вместо отдельной cron-задачи на каждую строку диспетчер вычисляет ближайший
+слот (день недели, час), спит до его начала и забирает пользователей этого
+слота keyset-страницами по индексу idx_schedules_day_hour_user: сначала до
+batch_size следующих user_id, затем все их строки. Каждая страница читается
+целиком и курсор закрывается до отправки, поэтому долгая отправка большого
+слота под лимитом исходящих не держит снимок WAL и не мешает checkpoint.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+SLOT_USERS_SQL = (
+    'SELECT DISTINCT user_id FROM schedules WHERE day = ? AND hour = ? AND user_id > ? ORDER BY user_id LIMIT ?'
+)
+SLOT_SQL = (
+    'SELECT user_id, time_of_day, hour, task FROM schedules '
+    'WHERE day = ? AND hour = ? AND user_id BETWEEN ? AND ? ORDER BY user_id'
+)
+# Меньше любого chat_id Telegram
+MIN_USER_ID = -(2 ** 63)
+
+
+def next_slot(now, timezone):
+    """Возвращает (timestamp начала следующего часа, день недели, час) в часовом поясе timezone."""
+    local = datetime.fromtimestamp(now, timezone)
+    hour_start = now - (local.minute * 60 + local.second + local.microsecond / 1e6)
+    start = hour_start + 3600
+    slot = datetime.fromtimestamp(start, timezone)
+    return start, DAYS[slot.weekday()], slot.hour
+
+
+def slot_pages(db, day, hour, batch_size=1000):
+    """Отдаёт задачи слота страницами до batch_size пользователей: [(user_id, [(time_of_day, hour, task), ...]), ...].
+
+    Между страницами курсоров не остается: каждая страница — два коротких запроса после последнего user_id.
+    """
+    after = MIN_USER_ID
+    while True:
+        user_ids = [row[0] for row in db.query(SLOT_USERS_SQL, (day, hour, after, batch_size))]
+        if not user_ids:
+            return
+        page = {}
+        for user_id, time_of_day, row_hour, task in db.query(SLOT_SQL, (day, hour, user_ids[0], user_ids[-1])):
+            page.setdefault(user_id, []).append((time_of_day, row_hour, task))
+        yield list(page.items())
+        if len(user_ids) < batch_size:
+            return
+        after = user_ids[-1]
+
+
+class WeeklyScheduleDispatcher:
+    """Поток, отправляющий задачи недельного расписания в начале каждого занятого часа.
+
+    fire_batch(day, hour, users) получает пачку до batch_size пользователей
+    в виде списка (user_id, [(time_of_day, hour, task), ...]).
+    """
+
+    def __init__(self, db, fire_batch, timezone, batch_size=1000, clock=time.time):
+        self.db = db
+        self.fire_batch = fire_batch
+        self.timezone = timezone
+        self.batch_size = batch_size
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+        self.fired = 0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='weekly-schedule', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def fire_slot(self, day, hour):
+        """Отправляет все задачи слота пачками. Возвращает число пользователей."""
+        users = 0
+        for batch in slot_pages(self.db, day, hour, self.batch_size):
+            if batch:
+                self.fire_batch(day, hour, batch)
+                users += len(batch)
+        self.fired += users
+        return users
+
+    def _run(self):
+        while not self._stop.is_set():
+            start, day, hour = next_slot(self.clock(), self.timezone)
+            # Ждём начала слота; после пробуждения сверяемся с часами заново
+            while not self._stop.is_set() and self.clock() < start:
+                self._stop.wait(min(start - self.clock(), 60))
+            if self._stop.is_set():
+                return
+            try:
+                users = self.fire_slot(day, hour)
+                if users:
+                    logger.info("Отправлено расписание %s %s:00 для пользователей: %s", day, hour, users)
+            except Exception as e:
+                logger.error("Ошибка при отправке расписания %s %s:00: %s", day, hour, e)
@@ -0,0 +1,193 @@
+"""Отложенная запись с групповым коммитом.
+
+Обработчики ставят записи в очередь, отдельный поток забирает всё, что
+накопилось за время предыдущего коммита, и применяет одной транзакцией:
+подряд идущие записи с одинаковым SQL сливаются в один executemany.
+Если предыдущий пакет был больше одной записи — пишут несколько обработчиков
+сразу, — поток ждёт не более max_delay секунд, пока новый пакет не наберёт
+столько же записей: обработчики, только что получившие свой COMMIT, успевают
+поставить следующие записи в ту же транзакцию. Одиночная запись при этом
+коммитится сразу, без задержки.
+Каждая запись получает Future, который завершается после COMMIT — обработчик
+дожидается его перед ответом пользователю, поэтому следующий запрос того же
+пользователя уже видит свои данные.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _Job:
+    __slots__ = ('sql', 'rows', 'fn', 'future')
+
+    def __init__(self, sql=None, rows=None, fn=None):
+        self.sql = sql
+        self.rows = rows
+        self.fn = fn
+        self.future = Future()
+
+
+class WriteBehindWriter:
+    """Поток-писатель, объединяющий записи в групповые транзакции."""
+
+    def __init__(self, db, max_delay=0.002, max_batch=1000):
+        self.db = db
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self.batches = 0
+        self.jobs = 0
+        # Размер предыдущего пакета — сколько записей ждать в следующем
+        self._target = 1
+        # observe(sql, seconds) получает время каждой группы и (с sql='COMMIT') всей транзакции пакета
+        self.observe = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Дописывает очередь и останавливает поток."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def write(self, sql, params=()):
+        """Ставит в очередь одну запись."""
+        return self._submit(_Job(sql=sql, rows=[params]))
+
+    def write_many(self, sql, rows):
+        """Ставит в очередь пакет строк для executemany."""
+        return self._submit(_Job(sql=sql, rows=list(rows)))
+
+    def call(self, fn):
+        """Ставит в очередь функцию fn(conn), выполняемую внутри групповой транзакции.
+
+        Результат функции становится результатом Future — так можно, например,
+        получить lastrowid вставленной строки.
+        """
+        return self._submit(_Job(fn=fn))
+
+    def _submit(self, job):
+        if self._thread is None:
+            raise RuntimeError('Поток записи не запущен')
+        self._queue.put(job)
+        return job.future
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            batch = [job]
+            stop = False
+            # Забираем всё, что накопилось, пока шёл предыдущий коммит; пока пакет
+            # меньше предыдущего, ждём новых записей не дольше max_delay от начала
+            deadline = time.monotonic() + self.max_delay
+            try:
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic() if len(batch) < self._target else 0
+                    job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                    if job is _STOP:
+                        stop = True
+                        break
+                    batch.append(job)
+            except queue.Empty:
+                pass
+            self._target = len(batch)
+            self._commit(batch)
+            if stop:
+                # Всё, что пришло до _STOP, уже в пакете; дописываем остатки
+                self._drain()
+                return
+
+    def _drain(self):
+        rest = []
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not _STOP:
+                rest.append(job)
+        if rest:
+            self._commit(rest)
+
+    @staticmethod
+    def _group(batch):
+        """Сливает подряд идущие записи с одинаковым SQL в одну группу."""
+        groups = []
+        for job in batch:
+            if job.fn is None and groups and groups[-1][0].fn is None and groups[-1][0].sql == job.sql:
+                groups[-1].append(job)
+            else:
+                groups.append([job])
+        return groups
+
+    def _apply(self, conn, group):
+        started = time.perf_counter()
+        if group[0].fn is not None:
+            result = group[0].fn(conn)
+            sql = 'CALL'
+        else:
+            rows = [row for job in group for row in job.rows]
+            conn.executemany(group[0].sql, rows)
+            result = None
+            sql = group[0].sql
+        if self.observe is not None:
+            self.observe(sql, time.perf_counter() - started)
+        return result
+
+    def _apply_isolated(self, conn, group, results):
+        """Применяет группу под SAVEPOINT; при ошибке повторяет записи по одной."""
+        conn.execute('SAVEPOINT write_behind')
+        try:
+            result = self._apply(conn, group)
+        except Exception as e:
+            conn.execute('ROLLBACK TO write_behind')
+            conn.execute('RELEASE write_behind')
+            if len(group) > 1:
+                for job in group:
+                    self._apply_isolated(conn, [job], results)
+            else:
+                logger.error("Ошибка отложенной записи: %s", e)
+                results[id(group[0])] = (False, e)
+            return
+        conn.execute('RELEASE write_behind')
+        for job in group:
+            results[id(job)] = (True, result)
+
+    def _commit(self, batch):
+        results = {}
+        # Future, от которого уже отказались (cancel), результат не получает, но запись все равно применяется;
+        # после set_running_or_notify_cancel отменить Future нельзя, поэтому set_result не упадет
+        waiting = [job for job in batch if job.future.set_running_or_notify_cancel()]
+        started = time.perf_counter()
+        try:
+            with self.db.transaction() as conn:
+                for group in self._group(batch):
+                    self._apply_isolated(conn, group, results)
+        except Exception as e:
+            logger.error("Ошибка группового коммита (%s записей): %s", len(batch), e)
+            for job in waiting:
+                job.future.set_exception(e)
+            return
+        self.batches += 1
+        self.jobs += len(batch)
+        if self.observe is not None:
+            self.observe('COMMIT', time.perf_counter() - started)
+        for job in waiting:
+            ok, value = results[id(job)]
+            if ok:
+                job.future.set_result(value)
+            else:
+                job.future.set_exception(value)